@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Throughput benchmark for geocachingsitelib and gc_get_spoiler_pics.py
+# against the offline stand-in server in fakesite.py.
+# Reports operations and HTTP requests per second, latency percentiles
+# and the tracemalloc peak of every benchmarked operation.
+
+import sys
+import os
+import io
+import json
+import time
+import atexit
+import getopt
+import shutil
+import runpy
+import tempfile
+import tracemalloc
+import contextlib
+
+benchmark_dir_ = os.path.dirname(os.path.abspath(__file__))
+gctools_dir_ = os.path.dirname(benchmark_dir_)
+sys.path.insert(0, gctools_dir_)
+
+import geocachingsitelib as gc
+import fakesite
+
+def usage():
+    print("Benchmark geocachingsitelib against an offline stand-in of geocaching.com")
+    print("\nSyntax:")
+    print("   %s [options] [benchmark ...]" % (sys.argv[0]))
+    print("\nBenchmarks:")
+    print("   " + ", ".join(benchmarks_.keys()) + " (default: all)")
+    print("\nOptions:")
+    print("   -n <num>    | --iterations <num>     Calls per benchmark, default 50")
+    print("   -m <num>    | --memory-iterations <num> Calls traced with tracemalloc, default 5")
+    print("   -c <num>    | --caches <num>         Caches in the spoiler-pics pocketquery, default 50")
+    print("   -t <num>    | --threads <num>        --threads given to gc_get_spoiler_pics.py, default 0")
+    print("   -l <sec>    | --latency <sec>        Server side latency per response")
+    print("   -j <sec>    | --jitter <sec>         Random extra server side latency")
+    print("   -e <rate>   | --error-rate <rate>    Fraction of responses that are HTTP 500")
+    print("   -x <rate>   | --expire-rate <rate>   Fraction of requests that expire the login session")
+    print("   -o <file>   | --json <file>          Also write results as JSON to <file>")
+    print("   -h          | --help                 Show this Help")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def tempDir():
+    d = tempfile.mkdtemp(prefix="gctools-bench-")
+    atexit.register(shutil.rmtree, d, True)
+    return d
+
+
+class BenchContext(object):
+    def __init__(self, site, threads, num_caches):
+        self.site = site
+        self.threads = threads
+        self.num_caches = num_caches
+        self.workdir = tempDir()
+        self.gccodes = [fakesite.gccodeFromString("cache%d" % i) for i in range(num_caches)]
+        self.guids = [fakesite.guidFromString("cache%d" % i) for i in range(num_caches)]
+        self.pquids = None
+        self.fieldnotes = None
+        self.usertokens = None
+        self.counter = 0
+
+    def next(self, lst):
+        self.counter += 1
+        return lst[self.counter % len(lst)]
+
+
+def benchDownloadGPX(ctx):
+    gc.download_gpx(ctx.next(ctx.gccodes), ctx.workdir)
+
+def benchDownloadPQ(ctx):
+    if ctx.pquids is None:
+        ctx.pquids = list(gc.get_pq_names().values())
+    gc.download_pq(ctx.next(ctx.pquids), ctx.workdir)
+
+def benchGetGCVotes(ctx):
+    gc.get_gcvotes(ctx.guids)
+
+def benchSubmitLog(ctx):
+    if ctx.fieldnotes is None:
+        ctx.fieldnotes = gc.get_fieldnotes()
+    fn = ctx.next(ctx.fieldnotes)
+    gc.submit_log(fn.loguri, "Benchmark log for %s" % fn.name)
+
+def benchUpdateCoordinates(ctx):
+    # all caches of the context, usertokens are reused after the first call
+    if ctx.usertokens is None:
+        ctx.usertokens = {}
+    coords = dict([(gccode, (48.0 + i / 1000.0, 16.0 + ctx.counter / 1000.0)) for (i, gccode) in enumerate(ctx.gccodes)])
+    ctx.counter += 1
+    gc.update_coordinates_bulk(coords, ctx.usertokens, threads=max(1, ctx.threads))
+
+def writeSpoilerPicsPQ(ctx, filename):
+    site = fakesite.FakeSite(ctx.site.config)
+    with open(filename, "w", encoding="utf-8") as fh:
+        for (i, gccode) in enumerate(ctx.gccodes):
+            gpx = site.renderCacheGPX(gccode, url="%s/seek/cache_details.aspx?guid=%s" % (ctx.site.base_url, ctx.guids[i]))
+            (head, _, rest) = gpx.partition("<wpt ")
+            (wpt, _, tail) = rest.partition("</wpt>")
+            if i == 0:
+                fh.write(head)
+            fh.write("<wpt " + wpt + "</wpt>\n  ")
+        fh.write(tail)
+
+def benchSpoilerPics(ctx):
+    # a full gc_get_spoiler_pics.py run, in-process so it uses the redirected geocachingsitelib
+    pqfile = os.path.join(ctx.workdir, "spoilerpics.gpx")
+    if not os.path.exists(pqfile):
+        writeSpoilerPicsPQ(ctx, pqfile)
+    savedir = tempDir()
+    argv = sys.argv
+    sys.argv = [os.path.join(gctools_dir_, "gc_get_spoiler_pics.py"), "--savedir", savedir, "--no_geotag", "--threads", str(ctx.threads), pqfile]
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+    finally:
+        sys.argv = argv
+
+benchmarks_ = {
+    "download_gpx": benchDownloadGPX,
+    "download_pq": benchDownloadPQ,
+    "get_gcvotes": benchGetGCVotes,
+    "submit_log": benchSubmitLog,
+    "update_coordinates": benchUpdateCoordinates,
+    "spoiler_pics": benchSpoilerPics,
+}
+
+
+def runBenchmark(ctx, name, iterations, memory_iterations):
+    fun = benchmarks_[name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _runBenchmark(ctx, name, fun, iterations, memory_iterations)
+
+def _runBenchmark(ctx, name, fun, iterations, memory_iterations):
+    # warm up: login, list fetching, fixture generation
+    try:
+        fun(ctx)
+    except Exception as e:
+        gc._debug_print(name, e)
+    latencies = []
+    errors = 0
+    requests_before = ctx.site.getStats()["requests"]
+    t_start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        try:
+            fun(ctx)
+        except Exception as e:
+            errors += 1
+            gc._debug_print(name, e)
+        latencies.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - t_start
+    # -1: exclude the /_stats request itself
+    http_requests = ctx.site.getStats()["requests"] - requests_before - 1
+    tracemalloc.start()
+    for i in range(memory_iterations):
+        try:
+            fun(ctx)
+        except Exception:
+            pass
+    mem_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "benchmark": name,
+        "iterations": iterations,
+        "errors": errors,
+        "wall_s": wall,
+        "ops_per_s": iterations / wall if wall > 0 else 0.0,
+        "http_requests": http_requests,
+        "http_requests_per_s": http_requests / wall if wall > 0 else 0.0,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p90_ms": percentile(latencies, 90) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "latency_max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "mem_peak_kib": mem_peak / 1024.0,
+    }
+
+def printRequestStats(summary):
+    print("\n%-28s %6s %6s %8s %8s %9s %9s %9s" % ("request", "count", "errors", "retries", "relogins", "KiB", "mean ms", "p90 ms"))
+    for (key, s) in sorted(summary.items()):
+        print("%-28s %6d %6d %8d %8d %9.1f %9.2f %9.2f" % (key, s["count"], s["errors"], s["retries"], s["relogins"], s["bytes"] / 1024.0, s["latency_mean"] * 1000, s["latency_p90"] * 1000))
+
+def printResults(results):
+    print("%-14s %6s %6s %9s %9s %9s %9s %9s %10s" % ("benchmark", "iter", "errors", "ops/s", "http/s", "p50 ms", "p90 ms", "p99 ms", "peak KiB"))
+    for r in results:
+        print("%-14s %6d %6d %9.1f %9.1f %9.2f %9.2f %9.2f %10.1f" % (r["benchmark"], r["iterations"], r["errors"], r["ops_per_s"], r["http_requests_per_s"], r["latency_p50_ms"], r["latency_p90_ms"], r["latency_p99_ms"], r["mem_peak_kib"]))
+
+
+if __name__ == '__main__':
+    iterations_ = 50
+    memory_iterations_ = 5
+    num_caches_ = 50
+    threads_ = 0
+    json_file_ = None
+    config_ = fakesite.FakeSiteConfig()
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hn:m:c:t:l:j:e:x:o:", ["help","iterations=","memory-iterations=","caches=","threads=","latency=","jitter=","error-rate=","expire-rate=","json="])
+    except getopt.GetoptError as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    for o, a in opts:
+        if o in ["-h","--help"]:
+            usage()
+            sys.exit()
+        elif o in ["-n","--iterations"]:
+            iterations_ = int(a)
+        elif o in ["-m","--memory-iterations"]:
+            memory_iterations_ = int(a)
+        elif o in ["-c","--caches"]:
+            num_caches_ = int(a)
+        elif o in ["-t","--threads"]:
+            threads_ = int(a)
+        elif o in ["-l","--latency"]:
+            config_.latency = float(a)
+        elif o in ["-j","--jitter"]:
+            config_.jitter = float(a)
+        elif o in ["-e","--error-rate"]:
+            config_.error_rate = float(a)
+        elif o in ["-x","--expire-rate"]:
+            config_.expire_rate = float(a)
+        elif o in ["-o","--json"]:
+            json_file_ = a
+
+    unknown = set(args) - set(benchmarks_.keys())
+    if unknown:
+        print("ERROR: unknown benchmark(s): %s" % ", ".join(unknown), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    results = []
+    request_stats = gc.RequestStatsCollector()
+    gc.request_hooks.append(request_stats)
+    with fakesite.FakeSiteProcess(config_) as site:
+        fakesite.redirectSiteLib(gc, site.base_url, tempDir())
+        ctx = BenchContext(site, threads_, num_caches_)
+        for name in (args or benchmarks_.keys()):
+            # the spoiler-pics run downloads a whole pocketquery, fewer iterations suffice
+            n = max(1, iterations_ // 10) if name == "spoiler_pics" else iterations_
+            m = min(memory_iterations_, n)
+            results.append(runBenchmark(ctx, name, n, m))
+    printResults(results)
+    printRequestStats(request_stats.summary())
+    if json_file_:
+        with open(json_file_, "w") as fh:
+            json.dump({"benchmarks": results, "requests": request_stats.summary()}, fh, indent=2)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Startup-time benchmark for the gctools entry points.
+# Every entry point is started repeatedly in a fresh interpreter, once with
+# --help and, where possible, with a small offline workload. Besides the wall
+# time we report which heavy modules (network stack, GUI, ...) got imported.
+
+import sys
+import os
+import time
+import json
+import atexit
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+benchmark_dir_ = os.path.dirname(os.path.abspath(__file__))
+gctools_dir_ = os.path.dirname(benchmark_dir_)
+fixtures_dir_ = os.path.join(benchmark_dir_, "fixtures")
+
+heavy_modules_ = ["requests", "urllib3", "lxml.etree", "wx", "numpy", "http.cookiejar", "cookielib"]
+
+# run a script (or import a module) and report the heavy modules it loaded on stderr
+probe_code_ = """
+import sys, runpy
+target, args = sys.argv[1], sys.argv[2:]
+sys.path.insert(0, %(gctools_dir)r)
+try:
+    if target.endswith(".py"):
+        sys.argv = [target] + args
+        runpy.run_path(target, run_name="__main__")
+    else:
+        __import__(target)
+except SystemExit:
+    pass
+sys.stderr.write("\\nPROBE-MODULES:" + ",".join([m for m in %(heavy)r if m in sys.modules]) + "\\n")
+"""
+
+def usage():
+    print("Measure the startup time of the gctools entry points")
+    print("\nSyntax:")
+    print("   %s [options]" % (sys.argv[0]))
+    print("\nOptions:")
+    print("   -n <num>    | --repeat <num>         Runs per entry point, default 10")
+    print("   --python2 <interpreter>             Interpreter for python2 scripts, default python2")
+    print("   --python3 <interpreter>             Interpreter for python3 scripts, default the running one")
+    print("   -o <file>   | --json <file>          Also write results as JSON to <file>")
+    print("   -h          | --help                 Show this Help")
+
+
+def prepareWorkdir():
+    workdir = tempfile.mkdtemp(prefix="gctools-startup-")
+    atexit.register(shutil.rmtree, workdir, True)
+    garmindir = os.path.join(workdir, "Garmin")
+    os.makedirs(os.path.join(garmindir, "GPX"))
+    with open(os.path.join(garmindir, "geocache_logs.xml"), "w") as fh:
+        fh.write('<?xml version="1.0" encoding="utf-8"?>\n<geocache_visits xmlns="http://www.garmin.com/xmlschemas/geocache_visits/v1">\n')
+        for i in range(50):
+            fh.write('<geocache_log><time>2017-06-%02dT12:00:00Z</time><code>GC%04X</code><result>found it</result><comment></comment></geocache_log>\n' % (i % 28 + 1, i))
+        fh.write('</geocache_visits>\n')
+    return workdir
+
+def entryPoints(workdir):
+    # (label, interpreter, script or module, arguments)
+    gpxfile = os.path.join(fixtures_dir_, "cache.gpx")
+    garmindir = os.path.join(workdir, "Garmin")
+    return [
+        ("import geocachingsitelib", "python3", "geocachingsitelib", []),
+        ("import garmindevicelib", "python3", "garmindevicelib", []),
+        ("gpx_merge.py --help", "python3", "gpx_merge.py", ["--help"]),
+        ("gpx_merge.py merge", "python3", "gpx_merge.py", ["-o", os.path.join(workdir, "merged.gpx"), gpxfile]),
+        ("gc_get_spoiler_pics.py --help", "python3", "gc_get_spoiler_pics.py", ["--help"]),
+        ("gc_grab_gpx.py --help", "python3", "gc_grab_gpx.py", ["--help"]),
+        ("gc_garmingps.py --help", "python2", "gc_garmingps.py", ["--help"]),
+        ("gc_garmingps.py --found", "python2", "gc_garmingps.py", ["--found", garmindir]),
+        ("gc_add_gcvote_to_pq.py --help", "python2", "gc_add_gcvote_to_pq.py", ["--help"]),
+        ("chngwaypoint.py --help", "python2", "chngwaypoint.py", ["--help"]),
+        ("gc_upload_fieldnotes.py --help", "python2", "gc_upload_fieldnotes.py", ["--help"]),
+        ("gc_bulklog_fieldnotes.py --help", "python2", "gc_bulklog_fieldnotes.py", ["--help"]),
+    ]
+
+def runOnce(interpreter, target, args):
+    if target.endswith(".py"):
+        target = os.path.join(gctools_dir_, target)
+    cmd = [interpreter, "-c", probe_code_ % {"gctools_dir": gctools_dir_, "heavy": heavy_modules_}, target] + args
+    t0 = time.perf_counter()
+    p = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=gctools_dir_)
+    wall = time.perf_counter() - t0
+    modules = None
+    for line in p.stderr.decode("utf-8", "replace").splitlines():
+        if line.startswith("PROBE-MODULES:"):
+            modules = [m for m in line[len("PROBE-MODULES:"):].split(",") if m]
+    return (wall, modules, p.stderr.decode("utf-8", "replace"))
+
+def benchEntryPoint(label, interpreter, target, args, repeat):
+    times = []
+    modules = None
+    for i in range(repeat):
+        (wall, modules, stderr) = runOnce(interpreter, target, args)
+        if modules is None:
+            return {"entry_point": label, "error": stderr.strip().splitlines()[-1] if stderr.strip() else "failed"}
+        times.append(wall)
+    times.sort()
+    return {"entry_point": label, "min_ms": times[0] * 1000, "median_ms": times[len(times) // 2] * 1000, "modules": modules}
+
+
+if __name__ == '__main__':
+    repeat_ = 10
+    json_file_ = None
+    interpreters_ = {"python2": "python2", "python3": sys.executable}
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hn:o:", ["help","repeat=","json=","python2=","python3="])
+    except getopt.GetoptError as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    for o, a in opts:
+        if o in ["-h","--help"]:
+            usage()
+            sys.exit()
+        elif o in ["-n","--repeat"]:
+            repeat_ = int(a)
+        elif o in ["-o","--json"]:
+            json_file_ = a
+        elif o in ["--python2"]:
+            interpreters_["python2"] = a
+        elif o in ["--python3"]:
+            interpreters_["python3"] = a
+
+    workdir = prepareWorkdir()
+    results = []
+    print("%-34s %9s %9s  %s" % ("entry point", "min ms", "median ms", "heavy modules loaded"))
+    for (label, interpreter, target, args) in entryPoints(workdir):
+        if shutil.which(interpreters_[interpreter]) is None:
+            r = {"entry_point": label, "error": "%s not found" % interpreters_[interpreter]}
+        else:
+            r = benchEntryPoint(label, interpreters_[interpreter], target, args, repeat_)
+        results.append(r)
+        if "error" in r:
+            print("%-34s %9s %9s  ERROR: %s" % (label, "-", "-", r["error"]))
+        else:
+            print("%-34s %9.1f %9.1f  %s" % (label, r["min_ms"], r["median_ms"], ", ".join(r["modules"]) or "-"))
+    if json_file_:
+        with open(json_file_, "w") as fh:
+            json.dump(results, fh, indent=2)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Time and peak memory of the gctools on synthetic pocket queries from
+# gen_pq.py. Every run is a fresh interpreter, so python2 tools are measured
+# the same way as python3 ones. Wall time and peak RSS (of the tool and the
+# processes it waited for) are taken from wait4(), anything the tool needs
+# (fresh copies of the input, a warm spoiler directory) is prepared outside
+# of the measurement. Network access goes to the stand-in in fakesite.py.
+# With --compare the results are checked against an earlier --json file.
+# A benchmark that fails, hangs longer than --timeout or whose check in
+# checks_ fails is reported as an error and makes the exit status 1.
+
+import sys
+import os
+import json
+import time
+import types
+import signal
+import threading
+import atexit
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+benchmark_dir_ = os.path.dirname(os.path.abspath(__file__))
+gctools_dir_ = os.path.dirname(benchmark_dir_)
+
+import fakesite
+import gen_pq
+
+# runs a tool with geocachingsitelib pointed at the stand-in, works with python2 and python3.
+# The tool runs in the real __main__ (not runpy's temporary one), so what its
+# atexit handlers pickle can still be found there
+run_code_ = """
+import sys, json
+sys.path.insert(0, %(gctools_dir)r)
+(target, site) = (sys.argv[1], json.loads(sys.argv[2]))
+if site:
+    import geocachingsitelib
+    for (k, v) in site.items():
+        setattr(geocachingsitelib, str(k), v)
+sys.argv = [target] + sys.argv[3:]
+__file__ = target
+with open(target, "rb") as fh:
+    code = compile(fh.read(), target, "exec")
+exec(code)
+"""
+
+# genCacheDescriptionHash of every cache, without the rest of gc_get_spoiler_pics.py
+hash_code_ = """
+import sys
+sys.path.insert(0, %(gctools_dir)r)
+import gpxlib
+from gc_get_spoiler_pics import genCacheDescriptionHash
+for filename in sys.argv[1:]:
+    for wpt in gpxlib.iterWaypoints(filename):
+        if wpt.cache is not None:
+            genCacheDescriptionHash(wpt.cache)
+"""
+
+def usage():
+    print("Benchmark time and peak memory of the gctools on synthetic pocket queries")
+    print("\nSyntax:")
+    print("   %s [options] [benchmark ...]" % (sys.argv[0]))
+    print("\nBenchmarks:")
+    print("   " + ", ".join(benchmarks_.keys()) + " (default: all)")
+    print("\nOptions:")
+    print("   -c <num>    | --caches <num>         Caches in the pocket queries, default 10000")
+    print("   -n <num>    | --repeat <num>         Runs per benchmark, default 3")
+    print("   -d <dir>    | --data <dir>           Keep the generated pocket queries in <dir> and reuse them")
+    print("   --spoiler-caches <num>               Caches for spoiler_pics, default 200")
+    print("   -t <num>    | --threads <num>        --threads given to gc_get_spoiler_pics.py, default 0")
+    print("   --python2 <interpreter>             Interpreter for python2 scripts, default python2")
+    print("   --python3 <interpreter>             Interpreter for python3 scripts, default the running one")
+    print("   -o <file>   | --json <file>          Also write results as JSON to <file>")
+    print("   --compare <file>                     Compare with the results of an earlier --json run")
+    print("   --threshold <rate>                   Slowdown or memory growth reported as regression, default 0.2")
+    print("   --timeout <sec>                      A run that takes longer fails, default 600")
+    print("   -h          | --help                 Show this Help")
+
+
+def tempDir():
+    d = tempfile.mkdtemp(prefix="gctools-bench-")
+    atexit.register(shutil.rmtree, d, True)
+    return d
+
+def generate(datadir, **options):
+    # the files of gen_pq.PQGenerator(**options) in datadir, generated only if needed
+    stamp = os.path.join(datadir, ".gen_pq.json")
+    if os.path.exists(stamp):
+        with open(stamp) as fh:
+            data = json.load(fh)
+        if data["options"] == options:
+            return data["files"]
+        shutil.rmtree(datadir)
+    t0 = time.perf_counter()
+    files = gen_pq.PQGenerator(**options).write(datadir)
+    print("generated %d caches in %s (%.1fs)" % (options["caches"], datadir, time.perf_counter() - t0))
+    with open(stamp, "w") as fh:
+        json.dump({"options": options, "files": files}, fh)
+    return files
+
+def copyFiles(files, dstdir):
+    if os.path.isdir(dstdir):
+        shutil.rmtree(dstdir)
+    os.makedirs(dstdir)
+    for f in files:
+        shutil.copy(f, dstdir)
+    return [os.path.join(dstdir, os.path.basename(f)) for f in files]
+
+
+class ToolContext(object):
+    def __init__(self, site, interpreters, datadir, num_caches, spoiler_caches, threads, timeout=600):
+        self.site = site
+        self.timeout = timeout
+        self.interpreters = interpreters
+        self.datadir = datadir
+        self.num_caches = num_caches
+        self.spoiler_caches = spoiler_caches
+        self.threads = threads
+        self.workdir = tempDir()
+        # what fakesite.redirectSiteLib sets in geocachingsitelib, for run_code_
+        ns = types.SimpleNamespace()
+        fakesite.redirectSiteLib(ns, site.base_url, os.path.join(self.workdir, "config"))
+        self.site_vars = vars(ns)
+        self._files = {}
+
+    def files(self, encoding="utf-8"):
+        # (pq files, additional waypoint files, geocache_logs.xml)
+        if encoding not in self._files:
+            self._files[encoding] = generate(os.path.join(self.datadir, "%d-%s" % (self.num_caches, encoding)), caches=self.num_caches, encoding=encoding)
+        return self._files[encoding]
+
+    def work(self, *names):
+        return os.path.join(self.workdir, *names)
+
+# Every benchmark prepares one run and returns (interpreter, script or
+# python code, arguments, redirect geocachingsitelib to the stand-in)
+
+def benchGPXMerge(ctx):
+    (pqs, wpts, logs) = ctx.files()
+    return ("python3", "gpx_merge.py", ["-o", ctx.work("merged.gpx")] + pqs + wpts, False)
+
+def benchGPXMergeIncremental(ctx):
+    # one of the pocket queries was downloaded again, its caches did not change
+    (pqs, wpts, logs) = ctx.files()
+    inputs = ctx.work("incremental")
+    if not os.path.isdir(inputs):
+        pqs = copyFiles(pqs, inputs)
+        subprocess.check_call([ctx.interpreters["python3"], os.path.join(gctools_dir_, "gpx_merge.py"), "--incremental", "-o", ctx.work("incremental.gpx")] + pqs, stdout=subprocess.DEVNULL)
+    pqs = [os.path.join(inputs, os.path.basename(f)) for f in pqs]
+    with open(pqs[-1], "ab") as fh:
+        fh.write(b"\n")
+    return ("python3", "gpx_merge.py", ["--incremental", "-o", ctx.work("incremental.gpx")] + pqs, False)
+
+def benchDescriptionHash(ctx):
+    (pqs, wpts, logs) = ctx.files()
+    return ("python3", hash_code_, pqs, False)
+
+def _purge(ctx, encoding):
+    # a device with all pocket queries and the visits of gen_pq.py
+    (pqs, wpts, logs) = ctx.files(encoding)
+    garmin = ctx.work("Garmin-%s" % encoding)
+    copyFiles(pqs + wpts, os.path.join(garmin, "GPX"))
+    shutil.copy(logs, garmin)
+    return ("python2", "gc_garmingps.py", ["--purge", "--scriptmode", "--full", "--state", ctx.work("garmingps_state.json"), garmin], False)
+
+def benchGarminPurge(ctx):
+    return _purge(ctx, "utf-8")
+
+def benchGarminPurgeUTF16(ctx):
+    # UTF-16 files can not be scanned as bytes and go through the parser
+    return _purge(ctx, "utf-16")
+
+def benchGCVote(ctx):
+    (pqs, wpts, logs) = ctx.files()
+    return ("python2", "gc_add_gcvote_to_pq.py", copyFiles(pqs, ctx.work("gcvote")), True)
+
+def benchSpoilerPics(ctx):
+    # everything gc_get_spoiler_pics.py does before it downloads: all caches
+    # were downloaded by a first run, so no cache page should be requested
+    savedir = ctx.work("spoilers")
+    pqdir = ctx.work("spoiler_pq")
+    if not os.path.isdir(pqdir):
+        gen_pq.PQGenerator(caches=ctx.spoiler_caches, url_base=ctx.site.base_url).write(pqdir)
+        os.makedirs(savedir)
+    args = ["--savedir", savedir, "--done_file", os.path.join(savedir, "done.pickle"), "--no_geotag", "--threads", str(ctx.threads)] + \
+        sorted([os.path.join(pqdir, f) for f in os.listdir(pqdir) if f.endswith(".gpx") and not f.endswith("-wpts.gpx")])
+    if not os.path.exists(os.path.join(savedir, "done.pickle")):
+        (wall, maxrss, rc, stderr) = runTool(ctx, "python3", "gc_get_spoiler_pics.py", args, True)
+        if rc != 0:
+            raise RuntimeError("first gc_get_spoiler_pics.py run failed: %s" % stderr.strip())
+    return ("python3", "gc_get_spoiler_pics.py", args, True)
+
+def _profileThreads(ctx):
+    return max(2, ctx.threads)
+
+def benchSpoilerPicsProfile(ctx):
+    # spoiler_pics under --profile with a forked worker pool
+    (interpreter, target, args, site) = benchSpoilerPics(ctx)
+    args = list(args)
+    args[args.index("--threads") + 1] = str(_profileThreads(ctx))
+    return (interpreter, target, ["--profile", ctx.work("spoiler_pics.pstats"), "--trace-memory"] + args, site)
+
+def checkSpoilerPicsProfile(ctx, stderr):
+    # the profiles of the pool workers have to be added to the parent's
+    if not os.path.isfile(ctx.work("spoiler_pics.pstats")):
+        return "no profile written"
+    if "including %d worker processes" % _profileThreads(ctx) not in stderr:
+        return "profile without the worker processes"
+    return None
+
+benchmarks_ = {
+    "gpx_merge": benchGPXMerge,
+    "gpx_merge_incremental": benchGPXMergeIncremental,
+    "description_hash": benchDescriptionHash,
+    "garmingps_purge": benchGarminPurge,
+    "garmingps_purge_utf16": benchGarminPurgeUTF16,
+    "gcvote": benchGCVote,
+    "spoiler_pics": benchSpoilerPics,
+    "spoiler_pics_profile": benchSpoilerPicsProfile,
+}
+# check(ctx, stderr) after every run, returns an error message or None
+checks_ = {
+    "spoiler_pics_profile": checkSpoilerPicsProfile,
+}
+
+
+def runTool(ctx, interpreter, target, args, site):
+    # returns (wall seconds, peak RSS in KiB, exit status, stderr)
+    code = run_code_ % {"gctools_dir": gctools_dir_}
+    if target.endswith(".py"):
+        args = [os.path.join(gctools_dir_, target), json.dumps(ctx.site_vars if site else {})] + args
+    else:
+        code = target % {"gctools_dir": gctools_dir_}
+    stderr = tempfile.TemporaryFile()
+    t0 = time.perf_counter()
+    # in its own process group, so a hanging tool is killed with all its workers
+    p = subprocess.Popen([ctx.interpreters[interpreter], "-c", code] + args, stdout=subprocess.DEVNULL, stderr=stderr, cwd=ctx.workdir, start_new_session=True)
+    timed_out = []
+    def kill():
+        timed_out.append(True)
+        os.killpg(p.pid, signal.SIGKILL)
+    timer = threading.Timer(ctx.timeout, kill)
+    timer.start()
+    (pid, status, rusage) = os.wait4(p.pid, 0)
+    timer.cancel()
+    wall = time.perf_counter() - t0
+    p.returncode = os.waitstatus_to_exitcode(status)
+    stderr.seek(0)
+    stderr = stderr.read().decode("utf-8", "replace")
+    if timed_out:
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        stderr += "\ntimed out after %gs" % ctx.timeout
+    return (wall, rusage.ru_maxrss, p.returncode, stderr)
+
+def runBenchmark(ctx, name, repeat):
+    times = []
+    peak = 0
+    http_requests = 0
+    for i in range(repeat):
+        (interpreter, target, args, site) = benchmarks_[name](ctx)
+        if shutil.which(ctx.interpreters[interpreter]) is None:
+            return {"benchmark": name, "error": "%s not found" % ctx.interpreters[interpreter]}
+        requests_before = ctx.site.getStats()["requests"]
+        (wall, maxrss, rc, stderr) = runTool(ctx, interpreter, target, args, site)
+        if rc != 0:
+            return {"benchmark": name, "error": stderr.strip().splitlines()[-1] if stderr.strip() else "exit status %d" % rc}
+        error = checks_[name](ctx, stderr) if name in checks_ else None
+        if error is not None:
+            return {"benchmark": name, "error": error}
+        # -1: exclude the /_stats request itself
+        http_requests += ctx.site.getStats()["requests"] - requests_before - 1
+        times.append(wall)
+        peak = max(peak, maxrss)
+    times.sort()
+    return {"benchmark": name, "caches": ctx.spoiler_caches if name.startswith("spoiler_pics") else ctx.num_caches, "runs": repeat,
+        "min_s": times[0], "median_s": times[len(times) // 2], "peak_rss_kib": peak, "http_requests": http_requests}
+
+def printResults(results):
+    print("%-24s %8s %9s %9s %10s %6s" % ("benchmark", "caches", "min s", "median s", "peak MiB", "http"))
+    for r in results:
+        if "error" in r:
+            print("%-24s %8s %9s %9s %10s %6s  ERROR: %s" % (r["benchmark"], "-", "-", "-", "-", "-", r["error"]))
+        else:
+            print("%-24s %8d %9.2f %9.2f %10.1f %6d" % (r["benchmark"], r["caches"], r["min_s"], r["median_s"], r["peak_rss_kib"] / 1024.0, r["http_requests"]))
+
+def compareResults(results, baseline, threshold):
+    # prints and returns the benchmarks that got slower or bigger than threshold allows
+    old = dict([(r["benchmark"], r) for r in baseline if "error" not in r])
+    regressions = []
+    for r in results:
+        b = old.get(r["benchmark"])
+        if "error" in r or b is None or b.get("caches") != r["caches"]:
+            continue
+        for (key, label) in [("min_s", "time"), ("peak_rss_kib", "peak memory")]:
+            if b[key] > 0 and r[key] > b[key] * (1 + threshold):
+                regressions.append(r["benchmark"])
+                print("REGRESSION %s: %s %+.0f%% (%g -> %g)" % (r["benchmark"], label, (r[key] / float(b[key]) - 1) * 100, b[key], r[key]))
+    return regressions
+
+
+if __name__ == '__main__':
+    num_caches_ = 10000
+    repeat_ = 3
+    datadir_ = None
+    spoiler_caches_ = 200
+    threads_ = 0
+    json_file_ = None
+    compare_file_ = None
+    threshold_ = 0.2
+    timeout_ = 600
+    interpreters_ = {"python2": "python2", "python3": sys.executable}
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hc:n:d:t:o:", ["help","caches=","repeat=","data=","spoiler-caches=","threads=","python2=","python3=","json=","compare=","threshold=","timeout="])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-c","--caches"]:
+                num_caches_ = int(a)
+            elif o in ["-n","--repeat"]:
+                repeat_ = max(1, int(a))
+            elif o in ["-d","--data"]:
+                datadir_ = a
+            elif o in ["--spoiler-caches"]:
+                spoiler_caches_ = int(a)
+            elif o in ["-t","--threads"]:
+                threads_ = int(a)
+            elif o in ["--python2"]:
+                interpreters_["python2"] = a
+            elif o in ["--python3"]:
+                interpreters_["python3"] = a
+            elif o in ["-o","--json"]:
+                json_file_ = a
+            elif o in ["--compare"]:
+                compare_file_ = a
+            elif o in ["--threshold"]:
+                threshold_ = float(a)
+            elif o in ["--timeout"]:
+                timeout_ = float(a)
+    except (getopt.GetoptError, ValueError) as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    unknown = set(args) - set(benchmarks_.keys())
+    if unknown:
+        print("ERROR: unknown benchmark(s): %s" % ", ".join(unknown), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    results = []
+    with fakesite.FakeSiteProcess(fakesite.FakeSiteConfig(images_per_cache=1)) as site:
+        ctx = ToolContext(site, interpreters_, datadir_ or tempDir(), num_caches_, spoiler_caches_, threads_, timeout_)
+        for name in (args or benchmarks_.keys()):
+            results.append(runBenchmark(ctx, name, repeat_))
+    printResults(results)
+    if json_file_:
+        with open(json_file_, "w") as fh:
+            json.dump(results, fh, indent=2)
+    if compare_file_:
+        with open(compare_file_) as fh:
+            if compareResults(results, json.load(fh), threshold_):
+                sys.exit(1)
+    if [r for r in results if "error" in r]:
+        sys.exit(1)
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Offline stand-in for the parts of geocaching.com and gcvote.com that
+# geocachingsitelib talks to. Pages are rendered from the recorded fixtures
+# in fixtures/, latency and errors can be injected to simulate a slow or
+# flaky site. Use redirectSiteLib() to point geocachingsitelib at it.
+
+import sys
+import os
+import io
+import time
+import json
+import random
+import getopt
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from string import Template
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, parse_qs
+
+fixtures_dir_ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# smallest byte string imghdr recognizes as a jpeg
+jpeg_image_ = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00" + b"\x00" * 1024 + b"\xff\xd9"
+
+def usage():
+    print("Offline stand-in for geocaching.com and gcvote.com")
+    print("\nSyntax:")
+    print("   %s [options]" % (sys.argv[0]))
+    print("\nOptions:")
+    print("   -p <port>   | --port <port>          Port to listen on, default 8080")
+    print("   -l <sec>    | --latency <sec>        Delay every response by <sec> seconds")
+    print("   -j <sec>    | --jitter <sec>         Add up to <sec> random seconds to latency")
+    print("   -e <rate>   | --error-rate <rate>    Answer this fraction of requests with HTTP 500")
+    print("   -x <rate>   | --expire-rate <rate>   Expire the login session on this fraction of requests")
+    print("   -i <num>    | --images <num>         Number of spoiler images per cache page, default 3")
+    print("   -h          | --help                 Show this Help")
+
+
+def loadFixture(name):
+    with open(os.path.join(fixtures_dir_, name), "r", encoding="utf-8") as fh:
+        return Template(fh.read())
+
+def gccodeFromString(s):
+    # deterministic fake gccode for guids and other ids
+    return "GC" + hashlib.md5(s.encode("utf-8")).hexdigest()[:5].upper()
+
+def guidFromString(s):
+    h = hashlib.md5(s.encode("utf-8")).hexdigest()
+    return "%s-%s-%s-%s-%s" % (h[0:8], h[8:12], h[12:16], h[16:20], h[20:32])
+
+def latLonFromString(s):
+    h = int(hashlib.md5(s.encode("utf-8")).hexdigest()[:8], 16)
+    return (47.0 + (h % 10000) / 10000.0, 15.0 + (h // 10000 % 10000) / 10000.0)
+
+
+class FakeSiteConfig(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, expire_rate=0.0, images_per_cache=3, num_fieldnotes=20, num_pqs=5, longdesc_size=2000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.expire_rate = expire_rate
+        self.images_per_cache = images_per_cache
+        self.num_fieldnotes = num_fieldnotes
+        self.num_pqs = num_pqs
+        self.longdesc_size = longdesc_size
+
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # send header and body in one segment, avoids delayed-ACK stalls on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def site(self):
+        return self.server.site
+
+    def _reply(self, body, status=200, content_type="text/html; charset=utf-8", headers={}):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        self.site.countRequest(self.command, self.path, status, len(body))
+
+    def _redirect(self, location, headers={}):
+        h = {"Location": location}
+        h.update(headers)
+        self._reply(b"", status=302, headers=h)
+
+    def _isLoggedIn(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return "gspkauth" in cookie and self.site.isValidSession(cookie["gspkauth"].value)
+
+    def _readForm(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length > 0 else b""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body.decode("utf-8") or "{}")
+        if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+            return {"_multipart": body}
+        return dict([(k, v[0]) for (k, v) in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()])
+
+    def _injectFaults(self):
+        cfg = self.site.config
+        delay = cfg.latency + (random.uniform(0, cfg.jitter) if cfg.jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if cfg.error_rate > 0 and random.random() < cfg.error_rate:
+            self._reply("<html><body><h1>Server Error</h1></body></html>", status=500)
+            return True
+        if cfg.expire_rate > 0 and random.random() < cfg.expire_rate:
+            self.site.expireSessions()
+        return False
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        query = dict([(k, v[0]) for (k, v) in parse_qs(url.query).items()])
+        path = url.path
+        if path == "/_stats":
+            return self._reply(json.dumps(self.site.getStats()), content_type="application/json")
+        form = self._readForm() if method == "POST" else {}
+        if self._injectFaults():
+            return
+        if path == "/account/login":
+            return self.login(method, form)
+        if path == "/gcvote/getVotes.php":
+            return self.gcvotes(form)
+        if path.startswith("/images/"):
+            return self._reply(jpeg_image_, content_type="image/jpeg")
+        if not self._isLoggedIn():
+            return self._reply(self.site.signed_out_html.substitute())
+        if path == "/play/search":
+            return self._reply(self.site.search_html.substitute())
+        if path == "/seek/cache_details.aspx":
+            return self.cacheDetails(method, query, form)
+        if path == "/seek/cache_details.aspx/SetUserCoordinate":
+            return self._reply(json.dumps({"d": json.dumps({"status": "success"})}), content_type="application/json")
+        if path == "/pocket/default.aspx":
+            return self.pocketList()
+        if path == "/pocket/downloadpq.ashx":
+            return self.pocketDownload(query)
+        if path == "/my/fieldnotes.aspx":
+            return self.fieldnotes()
+        if path == "/my/uploadfieldnotes.aspx":
+            return self._reply(self.site.uploadfieldnotes_html.substitute(count=1))
+        if path == "/seek/log.aspx":
+            return self.logForm(method, query, form)
+        self._reply("<html><body>Not Found</body></html>", status=404)
+
+    def login(self, method, form):
+        if method == "GET":
+            return self._reply(self.site.login_html.substitute(token=self.site.newToken()))
+        if form.get("UsernameOrEmail") and form.get("Password") and form.get("__RequestVerificationToken"):
+            return self._redirect("/play/search", headers={"Set-Cookie": "gspkauth=%s; Path=/" % self.site.newSession()})
+        self._reply(self.site.login_html.substitute(token=self.site.newToken()))
+
+    def cacheDetails(self, method, query, form):
+        key = query.get("wp") or query.get("guid") or "GC1"
+        gccode = key.upper() if key.upper().startswith("GC") else gccodeFromString(key)
+        if method == "POST" and "ctl00$ContentBody$btnGPXDL" in form:
+            return self._reply(self.site.renderCacheGPX(gccode), content_type="application/xml", headers={"Content-Disposition": "attachment; filename=%s.gpx" % gccode})
+        return self._reply(self.site.renderCacheDetails(gccode, "http://%s:%d" % self.server.server_address[:2]))
+
+    def pocketList(self):
+        rows = "\n".join([self.site.pocket_list_row_html.substitute(pquid=guidFromString("pq%d" % i), pqname="Benchmark PQ %d" % i) for i in range(self.site.config.num_pqs)])
+        self._reply(self.site.pocket_list_html.substitute(rows=rows))
+
+    def pocketDownload(self, query):
+        pquid = query.get("g", "")
+        self._reply(self.site.renderPQZip(pquid), content_type="application/zip", headers={"Content-Disposition": "attachment; filename=%s.zip" % pquid})
+
+    def fieldnotes(self):
+        rows = []
+        for i in range(self.site.config.num_fieldnotes):
+            gccode = gccodeFromString("fn%d" % i)
+            rows.append(self.site.fieldnotes_row_html.substitute(index=i, gccode=gccode, gcname="Fieldnote Cache %d" % i, date="06/%02d/2017" % (i % 28 + 1), time="12:%02d:00" % (i % 60), guid=guidFromString("fn%d" % i)))
+        self._reply(self.site.fieldnotes_html.substitute(rows="\n".join(rows)))
+
+    def logForm(self, method, query, form):
+        if method == "POST":
+            return self._reply(self.site.log_posted_html.substitute())
+        self._reply(self.site.log_form_html.substitute(guid=query.get("PLogGuid", ""), viewstate=self.site.viewstate, date="06/14/2017", fieldnote="Found it at 12:00"))
+
+    def gcvotes(self, form):
+        username = form.get("userName", "")
+        votes = []
+        for guid in [g for g in form.get("cacheIds", "").split(",") if g]:
+            h = int(hashlib.md5(guid.encode("utf-8")).hexdigest()[:4], 16)
+            votes.append(self.site.getvotes_vote_xml.substitute(username=username, guid=guid, gccode=gccodeFromString(guid), median="%.1f" % (1 + h % 9 * 0.5), avg="%.5f" % (1 + (h % 400) / 100.0), count=h % 50))
+        self._reply(self.site.getvotes_xml.substitute(username=username, votes="\n".join(votes)), content_type="text/xml")
+
+
+class FakeSite(object):
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.counter = 0
+        self.stats = {}
+        self.started = time.time()
+        self.viewstate = "V" * 2048
+        for name in ["login.html", "search.html", "signed_out.html", "cache_details.html", "cache_image_item.html", "pocket_list.html", "pocket_list_row.html", "fieldnotes.html", "fieldnotes_row.html", "log_form.html", "log_posted.html", "uploadfieldnotes.html", "getvotes.xml", "getvotes_vote.xml", "cache.gpx"]:
+            setattr(self, name.replace(".", "_"), loadFixture(name))
+
+    def newToken(self):
+        with self.lock:
+            self.counter += 1
+            return hashlib.md5(("token%d" % self.counter).encode("utf-8")).hexdigest()
+
+    def newSession(self):
+        token = self.newToken()
+        with self.lock:
+            self.sessions.add(token)
+        return token
+
+    def isValidSession(self, token):
+        with self.lock:
+            return token in self.sessions
+
+    def expireSessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def countRequest(self, method, path, status, size):
+        key = "%s %s" % (method, urlsplit(path).path)
+        with self.lock:
+            s = self.stats.setdefault(key, {"count": 0, "errors": 0, "bytes": 0})
+            s["count"] += 1
+            s["bytes"] += size
+            if status >= 400:
+                s["errors"] += 1
+
+    def getStats(self):
+        with self.lock:
+            return {"uptime": time.time() - self.started, "requests": sum([s["count"] for s in self.stats.values()]), "paths": dict(self.stats)}
+
+    def longDescription(self, gccode):
+        text = "Lorem ipsum %s dolor sit amet, consectetur adipisici elit. " % gccode
+        return (text * (self.config.longdesc_size // len(text) + 1))[:self.config.longdesc_size]
+
+    def renderCacheDetails(self, gccode, base):
+        images = "\n".join([self.cache_image_item_html.substitute(imguri="%s/images/%s/%d.jpg" % (base, gccode, i), imgdesc="Spoiler %s stage %d" % (gccode, i)) for i in range(self.config.images_per_cache)])
+        return self.cache_details_html.substitute(gccode=gccode, gcname="Benchmark Cache %s" % gccode, viewstate=self.viewstate, longdesc=self.longDescription(gccode), images=images, usertoken=hashlib.md5(gccode.encode("utf-8")).hexdigest())
+
+    def renderCacheGPX(self, gccode, url=None):
+        (lat, lon) = latLonFromString(gccode)
+        return self.cache_gpx.substitute(gccode=gccode, gcname="Benchmark Cache %s" % gccode, lat="%.6f" % lat, lon="%.6f" % lon, cacheid=int(hashlib.md5(gccode.encode("utf-8")).hexdigest()[:6], 16), url=url or "http://www.geocaching.com/seek/cache_details.aspx?guid=%s" % guidFromString(gccode), longdesc=self.longDescription(gccode))
+
+    def renderPQZip(self, pquid):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("%s.gpx" % pquid[:8], self.renderCacheGPX(gccodeFromString(pquid)))
+        return buf.getvalue()
+
+
+def serve(config, port=8080, ready_queue=None):
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), FakeSiteHandler)
+    httpd.daemon_threads = True
+    httpd.site = FakeSite(config)
+    if ready_queue is not None:
+        ready_queue.put(httpd.server_address[1])
+    httpd.serve_forever()
+
+
+class FakeSiteProcess(object):
+    # runs the stand-in server in its own process, so its CPU time
+    # does not distort the measurements of the client under test
+    def __init__(self, config=None, port=0):
+        self.config = config or FakeSiteConfig()
+        self.port = port
+        self.process = None
+
+    def __enter__(self):
+        ready_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=serve, args=(self.config, self.port, ready_queue))
+        self.process.daemon = True
+        self.process.start()
+        self.port = ready_queue.get(timeout=30)
+        return self
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.join()
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%d" % self.port
+
+    def getStats(self):
+        import urllib.request
+        with urllib.request.urlopen(self.base_url + "/_stats") as fh:
+            return json.loads(fh.read().decode("utf-8"))
+
+
+def redirectSiteLib(gc, base_url, config_dir):
+    # point geocachingsitelib's global uris at the stand-in server and keep
+    # the session cookie away from the user's real one
+    gc.gc_auth_uri_ = base_url + "/account/login?ReturnUrl=%2Fplay%2Fsearch"
+    gc.gc_uploadfieldnotes_uri_ = base_url + "/my/uploadfieldnotes.aspx"
+    gc.gc_listfieldnotes_uri_ = base_url + "/my/fieldnotes.aspx"
+    gc.gc_wp_uri_ = base_url + "/seek/cache_details.aspx?wp=%s"
+    gc.gc_setusercoord_uri_ = base_url + "/seek/cache_details.aspx/SetUserCoordinate"
+    gc.gc_pqlist_uri_ = base_url + "/pocket/default.aspx"
+    gc.gc_pqdownload_host_ = base_url
+    gc.gcvote_getvote_uri_ = base_url + "/gcvote/getVotes.php"
+    gc.default_config_dir_ = config_dir
+    gc.gc_username = "benchuser"
+    gc.gc_password = "benchpass"
+    gc.be_interactive = False
+    gc._gc_session_ = False
+
+
+if __name__ == '__main__':
+    port_ = 8080
+    config_ = FakeSiteConfig()
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hp:l:j:e:x:i:", ["help","port=","latency=","jitter=","error-rate=","expire-rate=","images="])
+    except getopt.GetoptError as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    for o, a in opts:
+        if o in ["-h","--help"]:
+            usage()
+            sys.exit()
+        elif o in ["-p","--port"]:
+            port_ = int(a)
+        elif o in ["-l","--latency"]:
+            config_.latency = float(a)
+        elif o in ["-j","--jitter"]:
+            config_.jitter = float(a)
+        elif o in ["-e","--error-rate"]:
+            config_.error_rate = float(a)
+        elif o in ["-x","--expire-rate"]:
+            config_.expire_rate = float(a)
+        elif o in ["-i","--images"]:
+            config_.images_per_cache = int(a)
+
+    print("Serving fake geocaching.com on http://127.0.0.1:%d/" % port_)
+    serve(config_, port_)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Generates synthetic pocket queries that look like the ones Groundspeak
+# mails: GPX 1.0 with groundspeak:cache 1.0.1 extensions, logs, travel bugs,
+# an additional waypoints file per PQ and a Garmin geocache_logs.xml with
+# visits to some of the caches. The output only depends on the options and
+# --seed, so benchmark runs are comparable. Files are written as a stream,
+# 500k caches do not need more memory than 1k.
+
+import sys
+import os
+import random
+import getopt
+import datetime
+from xml.sax.saxutils import escape
+
+# GC codes are hex up to GCFFFF and continue in base 31 with GCG000
+gccode_digits_ = "0123456789ABCDEFGHJKMNPQRTVWXYZ"
+first_cache_number_ = 200000
+pq_time_ = datetime.datetime(2017, 6, 14, 8, 0, 0)
+
+# (value, weight)
+cache_types_ = [("Traditional Cache", 60), ("Multi-cache", 15), ("Unknown Cache", 15), ("Letterbox Hybrid", 3),
+    ("Earthcache", 3), ("Wherigo Cache", 2), ("Event Cache", 1), ("Virtual Cache", 1)]
+containers_ = [("Micro", 35), ("Small", 30), ("Regular", 20), ("Large", 3), ("Other", 5), ("Not chosen", 5), ("Virtual", 2)]
+log_types_ = [("Found it", 75), ("Didn't find it", 8), ("Write note", 10), ("Owner Maintenance", 3), ("Needs Maintenance", 2), ("Publish Listing", 2)]
+# (id, name)
+attributes_ = [(1, "Dogs"), (6, "Recommended for kids"), (8, "Scenic view"), (13, "Available at all times"), (14, "Recommended at night"),
+    (24, "Wheelchair accessible"), (25, "Parking available"), (32, "Bicycles"), (40, "Stealth required"), (47, "Field Puzzle")]
+# (prefix, GPX type suffix, sym)
+additional_waypoints_ = [("PK", "Parking Area", "Parking Area"), ("ST", "Stages of a Multicache", "Stages of a Multicache"),
+    ("FN", "Final Location", "Final Location"), ("QA", "Question to Answer", "Question to Answer"), ("TH", "Trailhead", "Trailhead")]
+states_ = ["Steiermark", "Kaernten", "Niederoesterreich", "Wien", "Oberoesterreich", "Salzburg", "Tirol"]
+words_ = ("lorem ipsum dolor sit amet consectetur adipisici elit sed eiusmod tempor incidunt ut labore et dolore magna aliqua "
+    "forest bridge stone tree path river castle view bench old hidden near under behind small wall").split()
+bom_ = {"utf-8": b"", "utf-16": b"\xff\xfe"}
+
+gpx_header_ = """<?xml version="1.0" encoding="utf-8"?>
+<gpx xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema" version="1.0" creator="Groundspeak Pocket Query" xsi:schemaLocation="http://www.topografix.com/GPX/1/0 http://www.topografix.com/GPX/1/0/gpx.xsd http://www.groundspeak.com/cache/1/0/1 http://www.groundspeak.com/cache/1/0/1/cache.xsd" xmlns="http://www.topografix.com/GPX/1/0">
+  <name>%(name)s</name>
+  <desc>%(desc)s</desc>
+  <author>Groundspeak</author>
+  <email>contact@groundspeak.com</email>
+  <url>http://www.groundspeak.com</url>
+  <urlname>Geocaching - High Tech Treasure Hunting</urlname>
+  <time>%(time)s</time>
+  <keywords>cache, geocache, groundspeak</keywords>
+  <bounds minlat="%(minlat).6f" minlon="%(minlon).6f" maxlat="%(maxlat).6f" maxlon="%(maxlon).6f" />
+"""
+
+def usage():
+    print("Generate synthetic Groundspeak pocket queries for benchmarks")
+    print("\nSyntax:")
+    print("   %s [options] -o <dir>" % (sys.argv[0]))
+    print("\nOptions:")
+    print("   -o <dir>    | --output <dir>         Write the files into <dir>")
+    print("   -c <num>    | --caches <num>         Number of caches, default 1000")
+    print("   -s <num>    | --pq-size <num>        Caches per pocket query file, default 1000")
+    print("   -l <num>    | --logs <num>           Logs per cache, default 5")
+    print("   -b <num>    | --travelbugs <num>     Up to <num> travel bugs per cache, default 2")
+    print("   -w <num>    | --waypoints <num>      Up to <num> additional waypoints per cache, default 2")
+    print("   -f <rate>   | --found <rate>         Fraction of the caches visited in geocache_logs.xml, default 0.1")
+    print("   --center <lat,lon>                   Center of the caches, default 47.07,15.44")
+    print("   --spread <deg>                       Caches lie within +-<deg> of the center, default 1.0")
+    print("   --url-base <url>                     Cache pages are <url>/seek/cache_details.aspx?guid=...,")
+    print("                                         default http://www.geocaching.com")
+    print("   --encoding <utf-8|utf-16>            Encoding of the gpx files, default utf-8")
+    print("   --seed <num>                         Random seed, default 1")
+    print("   -h          | --help                 Show this Help")
+
+
+def gccode(n):
+    if n < 0x10000:
+        return "GC%X" % n
+    n += 411120
+    digits = ""
+    while n:
+        digits = gccode_digits_[n % 31] + digits
+        n //= 31
+    return "GC" + digits
+
+def weighted(rng, choices):
+    total = sum([w for (c, w) in choices])
+    r = rng.uniform(0, total)
+    for (choice, weight) in choices:
+        r -= weight
+        if r <= 0:
+            return choice
+    return choices[-1][0]
+
+def sentence(rng, num_words):
+    text = " ".join([rng.choice(words_) for i in range(num_words)])
+    return text[:1].upper() + text[1:] + "." if text else ""
+
+def guid(rng):
+    h = "%032x" % rng.getrandbits(128)
+    return "%s-%s-%s-%s-%s" % (h[0:8], h[8:12], h[12:16], h[16:20], h[20:32])
+
+def isoTime(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class PQGenerator(object):
+    # gen = PQGenerator(caches=10000)
+    # files = gen.write("/tmp/pq")
+    def __init__(self, caches=1000, pq_size=1000, logs=5, travelbugs=2, waypoints=2, found=0.1,
+            center=(47.07, 15.44), spread=1.0, url_base="http://www.geocaching.com", encoding="utf-8", seed=1):
+        self.caches = caches
+        self.pq_size = max(1, pq_size)
+        self.logs = logs
+        self.travelbugs = travelbugs
+        self.waypoints = waypoints
+        self.found = found
+        self.center = center
+        self.spread = spread
+        self.url_base = url_base.rstrip("/")
+        self.encoding = encoding
+        self.seed = seed
+
+    def cache(self, rng, n):
+        # all properties of cache number n, drawn from rng in a fixed order
+        c = {"gccode": gccode(first_cache_number_ + n), "id": first_cache_number_ + n, "guid": guid(rng),
+            "lat": self.center[0] + rng.uniform(-self.spread, self.spread),
+            "lon": self.center[1] + rng.uniform(-self.spread, self.spread),
+            "type": weighted(rng, cache_types_), "container": weighted(rng, containers_),
+            "difficulty": rng.choice([1, 1.5, 2, 2, 2.5, 3, 3.5, 4, 5]), "terrain": rng.choice([1, 1.5, 1.5, 2, 2.5, 3, 4, 5]),
+            "name": sentence(rng, rng.randint(2, 5))[:-1], "owner": "owner%d" % rng.randint(1, 5000),
+            "placed": pq_time_ - datetime.timedelta(days=rng.randint(30, 6000)), "state": rng.choice(states_)}
+        c["attributes"] = [(a, rng.random() < 0.85) for a in rng.sample(attributes_, rng.randint(0, 6))]
+        c["short"] = sentence(rng, rng.randint(5, 30))
+        c["long"] = "".join(["<p>%s</p>" % sentence(rng, rng.randint(10, 60)) for i in range(rng.randint(1, 8))])
+        if rng.random() < 0.3:
+            c["long"] += '<img src="%s/images/%s/spoiler.jpg" />' % (self.url_base, c["gccode"])
+        c["hint"] = sentence(rng, rng.randint(0, 8)) if rng.random() < 0.8 else ""
+        c["logs"] = []
+        t = pq_time_
+        for i in range(rng.randint(0, self.logs * 2) if self.logs else 0):
+            t -= datetime.timedelta(hours=rng.randint(1, 24 * 30))
+            c["logs"].append((rng.getrandbits(31), t, weighted(rng, log_types_), "finder%d" % rng.randint(1, 100000), sentence(rng, rng.randint(1, 40))))
+        c["travelbugs"] = [(rng.getrandbits(20), "TB%X" % rng.getrandbits(20), sentence(rng, rng.randint(1, 4))[:-1]) for i in range(rng.randint(0, self.travelbugs))]
+        c["waypoints"] = [rng.choice(additional_waypoints_) for i in range(rng.randint(0, self.waypoints))]
+        return c
+
+    def cacheXML(self, c):
+        attrs = "".join(['\n        <groundspeak:attribute id="%d" inc="%d">%s</groundspeak:attribute>' % (aid, inc, escape(aname)) for ((aid, aname), inc) in c["attributes"]])
+        logs = "".join(["""
+        <groundspeak:log id="%d">
+          <groundspeak:date>%sZ</groundspeak:date>
+          <groundspeak:type>%s</groundspeak:type>
+          <groundspeak:finder id="%d">%s</groundspeak:finder>
+          <groundspeak:text encoded="False">%s</groundspeak:text>
+        </groundspeak:log>""" % (lid, isoTime(t), escape(ltype), lid % 100000, finder, escape(text)) for (lid, t, ltype, finder, text) in c["logs"]])
+        tbs = "".join(["""
+        <groundspeak:travelbug id="%d" ref="%s">
+          <groundspeak:name>%s</groundspeak:name>
+        </groundspeak:travelbug>""" % (tbid, ref, escape(name)) for (tbid, ref, name) in c["travelbugs"]])
+        return """  <wpt lat="%(lat).6f" lon="%(lon).6f">
+    <time>%(placed)s</time>
+    <name>%(gccode)s</name>
+    <desc>%(desc)s</desc>
+    <url>%(url)s</url>
+    <urlname>%(name)s</urlname>
+    <sym>Geocache</sym>
+    <type>Geocache|%(type)s</type>
+    <groundspeak:cache id="%(id)d" available="True" archived="False" xmlns:groundspeak="http://www.groundspeak.com/cache/1/0/1">
+      <groundspeak:name>%(name)s</groundspeak:name>
+      <groundspeak:placed_by>%(owner)s</groundspeak:placed_by>
+      <groundspeak:owner id="%(ownerid)s">%(owner)s</groundspeak:owner>
+      <groundspeak:type>%(type)s</groundspeak:type>
+      <groundspeak:container>%(container)s</groundspeak:container>
+      <groundspeak:attributes>%(attrs)s
+      </groundspeak:attributes>
+      <groundspeak:difficulty>%(difficulty)g</groundspeak:difficulty>
+      <groundspeak:terrain>%(terrain)g</groundspeak:terrain>
+      <groundspeak:country>Austria</groundspeak:country>
+      <groundspeak:state>%(state)s</groundspeak:state>
+      <groundspeak:short_description html="True">%(short)s</groundspeak:short_description>
+      <groundspeak:long_description html="True">%(long)s</groundspeak:long_description>
+      <groundspeak:encoded_hints>%(hint)s</groundspeak:encoded_hints>
+      <groundspeak:logs>%(logs)s
+      </groundspeak:logs>
+      <groundspeak:travelbugs>%(tbs)s
+      </groundspeak:travelbugs>
+    </groundspeak:cache>
+  </wpt>
+""" % {"lat": c["lat"], "lon": c["lon"], "placed": isoTime(c["placed"]), "gccode": c["gccode"],
+            "desc": escape("%s by %s, %s (%g/%g)" % (c["name"], c["owner"], c["type"], c["difficulty"], c["terrain"])),
+            "url": escape("%s/seek/cache_details.aspx?guid=%s" % (self.url_base, c["guid"])), "name": escape(c["name"]),
+            "type": escape(c["type"]), "id": c["id"], "owner": c["owner"], "ownerid": c["owner"][5:], "container": c["container"],
+            "attrs": attrs, "difficulty": c["difficulty"], "terrain": c["terrain"], "state": c["state"],
+            "short": escape(c["short"]), "long": escape(c["long"]), "hint": escape(c["hint"]), "logs": logs, "tbs": tbs}
+
+    def waypointsXML(self, rng, c):
+        xml = []
+        for (num, (prefix, wpttype, sym)) in enumerate(c["waypoints"]):
+            code = "%s%s%s" % (prefix[0], gccode_digits_[num % 31], c["gccode"][2:])
+            xml.append("""  <wpt lat="%.6f" lon="%.6f">
+    <time>%s</time>
+    <name>%s</name>
+    <cmt>%s</cmt>
+    <desc>%s</desc>
+    <url>%s</url>
+    <urlname>%s</urlname>
+    <sym>%s</sym>
+    <type>Waypoint|%s</type>
+  </wpt>
+""" % (c["lat"] + rng.uniform(-0.002, 0.002), c["lon"] + rng.uniform(-0.002, 0.002), isoTime(c["placed"]), code,
+                escape(sentence(rng, rng.randint(0, 12))), escape(wpttype), escape("%s/seek/wpt.aspx?WID=%s" % (self.url_base, guid(rng))), escape(wpttype), escape(sym), escape(wpttype)))
+        return "".join(xml)
+
+    def _open(self, filename, name, desc):
+        fh = open(filename, "wb")
+        fh.write(bom_[self.encoding])
+        header = gpx_header_ % {"name": escape(name), "desc": escape(desc), "time": isoTime(pq_time_) + "Z",
+            "minlat": self.center[0] - self.spread, "minlon": self.center[1] - self.spread, "maxlat": self.center[0] + self.spread, "maxlon": self.center[1] + self.spread}
+        self._write(fh, header.replace('encoding="utf-8"', 'encoding="%s"' % self.encoding))
+        return fh
+
+    def _write(self, fh, text):
+        fh.write(text.encode("utf_16_le" if self.encoding == "utf-16" else "utf-8"))
+
+    def _close(self, fh):
+        self._write(fh, "</gpx>\n")
+        fh.close()
+
+    def write(self, outdir):
+        # returns (pq files, additional waypoint files, geocache_logs.xml)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        rng = random.Random(self.seed)
+        pq_files = []
+        wpts_files = []
+        visits = []
+        (pq, wpts) = (None, None)
+        for n in range(self.caches):
+            if n % self.pq_size == 0:
+                if pq is not None:
+                    self._close(pq)
+                    self._close(wpts)
+                pqid = 1000000 + len(pq_files)
+                pq_files.append(os.path.join(outdir, "%d.gpx" % pqid))
+                wpts_files.append(os.path.join(outdir, "%d-wpts.gpx" % pqid))
+                pq = self._open(pq_files[-1], "Benchmark PQ %d" % len(pq_files), "Geocache file generated by Groundspeak")
+                wpts = self._open(wpts_files[-1], "Benchmark PQ %d Waypoints" % len(pq_files), "This is a list of supporting waypoints for caches generated by Groundspeak")
+            c = self.cache(rng, n)
+            self._write(pq, self.cacheXML(c))
+            self._write(wpts, self.waypointsXML(rng, c))
+            if rng.random() < self.found:
+                visits.append((c["gccode"], rng.random() < 0.9))
+        if pq is not None:
+            self._close(pq)
+            self._close(wpts)
+        logs_file = os.path.join(outdir, "geocache_logs.xml")
+        self.writeVisits(rng, logs_file, visits)
+        return (pq_files, wpts_files, logs_file)
+
+    def writeVisits(self, rng, filename, visits):
+        t = pq_time_
+        with open(filename, "w", encoding="utf-8") as fh:
+            fh.write('<?xml version="1.0" encoding="utf-8"?>\n<geocache_visits xmlns="http://www.garmin.com/xmlschemas/geocache_visits/v1">\n')
+            for (code, found) in visits:
+                t += datetime.timedelta(minutes=rng.randint(5, 600))
+                fh.write('<geocache_log><time>%sZ</time><code>%s</code><result>%s</result><comment>%s</comment></geocache_log>\n'
+                    % (isoTime(t), code, "found it" if found else "didn't find it", escape(sentence(rng, rng.randint(0, 6))) if rng.random() < 0.3 else ""))
+            fh.write('</geocache_visits>\n')
+
+
+if __name__ == '__main__':
+    outdir_ = None
+    options_ = {}
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "ho:c:s:l:b:w:f:", ["help","output=","caches=","pq-size=","logs=","travelbugs=","waypoints=","found=","center=","spread=","url-base=","encoding=","seed="])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-o","--output"]:
+                outdir_ = a
+            elif o in ["-c","--caches"]:
+                options_["caches"] = int(a)
+            elif o in ["-s","--pq-size"]:
+                options_["pq_size"] = int(a)
+            elif o in ["-l","--logs"]:
+                options_["logs"] = int(a)
+            elif o in ["-b","--travelbugs"]:
+                options_["travelbugs"] = int(a)
+            elif o in ["-w","--waypoints"]:
+                options_["waypoints"] = int(a)
+            elif o in ["-f","--found"]:
+                options_["found"] = float(a)
+            elif o in ["--center"]:
+                options_["center"] = tuple([float(x) for x in a.split(",")][:2])
+            elif o in ["--spread"]:
+                options_["spread"] = float(a)
+            elif o in ["--url-base"]:
+                options_["url_base"] = a
+            elif o in ["--encoding"]:
+                if a.lower() not in bom_:
+                    raise ValueError("unknown encoding %s" % a)
+                options_["encoding"] = a.lower()
+            elif o in ["--seed"]:
+                options_["seed"] = int(a)
+    except (getopt.GetoptError, ValueError) as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    if outdir_ is None:
+        print("ERROR: no output directory given", file=sys.stderr)
+        usage()
+        sys.exit(1)
+    (pq_files, wpts_files, logs_file) = PQGenerator(**options_).write(outdir_)
+    print("%d caches in %d pocket queries written to %s" % (options_.get("caches", 1000), len(pq_files), outdir_))
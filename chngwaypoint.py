@@ -4,14 +4,21 @@
 
 import sys, os
 import getopt
+import shutil
+import csv
 from lxml import etree
-import re
+import gpxlib
+import correctionslib
+from correctionslib import parseSingleCoordinate, parseCoords
+import profilelib
 from collections import namedtuple
 
 WPTInfo = namedtuple("WPTInfo",["lat","lon","shortdesc","longdesc","type"])
 empty_wptinfo_ = WPTInfo(*((None,)*5))
 
-try:
+# wx is only loaded when the dialog is actually shown, command-line use stays fast
+def initGUI():
+  global wx, ChngWPTDialog
   import wx
 
   def tupleSizeRestrict(a,maxsize,margin=0):
@@ -88,10 +95,6 @@ try:
       new_description = self.desc_txt.GetValue() if self.desc_chkbox.IsChecked() else None
       return WPTInfo(lat=new_latitude,lon=new_longitude,shortdesc=new_short_description,longdesc=new_description,type=new_type)
 
-  gui_available_ = True
-except ImportError:
-  gui_available_ = False
-
 def usage():
   print("Sytax:")
   print("       %s [options] <gpx-file> [more gpx files ...]" % (sys.argv[0]))
@@ -104,67 +107,146 @@ def usage():
   print("  -t [multi|tradi|myst] | --type <type>    Change Type")
   print("  -s <dir>              | --savedir <dir>  Save to directory")
   print("  -r                    | --rename         Rename to GCCODE_name.gpx")
+  print("  -b <file>             | --batch <file>   Apply the corrections in a csv or json file")
+  print("                                           to the waypoints with matching gccode")
   print("  -g                    | --gui           Display GUI (default if no option given)")
+  print("                          --profile <file> Write a profile (pstats, collapsed stacks if <file> ends in .folded)")
+  print("                          --trace-memory   Print peak memory at exit")
   print("  -h                    | --help          Show Help")
-
-RE_SINGLECOORD=re.compile(r"([NEOWS+-])?\s*(?:(\d{1,3})\D+(\d{1,2}\.\d{3})|(\d{1,3}\.\d{1,7}))")
-def parseSingleCoordinate(t):
-  t = t.replace(",",".")
-  m = RE_SINGLECOORD.search(t)
-  coord=None
-  if not m is None:
-    if m.group(2) and m.group(3):
-      coord=float(m.group(2))+(float(m.group(3))/60.0)
-    else:
-      coord=float(m.group(4))
-    if not m.group(1) is None and m.group(1) in "SW-":
-      coord *= -1
-  else:
-    try:
-      coord=float(t)
-    except:
-      pass
-  return coord
-
-RE_NSWECOORDS=re.compile(r"([NS+-].+)\s+([WEO+-].+)",re.IGNORECASE)
-RE_WENSCOORDS=re.compile(r"([WEO+-].+)\s+([NS+-].+)",re.IGNORECASE)
-RE_DECCOORDS=re.compile(r"((?:[+-]\s*)?\d+[.,]\d+)(?:\s+|\s*[,;]\s*)((?:[+-]\s*)?\d+[.,]\d+)",re.IGNORECASE)
-def parseCoords(t):
-  coords=(None,None)
-  m1 = RE_NSWECOORDS.search(t)
-  m2 = RE_WENSCOORDS.search(t)
-  m3 = RE_DECCOORDS.search(t)
-  if not m1 is None:
-    coords = (parseSingleCoordinate(m1.group(1)),parseSingleCoordinate(m1.group(2)))
-  elif not m2 is None:
-    coords = (parseSingleCoordinate(m2.group(2)),parseSingleCoordinate(m2.group(1)))
-  elif not m3 is None:
-    coords = (parseSingleCoordinate(m3.group(1)),parseSingleCoordinate(m3.group(2)))
-  return coords
+  print("Batch file:")
+  print("  csv with a header line and the columns gccode,coords,lat,lon,type,shortdesc,desc (all but gccode optional)")
+  print("  or json: {\"GC12345\": {\"coords\": \"N48 12.345 E016 23.456\", \"type\": \"tradi\"}, ...}")
 
 def changedCoordsString(new_latitude, new_longitude):
   return (u"New Latitude: %.4f" % new_latitude if not new_latitude is None else u"Latitude unchanged") +"  "+ ("New Longitude: %.4f" % new_longitude if not new_longitude is None else u"Longitude unchanged")
 
 def parseGPXFile(gpxfile):
-  with open(gpxfile, mode="rb") as f:
-    parser = etree.XMLParser()
-    tree = etree.parse(f,parser).getroot()
   try:
-    wpt_elem = tree.find("{http://www.topografix.com/GPX/1/0}wpt",namespaces=tree.nsmap)
-    type_elem = wpt_elem.find("..//{http://www.groundspeak.com/cache/1/0}type",namespaces=tree.nsmap)
+    wpt = next(iter(gpxlib.GPXReader(gpxfile, clear=False)))
+    type_elem = gpxlib.findGroundspeakChild(wpt.cache, "type")
     cachetype = (type_elem.text or '')
-    sdesc_elem = wpt_elem.find("..//{http://www.groundspeak.com/cache/1/0}short_description",namespaces=tree.nsmap)
-    ldesc_elem = wpt_elem.find("..//{http://www.groundspeak.com/cache/1/0}long_description",namespaces=tree.nsmap)
-    sdesc = (sdesc_elem.text or '') + '\n'.join([html.tostring(child) for child in sdesc_elem.iterchildren()])
-    ldesc = (ldesc_elem.text or '') + '\n'.join([html.tostring(child) for child in ldesc_elem.iterchildren()])
-    return WPTInfo(lat=float(wpt_elem.get("lat")),lon=float(wpt_elem.get("lon")),shortdesc=sdesc,longdesc=ldesc,type=cachetype)
+    sdesc_elem = gpxlib.findGroundspeakChild(wpt.cache, "short_description")
+    ldesc_elem = gpxlib.findGroundspeakChild(wpt.cache, "long_description")
+    sdesc = (sdesc_elem.text or '') + '\n'.join([etree.tostring(child) for child in sdesc_elem.iterchildren()])
+    ldesc = (ldesc_elem.text or '') + '\n'.join([etree.tostring(child) for child in ldesc_elem.iterchildren()])
+    return WPTInfo(lat=wpt.lat,lon=wpt.lon,shortdesc=sdesc,longdesc=ldesc,type=cachetype)
   except Exception, e:
     print "GPX Parse Error:", e
     return empty_wptinfo_
 
+def updateWaypoint(elem, wpt, wptinfo):
+  # applies wptinfo to a <wpt>, returns the names of what was changed
+  changed = []
+  if not wptinfo.lat is None:
+    elem.set("lat",str(wptinfo.lat))
+    changed.append("latitude")
+  if not wptinfo.lon is None:
+    elem.set("lon",str(wptinfo.lon))
+    changed.append("longitude")
+  for cache_elem in elem:
+    if not wptinfo.type is None and gpxlib.isGPXTag(cache_elem.tag, "type"):
+      cache_elem.text = "Geocache|"+wptinfo.type
+      changed.append("cachetype")
+  if wpt.cache is not None:
+    for desc_elem in wpt.cache:
+      if not wptinfo.type is None and gpxlib.isGroundspeakTag(desc_elem.tag, "type"):
+        desc_elem.text = wptinfo.type
+      elif not wptinfo.shortdesc is None and gpxlib.isGroundspeakTag(desc_elem.tag, "short_description"):
+        desc_elem.set("html","True")
+        desc_elem.text=wptinfo.shortdesc
+        changed.append("short-description with given html text")
+      elif not wptinfo.longdesc is None and gpxlib.isGroundspeakTag(desc_elem.tag, "long_description"):
+        desc_elem.set("html","True")
+        desc_elem.text=wptinfo.longdesc
+        changed.append("long-description with given html text")
+  return changed
+
+def setBounds(elem, bounds):
+  for (name, value) in zip(["minlat","minlon","maxlat","maxlon"], bounds):
+    if not value is None:
+      elem.set(name, str(value))
+
+def changeWaypoint(elem, wpt, wptinfo, state):
+  # only the first waypoint of a file is changed, state remembers its code and name
+  if gpxlib.isGPXTag(elem.tag, "bounds"):
+    setBounds(elem, (wptinfo.lat, wptinfo.lon, wptinfo.lat, wptinfo.lon))
+  if wpt is None or "gccode" in state:
+    return elem
+  state["gccode"] = wpt.code
+  state["gcname"] = wpt.name
+  for what in updateWaypoint(elem, wpt, wptinfo):
+    print("* updated %s" % what)
+  return elem
+
+def parseType(t):
+  return cache_type_map.get(t, t)
+
+def loadCorrections(filename):
+  # {gccode: WPTInfo} from a csv or json corrections file, see correctionslib.py
+  return dict([(gccode, WPTInfo(lat=c.lat, lon=c.lon, shortdesc=c.shortdesc, longdesc=c.desc, type=parseType(c.type) if c.type else None))
+    for (gccode, c) in correctionslib.loadCorrections(filename).items()])
+
+def correctedBounds(positions, corrections):
+  # (minlat, minlon, maxlat, maxlon) of all waypoints after applying corrections
+  lats = []
+  lons = []
+  for (code, lat, lon) in positions:
+    wptinfo = corrections.get(code, empty_wptinfo_)
+    lat = wptinfo.lat if not wptinfo.lat is None else lat
+    lon = wptinfo.lon if not wptinfo.lon is None else lon
+    if not lat is None and not lon is None:
+      lats.append(lat)
+      lons.append(lon)
+  if not lats:
+    return (None, None, None, None)
+  return (min(lats), min(lons), max(lats), max(lons))
+
+def batchChangeWaypoint(elem, wpt, corrections, bounds, state):
+  if gpxlib.isGPXTag(elem.tag, "bounds"):
+    setBounds(elem, bounds)
+  if wpt is None:
+    return elem
+  if not "gccode" in state:
+    state["gccode"] = wpt.code
+    state["gcname"] = wpt.name
+  if wpt.code in corrections:
+    state["found"].add(wpt.code)
+    print("* %s: updated %s" % (wpt.code, ", ".join(updateWaypoint(elem, wpt, corrections[wpt.code]))))
+  return elem
+
+def moveGPXFile(gpxfile, state):
+  # renames and/or moves gpxfile as requested by --rename and --savedir
+  gcname = state.get("gcname")
+  gccode = state.get("gccode")
+
+  (gpxdir, gpxfilename) = os.path.split(gpxfile)
+  if autorename_ and gcname and gccode:
+    gpxfilename = "%s_%s%s" % (gccode,filter(lambda x: x in u"_ -abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", gcname)[:25], os.path.splitext(gpxfilename)[1])
+  if not savedir_ is None:
+    gpxdir = savedir_
+  dst_gpxfile = os.path.join(gpxdir,gpxfilename)
+  if dst_gpxfile != gpxfile:
+    shutil.move(gpxfile, dst_gpxfile)
+  print("* successfully written %s" % dst_gpxfile)
+
+def runBatch(files, corrections):
+  # one streaming pass over every file that contains a corrected waypoint,
+  # a quick scan beforehand finds those files and the new <bounds>
+  found = set()
+  for gpxfile in files:
+    positions = gpxlib.waypointPositions(gpxfile)
+    if not any([code in corrections for (code, lat, lon) in positions]):
+      print("%s: no waypoint to correct" % gpxfile)
+      continue
+    bounds = correctedBounds(positions, corrections)
+    state = {"found": found}
+    gpxlib.rewriteGPX(gpxfile, gpxfile, lambda elem, wpt: batchChangeWaypoint(elem, wpt, corrections, bounds, state))
+    moveGPXFile(gpxfile, state)
+  for gccode in sorted(set(corrections) - found):
+    print("Warning: %s not found in any file" % gccode)
 
 try:
-  opts, files = getopt.gnu_getopt(sys.argv[1:], "hrgc:k:d:t:s:", ["help","gui","rename","coordinates=","longitude=","latitude=","shortdescription=","description=","type=","savedir="])
+  opts, files = getopt.gnu_getopt(sys.argv[1:], "hrgc:k:d:t:s:b:", ["help","gui","rename","coordinates=","longitude=","latitude=","shortdescription=","description=","type=","savedir=","batch=","profile=","trace-memory"])
 except getopt.GetoptError as e:
   print "ERROR: Invalid Option: " +str(e)
   usage()
@@ -174,6 +256,9 @@ new_wptinfo_ = empty_wptinfo_
 savedir_ = None
 autorename_ = False
 display_dialog_ = False
+batch_file_ = None
+profile_file_ = None
+trace_memory_ = False
 
 cache_type_map={"multi":"Multi-cache","tradi":"Traditional Cache","myst":"Unknown Cache","cito":"Cache In Trash Out Event","event":"Event Cache","megaevent":"Mega-Event Cache","letterbox":"Letterbox Hybrid","earth":"Earthcache"}
 for o, a in opts:
@@ -184,6 +269,8 @@ for o, a in opts:
     autorename_=True
   elif o in "--gui":
     display_dialog_=True
+  elif o in "--batch":
+    batch_file_=a
   elif o in "--coordinates":
     (lat,lon) = parseCoords(a.strip())
     new_wptinfo_ = WPTInfo(lat=lat, lon=lon, shortdesc=new_wptinfo_.shortdesc, longdesc=new_wptinfo_.longdesc, type=new_wptinfo_.type)
@@ -201,19 +288,39 @@ for o, a in opts:
     else:
       print "Not a directory:", a
   elif o in "--type":
-    if a in cache_type_map:
-      new_wptinfo_ = WPTInfo(lat=new_wptinfo_.lat, lon=new_wptinfo_.lon, shortdesc=new_wptinfo_.shortdesc, longdesc=new_wptinfo_.longdesc,type=cache_type_map[a])
-    else:
-      new_wptinfo_ = WPTInfo(lat=new_wptinfo_.lat, lon=new_wptinfo_.lon, shortdesc=new_wptinfo_.shortdesc, longdesc=new_wptinfo_.longdesc,type=a)
+    new_wptinfo_ = WPTInfo(lat=new_wptinfo_.lat, lon=new_wptinfo_.lon, shortdesc=new_wptinfo_.shortdesc, longdesc=new_wptinfo_.longdesc,type=parseType(a))
+    if not a in cache_type_map:
       sys.stdout.write("Warning: Cachetype unknown, using raw string.")
     print "New Cachetype:", new_wptinfo_.type
+  elif o in "--profile":
+    profile_file_=a
+  elif o in "--trace-memory":
+    trace_memory_=True
+profilelib.start(profile_file_, trace_memory_)
 
 
 if len(files) <1:
   usage()
   sys.exit()
 
+if not batch_file_ is None:
+  if new_wptinfo_ != empty_wptinfo_ or display_dialog_:
+    print "ERROR: --batch can not be combined with other changes or --gui"
+    sys.exit(1)
+  try:
+    corrections_ = loadCorrections(batch_file_)
+  except (IOError, ValueError, csv.Error) as e:
+    print "ERROR: could not read %s: %s" % (batch_file_, e)
+    sys.exit(1)
+  runBatch(files, corrections_)
+  sys.exit()
+
 if display_dialog_ or new_wptinfo_.lat == new_wptinfo_.lon == new_wptinfo_.longdesc == new_wptinfo_.type == None:
+  try:
+    initGUI()
+    gui_available_ = True
+  except ImportError:
+    gui_available_ = False
   if gui_available_:
     wxapp = wx.App()
     dial = ChngWPTDialog(None, "Change "+",".join(files),
@@ -230,65 +337,6 @@ if display_dialog_ or new_wptinfo_.lat == new_wptinfo_.lon == new_wptinfo_.longd
 print changedCoordsString(new_wptinfo_.lat, new_wptinfo_.lon)
 
 for gpxfile in files:
-  tree = None
-  gcname = None
-  gccode = None
-  with open(gpxfile, mode="rb") as f:
-    parser = etree.XMLParser()
-    tree = etree.parse(f,parser).getroot()
-
-  for wpt_elem in tree:
-    if wpt_elem.tag[-6:] == "bounds":
-      if not new_wptinfo_.lat is None:
-        wpt_elem.set("minlat",str(new_wptinfo_.lat))
-        wpt_elem.set("maxlat",str(new_wptinfo_.lat))
-      if not new_wptinfo_.lon is None:
-        wpt_elem.set("minlon",str(new_wptinfo_.lon))
-        wpt_elem.set("maxlon",str(new_wptinfo_.lon))
-
-    if wpt_elem.tag[-3:] == "wpt":
-      if not new_wptinfo_.lat is None:
-        wpt_elem.set("lat",str(new_wptinfo_.lat))
-        print("* updated latitude");
-      if not new_wptinfo_.lon is None:
-        wpt_elem.set("lon",str(new_wptinfo_.lon))
-        print("* updated longitude");
-
-      if autorename_ or not (new_wptinfo_.longdesc is None and new_wptinfo_.type is None and new_wptinfo_.shortdesc is None):
-        for cache_elem in wpt_elem:
-          if cache_elem.tag[-7:] == "urlname":
-            gcname = cache_elem.text
-          elif cache_elem.tag[-4:] == "name":
-            gccode = cache_elem.text
-          elif not new_wptinfo_.type is None and cache_elem.tag[-4:] == "type":
-            cache_elem.text = "Geocache|"+new_wptinfo_.type
-            print("* updated cachetype");
-          elif cache_elem.tag[-5:] == "cache":
-            for desc_elem in cache_elem:
-              if not new_wptinfo_.type is None and desc_elem.tag[-4:] == "type":
-                desc_elem.text = new_wptinfo_.type
-              elif not new_wptinfo_.shortdesc is None and desc_elem.tag[-17:] == "short_description":
-                desc_elem.set("html","True")
-                desc_elem.text=new_wptinfo_.shortdesc
-                print("* updated short-description with given html text");
-              elif not new_wptinfo_.longdesc is None and desc_elem.tag[-16:] == "long_description":
-                desc_elem.set("html","True")
-                desc_elem.text=new_wptinfo_.longdesc
-                print("* updated long-description with given html text");
-      break
-
-  data = etree.tostring(tree,method="xml",xml_declaration=True,encoding="utf-8")
-
-  (gpxdir, gpxfilename) = os.path.split(gpxfile)
-  if autorename_ and gcname and gccode:
-    gpxfilename = "%s_%s%s" % (gccode,filter(lambda x: x in u"_ -abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", gcname)[:25], os.path.splitext(gpxfilename)[1])
-  if not savedir_ is None:
-    gpxdir = savedir_
-  dst_gpxfile = os.path.join(gpxdir,gpxfilename)
-  with open(dst_gpxfile,mode="wb") as f:
-    f.truncate()
-    f.write(data)
-  print("* successfully written %s" % dst_gpxfile)
-  if dst_gpxfile != gpxfile:
-    os.unlink(gpxfile)
-
+  state = {}
+  gpxlib.rewriteGPX(gpxfile, gpxfile, lambda elem, wpt: changeWaypoint(elem, wpt, new_wptinfo_, state))
+  moveGPXFile(gpxfile, state)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Coordinates as people type them and the corrections files of
+# chngwaypoint.py --batch and gc_update_coordinates.py:
+#   csv with a header line and the columns gccode,coords,lat,lon,type,shortdesc,desc
+#   (all but gccode optional) or json
+#   {"GC12345": {"coords": "N48 12.345 E016 23.456", "type": "tradi"}, ...}
+# coords, lat and lon take everything parseCoords and parseSingleCoordinate do,
+# e.g. "N48 12.345 E016 23.456", "48.2058 16.3951" or -16.3951.
+
+from __future__ import print_function
+import os
+import re
+import sys
+import csv
+import json
+from collections import namedtuple
+
+Correction = namedtuple("Correction", ["lat", "lon", "type", "shortdesc", "desc"])
+
+RE_SINGLECOORD=re.compile(r"([NEOWS+-])?\s*(?:(\d{1,3})\D+(\d{1,2}\.\d{3})|(\d{1,3}\.\d{1,7}))")
+def parseSingleCoordinate(t):
+    t = t.replace(",",".")
+    m = RE_SINGLECOORD.search(t)
+    coord=None
+    if not m is None:
+        if m.group(2) and m.group(3):
+            coord=float(m.group(2))+(float(m.group(3))/60.0)
+        else:
+            coord=float(m.group(4))
+        if not m.group(1) is None and m.group(1) in "SW-":
+            coord *= -1
+    else:
+        try:
+            coord=float(t)
+        except:
+            pass
+    return coord
+
+RE_NSWECOORDS=re.compile(r"([NS+-].+)\s+([WEO+-].+)",re.IGNORECASE)
+RE_WENSCOORDS=re.compile(r"([WEO+-].+)\s+([NS+-].+)",re.IGNORECASE)
+RE_DECCOORDS=re.compile(r"((?:[+-]\s*)?\d+[.,]\d+)(?:\s+|\s*[,;]\s*)((?:[+-]\s*)?\d+[.,]\d+)",re.IGNORECASE)
+def parseCoords(t):
+    coords=(None,None)
+    m1 = RE_NSWECOORDS.search(t)
+    m2 = RE_WENSCOORDS.search(t)
+    m3 = RE_DECCOORDS.search(t)
+    if not m1 is None:
+        coords = (parseSingleCoordinate(m1.group(1)),parseSingleCoordinate(m1.group(2)))
+    elif not m2 is None:
+        coords = (parseSingleCoordinate(m2.group(2)),parseSingleCoordinate(m2.group(1)))
+    elif not m3 is None:
+        coords = (parseSingleCoordinate(m3.group(1)),parseSingleCoordinate(m3.group(2)))
+    return coords
+
+
+def _value(row, key):
+    # stripped unicode text of a csv cell or json value, None if empty
+    value = row.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    value = (u"%s" % value).strip()
+    return value if value != u"" else None
+
+def _jsonRow(gccode, value):
+    # gc_update_coordinates.py also takes {"GC12345": [48.2, 16.3]}
+    if isinstance(value, (list, tuple)):
+        value = {"lat": value[0], "lon": value[1]}
+    return dict(value, gccode=gccode)
+
+def _coordinate(gccode, row, key):
+    coord = parseSingleCoordinate(_value(row, key))
+    if coord is None:
+        raise ValueError("%s: can not parse %s %s" % (gccode, key, _value(row, key)))
+    return coord
+
+def _openText(filename):
+    if sys.version_info[0] < 3:
+        return open(filename, "rb")
+    return open(filename, "r", encoding="utf-8", newline="")
+
+def loadCorrections(filename):
+    # {GCCODE: Correction} from a csv or json corrections file, fields that
+    # are not given are None. Coordinates that can not be parsed raise ValueError.
+    with _openText(filename) as fh:
+        if os.path.splitext(filename)[1].lower() == ".json":
+            data = json.load(fh)
+            rows = [_jsonRow(k, v) for (k, v) in data.items()] if isinstance(data, dict) else data
+        else:
+            rows = list(csv.DictReader(fh))
+    corrections = {}
+    for row in rows:
+        gccode = _value(row, "gccode")
+        if gccode is None:
+            continue
+        (lat, lon) = (None, None)
+        if _value(row, "coords"):
+            (lat, lon) = parseCoords(_value(row, "coords"))
+            if lat is None or lon is None:
+                raise ValueError("%s: can not parse coords %s" % (gccode, _value(row, "coords")))
+        if _value(row, "lat"):
+            lat = _coordinate(gccode, row, "lat")
+        if _value(row, "lon"):
+            lon = _coordinate(gccode, row, "lon")
+        corrections[gccode.upper()] = Correction(lat=lat, lon=lon, type=_value(row, "type"),
+            shortdesc=_value(row, "shortdesc"), desc=_value(row, "desc"))
+    return corrections
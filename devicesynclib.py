@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Mirrors a directory (pocketqueries, GeocachePhotos, ...) onto a GPS
+# mounted as USB mass storage, copying only what changed.
+# A manifest in the device directory remembers for every file it copied
+# size and mtime of the source, the md5 of the content and size and mtime
+# of the copy on the device. A file is copied again only if its source
+# changed. Changes made on the device itself, e.g. found caches purged by
+# gc_garmingps.py, are kept until then.
+
+from __future__ import print_function
+import os
+import json
+import errno
+import fnmatch
+import tempfile
+import shutil
+from hashlib import md5
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from filelib import fileState, replaceFile, fsyncFile
+
+manifest_name_ = ".gctools-sync.json"
+manifest_version_ = 1
+copy_bufsize_ = 1024 * 1024
+# small files are handed to the copy threads in batches of this size
+batch_max_bytes_ = 8 * 1024 * 1024
+batch_max_files_ = 64
+# bookkeeping files of other gctools that have no business on the device
+exclude_patterns_ = ["*.mergeindex"]
+
+# action: "copy", "delete" or "keep"; reason says why
+SyncAction = namedtuple("SyncAction", ["action", "path", "size", "reason"])
+# result of one copy, entry is the new manifest entry, None on error
+SyncResult = namedtuple("SyncResult", ["path", "copied", "entry", "error"])
+
+
+def _join(root, relpath):
+    return os.path.join(root, *relpath.split("/"))
+
+def fileMD5(filename):
+    digest = md5()
+    with open(filename, "rb") as fh:
+        _dropCache(fh)
+        for chunk in iter(lambda: fh.read(copy_bufsize_), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _dropCache(fh):
+    # so verifying reads what is on the device, not what is still in the page cache
+    fadvise = getattr(os, "posix_fadvise", None)
+    if fadvise is not None:
+        try:
+            fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+def _makedirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def listTree(root):
+    # relative paths with "/" of all files below root, hidden files (and our
+    # temp files) and exclude_patterns_ excluded
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames[:] = sorted([d for d in dirnames if not d.startswith(".")])
+        reldir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        for fn in sorted(filenames):
+            if not fn.startswith(".") and not [p for p in exclude_patterns_ if fnmatch.fnmatch(fn, p)]:
+                files.append(fn if reldir == "." else reldir + "/" + fn)
+    return files
+
+def copyFile(src, dst, verify=True):
+    # copies via a temp file next to dst, fsyncs and renames it over dst,
+    # then reads dst back and compares md5. Returns the md5.
+    _makedirs(os.path.dirname(dst))
+    (fd, tmpfile) = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(dst))
+    digest = md5()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            with open(src, "rb") as fh:
+                for chunk in iter(lambda: fh.read(copy_bufsize_), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+            fsyncFile(out)
+        st = os.stat(src)
+        try:
+            os.utime(tmpfile, (st.st_atime, st.st_mtime))
+            shutil.copymode(src, tmpfile)
+        except OSError:
+            pass  # e.g. FAT devices
+        replaceFile(tmpfile, dst)
+    except:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        raise
+    if verify and fileMD5(dst) != digest.hexdigest():
+        raise IOError("verification of %s failed, the device returned different data" % dst)
+    return digest.hexdigest()
+
+
+class DeviceSync(object):
+    # sync = DeviceSync(source_dir, device_dir)
+    # actions = sync.plan()
+    # results = sync.run(actions)
+    def __init__(self, source_dir, device_dir, manifest_file=None, delete=True, repair=False, verify=True, jobs=4):
+        self.source_dir = source_dir
+        self.device_dir = device_dir
+        self.manifest_file = manifest_file or os.path.join(device_dir, manifest_name_)
+        self.delete = delete
+        self.repair = repair
+        self.verify = verify
+        self.jobs = jobs
+        self.files = self.loadManifest()
+
+    def loadManifest(self):
+        try:
+            with open(self.manifest_file, "r") as fh:
+                data = json.load(fh)
+            if data.get("version") == manifest_version_:
+                return data["files"]
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            pass
+        return {}
+
+    def saveManifest(self):
+        _makedirs(os.path.dirname(os.path.abspath(self.manifest_file)))
+        (fd, tmpfile) = tempfile.mkstemp(prefix=".", suffix=".json.tmp", dir=os.path.dirname(os.path.abspath(self.manifest_file)))
+        with os.fdopen(fd, "w") as fh:
+            json.dump({"version": manifest_version_, "files": self.files}, fh, indent=0, sort_keys=True)
+            fsyncFile(fh)
+        replaceFile(tmpfile, self.manifest_file)
+
+    def plan(self):
+        actions = []
+        source_files = listTree(self.source_dir)
+        for relpath in source_files:
+            src_state = fileState(_join(self.source_dir, relpath))
+            entry = self.files.get(relpath)
+            if entry is None:
+                actions.append(SyncAction("copy", relpath, src_state[0], "new"))
+            elif entry["src"] != src_state:
+                actions.append(SyncAction("copy", relpath, src_state[0], "changed"))
+            elif self.repair and entry["dst"] != fileState(_join(self.device_dir, relpath)):
+                actions.append(SyncAction("copy", relpath, src_state[0], "changed on device"))
+            else:
+                actions.append(SyncAction("keep", relpath, src_state[0], "unchanged"))
+        if self.delete:
+            source_set = set(source_files)
+            for relpath in sorted(self.files):
+                if relpath not in source_set:
+                    actions.append(SyncAction("delete", relpath, 0, "removed from source"))
+        return actions
+
+    def _copy(self, relpath):
+        src = _join(self.source_dir, relpath)
+        dst = _join(self.device_dir, relpath)
+        src_state = fileState(src)
+        entry = self.files.get(relpath)
+        dst_state = fileState(dst)
+        try:
+            if dst_state is not None and dst_state[0] == src_state[0] and (entry is None or entry["dst"] == dst_state):
+                # touched but unchanged source, or a device filled by hand: skip identical files
+                digest = fileMD5(src)
+                if (entry is not None and entry["md5"] == digest) or fileMD5(dst) == digest:
+                    return SyncResult(relpath, False, {"src": src_state, "md5": digest, "dst": dst_state}, None)
+            digest = copyFile(src, dst, self.verify)
+            return SyncResult(relpath, True, {"src": src_state, "md5": digest, "dst": fileState(dst)}, None)
+        except (IOError, OSError) as e:
+            return SyncResult(relpath, False, None, e)
+
+    def _copyBatch(self, relpaths):
+        return [self._copy(relpath) for relpath in relpaths]
+
+    def _batches(self, actions):
+        batch = []
+        size = 0
+        for a in actions:
+            if batch and (size + a.size > batch_max_bytes_ or len(batch) >= batch_max_files_):
+                yield batch
+                (batch, size) = ([], 0)
+            batch.append(a.path)
+            size += a.size
+        if batch:
+            yield batch
+
+    def _deleteFile(self, relpath):
+        dst = _join(self.device_dir, relpath)
+        try:
+            os.unlink(dst)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                return e
+        # remove directories that became empty, but never the device directory itself
+        dirname = os.path.dirname(dst)
+        while os.path.abspath(dirname) != os.path.abspath(self.device_dir):
+            try:
+                os.rmdir(dirname)
+            except OSError:
+                break
+            dirname = os.path.dirname(dirname)
+        return None
+
+    def run(self, actions, callback=None):
+        # carries out the actions of plan(), copies in parallel. callback(action, result)
+        # is called for every copied or deleted file. The manifest is saved even if
+        # something fails on the way. Returns the list of SyncResults.
+        copies = dict([(a.path, a) for a in actions if a.action == "copy"])
+        results = []
+        pool = ThreadPool(max(1, self.jobs))
+        try:
+            for batch_results in pool.imap_unordered(self._copyBatch, self._batches([copies[p] for p in sorted(copies)])):
+                for r in batch_results:
+                    if r.entry is not None:
+                        self.files[r.path] = r.entry
+                    results.append(r)
+                    if callback is not None:
+                        callback(copies[r.path], r)
+            for a in actions:
+                if a.action == "delete":
+                    error = self._deleteFile(a.path)
+                    if error is None:
+                        del self.files[a.path]
+                    r = SyncResult(a.path, False, None, error)
+                    results.append(r)
+                    if callback is not None:
+                        callback(a, r)
+        finally:
+            pool.close()
+            pool.join()
+            self.saveManifest()
+        return results
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Small file helpers for writing safely to slow or removable storage.
+# Kept free of lxml so device tools can use them without it.
+
+import os
+import shutil
+
+
+def fileState(filename):
+    # [size, mtime in ns] to notice changed files, None if the file does not exist
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size, getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))]
+
+def copyFileMode(tmpfile, dst):
+    # mkstemp creates 0600, give tmpfile the mode of the dst it is going to
+    # replace or the mode a new file would get under the umask
+    if os.path.exists(dst):
+        shutil.copymode(dst, tmpfile)
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpfile, 0o666 & ~umask)
+
+def replaceFile(src, dst):
+    # atomic on POSIX, python2 has no os.replace
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        if os.name == "nt" and os.path.exists(dst):
+            os.unlink(dst)
+        os.rename(src, dst)
+    fsyncDir(os.path.dirname(os.path.abspath(dst)))
+
+def fsyncFile(fh):
+    fh.flush()
+    os.fsync(fh.fileno())
+
+def fsyncDir(dirname):
+    # makes a rename in dirname durable, not possible on every OS/filesystem
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
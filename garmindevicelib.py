@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Offline part of gctools: reading what Garmin devices store.
+# Unlike geocachingsitelib this never loads the network stack,
+# so tools working only on device data start fast.
+
+from __future__ import print_function
+import re
+import sys
+import codecs
+from hashlib import md5
+from collections import namedtuple
+
+GarminFieldLog = namedtuple("GarminFieldLog",["gccode","date","time","type","comment"])
+
+garmin_visits_ns_ = "{http://www.garmin.com/xmlschemas/geocache_visits/v1}"
+# bytes in front of the last read position that have to be unchanged to continue from there
+visits_check_bytes_ = 4096
+re_first_start_tag_ = re.compile(u"<[A-Za-z_][^>]*>")
+gc_debug = False
+
+
+def _debug_print(context,*args):
+    if gc_debug:
+        print(u"\n\n=============== %s ===============" % context,file=sys.stderr)
+        print(*args,file=sys.stderr)
+
+def _visits_encoding(data):
+    for (bom, codec) in [(codecs.BOM_UTF16_LE, "utf_16_le"), (codecs.BOM_UTF16_BE, "utf_16_be"), (codecs.BOM_UTF8, "utf_8_sig")]:
+        if data.startswith(bom):
+            return codec
+    return "utf_8"
+
+def _visits_parser(codec):
+    from lxml import etree
+    return etree.XMLParser(encoding="utf-8") if codec.startswith("utf_8") else etree.XMLParser()
+
+def _visits_to_logs(tree):
+    rv = []
+    for log_elem in tree:
+        timedate=log_elem.find("./%stime" % garmin_visits_ns_).text
+        rv.append(GarminFieldLog(gccode=log_elem.find("./%scode" % garmin_visits_ns_).text,
+                                                date=timedate[0:10],
+                                                time=timedate[11:19],
+                                                type=log_elem.find("./%sresult" % garmin_visits_ns_).text,
+                                                comment=log_elem.find("./%scomment" % garmin_visits_ns_).text))
+    return rv
+
+def read_garmin_fieldnotes_xml(filename):
+    from lxml import etree
+    with open(filename,"rb") as fh:
+        tree = etree.parse(fh, etree.XMLParser(encoding="utf-8")).getroot()
+    rv = _visits_to_logs(tree)
+    _debug_print("read_garmin_fieldnotes_xml", "%d logs read from %s" % (len(rv), filename))
+    return rv
+
+def _visits_position(data, codec):
+    # where the next visit will be appended (the end tag of the root) and
+    # checksums of what comes before, None if the file looks unusual
+    head = data[:1024].decode(codec, "ignore")
+    m = re_first_start_tag_.search(head)
+    end = data.rfind(u"</".encode(codec))
+    if m is None or m.group(0).endswith(u"/>") or end < 0:
+        return None
+    head_len = len(head[:m.end()].encode(codec))
+    return {"head": head_len, "head_md5": md5(data[:head_len]).hexdigest(), "offset": end,
+        "md5": md5(data[max(head_len, end - visits_check_bytes_):end]).hexdigest()}
+
+def read_new_garmin_fieldnotes_xml(filename, position=None):
+    # Only parses the visits the device appended since a previous call
+    # returned position. Returns (logs, new position, True) or, if the file
+    # was changed in any other way, (all logs, new position, False).
+    from lxml import etree
+    with open(filename,"rb") as fh:
+        data = fh.read()
+    codec = _visits_encoding(data)
+    new_position = _visits_position(data, codec)
+    if position and new_position and position["offset"] <= new_position["offset"] \
+            and md5(data[:position["head"]]).hexdigest() == position["head_md5"] \
+            and md5(data[max(position["head"], position["offset"] - visits_check_bytes_):position["offset"]]).hexdigest() == position["md5"]:
+        tree = etree.fromstring(data[:position["head"]] + data[position["offset"]:], _visits_parser(codec))
+        rv = _visits_to_logs(tree)
+        _debug_print("read_new_garmin_fieldnotes_xml", "%d new logs read from %s" % (len(rv), filename))
+        return (rv, new_position, True)
+    tree = etree.fromstring(data, _visits_parser(codec))
+    rv = _visits_to_logs(tree)
+    _debug_print("read_new_garmin_fieldnotes_xml", "%d logs read from %s" % (len(rv), filename))
+    return (rv, new_position, False)
@@ -3,40 +3,86 @@
 # (c) Bernhard Tittelbach <xro@gmx.net>
 # License: public domain, attribution appreciated
 
+import re
 import sys
 import getopt
 from lxml import etree
 import geocachingsitelib as gc
+import gpxlib
+import waypointdblib
+import profilelib
 
 show_vote_string_="GCVote: %s (%s votes)"
+# a vote line added by an earlier run, replaced instead of adding a second one
+re_vote_line_=re.compile(r"^GCVote: [^<\n]* \(\d+ votes\)<br/>\n?")
 gc_guid_uri_='http://www.geocaching.com/seek/cache_details.aspx?guid='
-xml_parser_ = etree.XMLParser(encoding="utf-8")
 use_median_=True
 
+def getGUID(wpt):
+  if wpt.url and wpt.url.startswith(gc_guid_uri_):
+    return wpt.url[len(gc_guid_uri_):]
+  return None
+
+def currentVote(wpt):
+  # the vote line already in short_description, None if there is none
+  sdesc_elem = gpxlib.findGroundspeakChild(wpt.cache, "short_description")
+  if sdesc_elem is None:
+    return None
+  m = re_vote_line_.match(sdesc_elem.text or "")
+  return m.group(0) if m else None
+
+def voteLine(votes):
+  return show_vote_string_ % votes + "<br/>\n"
+
+def addVote(wpt, votes_dict):
+  # returns True if short_description was changed
+  sdesc_elem = gpxlib.findGroundspeakChild(wpt.cache, "short_description")
+  if sdesc_elem is not None and wpt.code in votes_dict:
+    vote_line = voteLine(votes_dict[wpt.code])
+    text = sdesc_elem.text or ""
+    m = re_vote_line_.match(text)
+    if m:
+      if m.group(0) == vote_line:
+        return False
+      text = text[m.end():]
+    sdesc_elem.set("html","True")
+    sdesc_elem.text = vote_line + text
+    return True
+  return False
+
+def votesChanged(current_votes, votes_dict):
+  # current_votes: {gccode: vote line or None} of one file
+  for (gccode, current) in current_votes.items():
+    if gccode in votes_dict and voteLine(votes_dict[gccode]) != current:
+      return True
+  return False
+
 def usage():
   print "Sytax:"
   print "       %s [options] <pocketquery.gpx> [...]" % (sys.argv[0])
+  print "       %s [options] --db <waypoint-db>" % (sys.argv[0])
   print "Options:"
   print "       -h          | --help"
   print "       -u username | --username=gcvote_user"
   print "       -p password | --password=gcvote_pass"
   print "       -m          | --mean     Use mean instead of median"
+  print "       -d file     | --db=file  Add votes to all caches in this gc_waypointdb database"
+  print "       --profile file           Write a profile (pstats, collapsed stacks if file ends in .folded)"
+  print "       --trace-memory           Print peak memory at exit"
 
 if __name__ == '__main__':
   gcvote_username_ = None
   gcvote_password_ = None
+  db_file_ = None
+  profile_file_ = None
+  trace_memory_ = False
   try:
-    opts, files = getopt.gnu_getopt(sys.argv[1:], "mhu:p:", ["user=","pass=","help","mean"])
+    opts, files = getopt.gnu_getopt(sys.argv[1:], "mhu:p:d:", ["user=","pass=","help","mean","db=","profile=","trace-memory"])
   except getopt.GetoptError as e:
     print "ERROR: Invalid Option: " +str(e)
     usage()
     sys.exit(1)
 
-  if len(files) < 1:
-    print "ERROR: no gpx file given\n"
-    usage()
-    sys.exit()
-
   for o, a in opts:
     if o in ["-h","--help"]:
       usage()
@@ -47,32 +93,56 @@ if __name__ == '__main__':
       gcvote_password_ = a
     elif o in ["-m","--mean"]:
       use_median_=False
+    elif o in ["-d","--db"]:
+      db_file_ = a
+    elif o in ["--profile"]:
+      profile_file_ = a
+    elif o in ["--trace-memory"]:
+      trace_memory_ = True
+  profilelib.start(profile_file_, trace_memory_)
 
+  if len(files) < 1 and db_file_ is None:
+    print "ERROR: no gpx file given\n"
+    usage()
+    sys.exit()
+
+  # collect the caches of all files first, so every vote is fetched only once
+  gcids = set()
+  file_votes = []
   for gpxfile in files:
-    tree = None
-    gccode = None
-    gcids = []
+    current_votes = {}
     try:
-      with open(gpxfile, mode="rb") as f:
-        tree = etree.parse(f,xml_parser_).getroot()
-    except (etree.ParserError,etree.DocumentInvalid) as e:
+      for wpt in gpxlib.iterWaypoints(gpxfile):
+        if getGUID(wpt):
+          gcids.add(getGUID(wpt))
+          current_votes[wpt.code] = currentVote(wpt)
+    except (etree.ParserError,etree.XMLSyntaxError) as e:
       print "ERROR, could not parse %s" % (gpxfile)
       print "\tErrorMsg: %s" % (str(e))
       continue
-    nsmap = tree.nsmap
-    if None in nsmap:
-        nsmap["gcns"] = nsmap[None]
-        del nsmap[None]
-    urls = [ url.text for url in tree.iterfind(".//{http://www.topografix.com/GPX/1/0}url",namespaces=nsmap) ]
-    gcids += map(lambda x: x[len(gc_guid_uri_):], filter(lambda x: x.startswith(gc_guid_uri_), urls))
-    votes_dict = gc.get_gcvotes(gcids, gcvote_username_, gcvote_password_, use_median=use_median_)
-    for wpt_elem in tree.iterfind("{http://www.topografix.com/GPX/1/0}wpt",namespaces=nsmap):
-      gccode = wpt_elem.find("{http://www.topografix.com/GPX/1/0}name",namespaces=nsmap).text
-      sdesc_elem = wpt_elem.find(".//{http://www.groundspeak.com/cache/1/0}short_description",namespaces=nsmap)
-      if sdesc_elem is not None and gccode in votes_dict:
-        vote_info = show_vote_string_ % votes_dict[gccode]
-        sdesc_elem.set("html","True")
-        sdesc_elem.text = vote_info+"<br/>\n"+sdesc_elem.text
-    with open(gpxfile, mode="wb") as f:
-      f.truncate()
-      f.write(etree.tostring(tree,method="xml",xml_declaration=True,encoding="utf-8"))
+    file_votes.append((gpxfile, current_votes))
+
+  if db_file_ is not None:
+    with waypointdblib.WaypointDB(db_file_) as db:
+      gcids.update(filter(None, [getGUID(wpt) for wpt in db.iterWaypoints([row[0] for row in db.query()])]))
+
+  if not gcids:
+    print "no geocaching.com caches found"
+    sys.exit()
+  votes_dict = gc.get_gcvotes(sorted(gcids), gcvote_username_, gcvote_password_, use_median=use_median_)
+
+  if db_file_ is not None:
+    with waypointdblib.WaypointDB(db_file_) as db:
+      for wpt in db.iterWaypoints([row[0] for row in db.query()]):
+        if addVote(wpt, votes_dict):
+          db.update(wpt.elem)
+
+  for (gpxfile, current_votes) in file_votes:
+    if not votesChanged(current_votes, votes_dict):
+      print "%s: votes unchanged" % (gpxfile)
+      continue
+    def addVoteToElem(wpt_elem, wpt):
+      if wpt is not None:
+        addVote(wpt, votes_dict)
+      return wpt_elem
+    gpxlib.rewriteGPX(gpxfile, gpxfile, addVoteToElem)
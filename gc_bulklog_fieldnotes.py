@@ -5,12 +5,53 @@
 
 import sys
 import getopt
+import threading
 import geocachingsitelib as gc
 from collections import namedtuple
 
 DialogInfo = namedtuple("DialogInfo",["selection","favorite","encrypt","substvars","text"])
 
-try:
+# fetches and parses the log forms of all pending fieldnotes in the background,
+# so that while the user is busy with the dialog, submitting a log is only a POST.
+# It never asks for a password (that would open a dialog outside the GUI thread),
+# if the login is lost the forms are left to submit_log in the main thread.
+class LogFormPrefetcher(threading.Thread):
+    def __init__(self, fieldnotes):
+        super(LogFormPrefetcher, self).__init__()
+        self.daemon = True
+        self.loguris = [fn.loguri for fn in fieldnotes]
+        self.logforms = {}
+        self.ready = dict([(loguri, threading.Event()) for loguri in self.loguris])
+        self.wanted = None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        with gc.getDefaultInteractiveGCSession().nonInteractive():
+            for loguri in self.loguris:
+                if not self.stop_event.is_set() and (self.wanted is None or loguri in self.wanted):
+                    try:
+                        self.logforms[loguri] = gc.fetch_log_form(loguri)
+                    except gc.NotLoggedInError, e:
+                        gc._debug_print("LogFormPrefetcher", loguri, e)
+                        self.stop_event.set()
+                    except Exception, e:
+                        gc._debug_print("LogFormPrefetcher", loguri, e)
+                # also when stopped, get() must not wait for it
+                self.ready[loguri].set()
+
+    def restrictTo(self, loguris):
+        self.wanted = set(loguris)
+
+    def get(self, loguri):
+        self.ready[loguri].wait()
+        return self.logforms.get(loguri)
+
+    def stop(self):
+        self.stop_event.set()
+
+# wx is only loaded once the command line has been parsed
+def initGUI():
+  global wx, wxapp, WriteFieldnoteLogsDialog
   import wx
 
   def tupleSizeRestrict(a,maxsize,margin=0):
@@ -59,9 +100,6 @@ try:
                                         text=self.loginfo_txt.GetValue())
 
   wxapp = wx.App()
-  gui_available_ = True
-except ImportError:
-  gui_available_ = False
 
 
 def usage():
@@ -97,6 +135,12 @@ for o, a in opts:
     elif o in ["--debug"]:
         gc.gc_debug = True
 
+try:
+    initGUI()
+    gui_available_ = True
+except ImportError:
+    gui_available_ = False
+
 if not gui_available_:
     print("wyPython not installed: GUI not available, exiting...")
     sys.exit(1)
@@ -112,14 +156,19 @@ if len(fieldnotes) == 0:
     msgdlg.Destroy()
     sys.exit(0)
 
+prefetcher = LogFormPrefetcher(fieldnotes)
+prefetcher.start()
+
 dial = WriteFieldnoteLogsDialog(None, dialog_title, fieldnotes)
 if dial.ShowModal() != wx.ID_OK:
     print "Abort selected"
+    prefetcher.stop()
     dial.Destroy()
     sys.exit(1)
 
 dialinfo =  dial.getInput()
 dial.Destroy()
+prefetcher.restrictTo([fieldnotes[fnindex].loguri for fnindex in dialinfo.selection])
 
 progressdial = wx.ProgressDialog(title=dialog_title, message="Logging selected fieldnotes", parent=None, maximum=len(dialinfo.selection), style = wx.PD_APP_MODAL | wx.PD_ELAPSED_TIME | wx.PD_AUTO_HIDE | wx.PD_CAN_ABORT)
 progress=0
@@ -131,6 +180,9 @@ for fnindex in dialinfo.selection:
     logtxt = dialinfo.text
     if dialinfo.substvars:
         logtxt = logtxt.replace("%T",fn.time).replace("%D",fn.date)
-    if not gc.submit_log(fn.loguri, logtxt, favorite=dialinfo.favorite, encrypt=dialinfo.encrypt):
+    # a form that failed to prefetch is None and will be fetched again by submit_log
+    logform = prefetcher.get(fn.loguri)
+    if not gc.submit_log(fn.loguri, logtxt, favorite=dialinfo.favorite, encrypt=dialinfo.encrypt, logform=logform):
         print "ERROR logging fieldnote for", fn.name
+prefetcher.stop()
 progressdial.Destroy()
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+from __future__ import print_function
+import sys
+import getopt
+import devicesynclib
+
+def usage():
+    print("gc_devicesync - copy new and changed gpx files and photos onto your GPS")
+    print("\nSyntax:")
+    print("       %s [options] <source-dir> <device-dir>" % (sys.argv[0]))
+    print("\nOptions:")
+    print("       -h           | --help              Show Help")
+    print("       -n           | --dryrun            Only show what would be done")
+    print("       -s           | --scriptmode        Only print the summary")
+    print("       -j <n>       | --jobs <n>          Copy n files at the same time, default 4")
+    print("       --keep-deleted                     Do not delete files on the device that were")
+    print("                                           removed from source-dir")
+    print("       --repair                           Also copy files that were changed or deleted on the device")
+    print("       --no-verify                        Do not read back and compare what was written")
+    print("       --manifest <file>                  Default <device-dir>/%s" % devicesynclib.manifest_name_)
+    print("\nExamples:")
+    print("       %s ~/pq /media/GARMIN/Garmin/GPX" % (sys.argv[0]))
+    print("       %s ./spoilers /media/GARMIN/Garmin/GeocachePhotos" % (sys.argv[0]))
+
+
+if __name__ == '__main__':
+    dry_mode_ = False
+    script_mode_ = False
+    jobs_ = 4
+    delete_ = True
+    repair_ = False
+    verify_ = True
+    manifest_file_ = None
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hnsj:", ["help","dryrun","scriptmode","jobs=","keep-deleted","repair","no-verify","manifest="])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-n","--dryrun"]:
+                dry_mode_ = True
+            elif o in ["-s","--scriptmode"]:
+                script_mode_ = True
+            elif o in ["-j","--jobs"]:
+                jobs_ = int(a)
+            elif o in ["--keep-deleted"]:
+                delete_ = False
+            elif o in ["--repair"]:
+                repair_ = True
+            elif o in ["--no-verify"]:
+                verify_ = False
+            elif o in ["--manifest"]:
+                manifest_file_ = a
+    except (getopt.GetoptError, ValueError) as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    if len(args) != 2:
+        usage()
+        sys.exit(1)
+
+    sync = devicesynclib.DeviceSync(args[0], args[1], manifest_file_, delete=delete_, repair=repair_, verify=verify_, jobs=jobs_)
+    actions = sync.plan()
+    num_keep = len([a for a in actions if a.action == "keep"])
+    if dry_mode_:
+        print("Dry-Run, no write or delete will be performed\n")
+        for a in actions:
+            if a.action != "keep" and not script_mode_:
+                print("%-6s %s (%s)" % (a.action, a.path, a.reason))
+        print("%d files to copy, %d to delete, %d unchanged" % (len([a for a in actions if a.action == "copy"]), len([a for a in actions if a.action == "delete"]), num_keep))
+        sys.exit(0)
+
+    counts = {"copied": 0, "bytes": 0, "deleted": 0, "unchanged": num_keep, "failed": 0}
+    def report(action, result):
+        if result.error is not None:
+            counts["failed"] += 1
+            print("ERROR: %s %s: %s" % (action.action, action.path, result.error), file=sys.stderr)
+        elif action.action == "delete":
+            counts["deleted"] += 1
+            if not script_mode_:
+                print("deleted %s" % (action.path))
+        elif result.copied:
+            counts["copied"] += 1
+            counts["bytes"] += result.entry["src"][0]
+            if not script_mode_:
+                print("copied  %s (%s)" % (action.path, action.reason))
+        else:
+            # identical file already on the device
+            counts["unchanged"] += 1
+
+    sync.run(actions, report)
+    print("%d files copied (%.1f MB), %d deleted, %d unchanged, %d failed" % (counts["copied"], counts["bytes"] / 1e6, counts["deleted"], counts["unchanged"], counts["failed"]))
+    if counts["failed"] > 0:
+        sys.exit(1)
@@ -5,12 +5,16 @@
 
 from __future__ import print_function
 import sys,os
+import re
+import json
 import getopt
-from lxml import etree
-import codecs
-import geocachingsitelib as gc
+import tempfile
+import garmindevicelib as gd
+import profilelib
 from collections import namedtuple
 
+default_state_file_ = os.path.join(os.path.expanduser('~'),".local","share","gctools","garmingps_state.json")
+
 def usage():
     print("gc_garmingps - A tool to dump garmin-gps fieldnotes/fieldlogs")
     print(" and use that information to delete obsolete waypoints from gpx")
@@ -27,21 +31,69 @@ def usage():
     print("       -p           | --purge       Purge found wtps from gpx files")
     print("       -s           | --scriptmode  Just print deleted files")
     print("       -n           | --dryrun      Don't really write or delete")
+    print("       --db <file>                  Also delete found caches from this")
+    print("                                     gc_waypointdb database")
+    print("       --state <file>               Remember processed visits and purged gpx files here,")
+    print("                                     default %s" % default_state_file_)
+    print("       --full                       Ignore the state file, process all visits and files again")
+    print("       --profile <file>             Write a profile (pstats, collapsed stacks if <file>")
+    print("                                     ends in .folded)")
+    print("       --trace-memory               Print peak memory at exit")
 
 
 def printLogs(logs):
     print("\n".join(map(lambda l: "%7s: %-12ls %s %s%s" % (l.gccode, l.type, l.date, l.time, " (%s)" % l.comment if l.comment else ""),logs)))
 
-def filterReallyFoundLogs(logs):
-    last_gccode=None
-    fl=[]
+def reallyFoundFinds(logs, found=None, last_gccode=None, next_seq=0):
+    # a "did not find" right after a "found it" of the same cache revokes it.
+    # Every find is numbered, a revoked number is never used again, so
+    # "processed up to number n" stays true when a later run revokes a find.
+    # found, last_gccode and next_seq continue from a previous call.
+    # returns ([[gccode, number], ...] in order of the logs, last_gccode, next_seq)
+    fl = [list(find) for find in (found or [])]
     for log in logs:
         if log.type == "found it":
             last_gccode = log.gccode
-            fl.append(log)
-        elif log.type == "did not find" and log.gccode == last_gccode:
+            fl.append([log.gccode, next_seq])
+            next_seq += 1
+        elif log.type == "did not find" and log.gccode == last_gccode and fl:
             fl.pop()
-    return fl
+    return (fl, last_gccode, next_seq)
+
+def reallyFoundGCCodes(logs):
+    return [gccode for (gccode, seq) in reallyFoundFinds(logs)[0]]
+
+def foundSince(found, seq):
+    # gccodes of the finds numbered seq or higher
+    return [gccode for (gccode, n) in found if n >= seq]
+
+def deviceKey(garmin_dir):
+    # the unit id, so the state survives a different mount point
+    try:
+        with open(os.path.join(garmin_dir, "GarminDevice.xml"), "rb") as fh:
+            m = re.search(br"<Id>\s*(\d+)\s*</Id>", fh.read())
+        if m is not None:
+            return "unit-" + m.group(1).decode("ascii")
+    except (IOError, OSError):
+        pass
+    return os.path.abspath(garmin_dir)
+
+def loadSyncState(filename):
+    try:
+        with open(filename, "r") as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def saveSyncState(filename, state):
+    import gpxlib
+    statedir = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(statedir):
+        os.makedirs(statedir)
+    (fd, tmpname) = tempfile.mkstemp(prefix=".", suffix=".json.tmp", dir=statedir)
+    with os.fdopen(fd, "w") as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+    gpxlib.replaceFile(tmpname, filename)
 
 def deleteAndPrintGPXFilesNamedAfterFoundGCCodes(logs, gpx_dir, dryrun=True, verbose=True):
     gpx_on_garmin=filter(lambda f: f.startswith("GC") and f.endswith(".gpx") and os.path.isfile(os.path.join(gpx_dir,f)),os.listdir(gpx_dir))
@@ -62,115 +114,157 @@ def deleteAndPrintGPXFilesNamedAfterFoundGCCodes(logs, gpx_dir, dryrun=True, ver
             map(os.unlink,map(lambda f: os.path.join(gpx_dir, f), obsolete_mystery_gpx))
     return obsolete_mystery_gpx
 
-def grepFile(filename, stringlist):
-    #~ assert fh.mode.find("r") != -1
-    #~ fh.seek(0)
-    with open(filename,"r") as fh:
-        return any( [ x in (fh.seek(0), fh.read())[1] for x in (stringlist if isinstance(stringlist,list) else [stringlist]) ] )
-    #~ fh.seek(0)
-    #~ return pos >= 0
-
-def guessEncodingFromBOM(filename):
-    with open(filename,"rb") as fh:
-        sample = fh.read(4)
-    for (bom,codec) in [(codecs.BOM_UTF32_LE,"utf_32_le"),(codecs.BOM_UTF32_BE,"utf_32_be"),(codecs.BOM_UTF16_LE,"utf_16_le"),(codecs.BOM_UTF16_BE,"utf_16_be"),(codecs.BOM_UTF8,"utf_8_sig")]:
-        if sample.startswith(bom):
-            return codec
-    return "utf_8"
-
 def removeWPTfromGPX(gccodes, gpxfile, verbose=True, dryrun=True):
+    import gpxlib
+    from lxml import etree
     removed_files = []
-    xml_parser = etree.XMLParser(encoding="utf-8")
+    gccodes = set(gccodes)
     try:
-        gpxtree = etree.parse(gpxfile, xml_parser).getroot()
-    except (etree.ParserError,etree.DocumentInvalid,etree.XMLSyntaxError) as e:
+        # copies all other waypoints to a temp file and atomically renames it over gpxfile
+        (num_kept, num_ours) = gpxlib.purgeWaypoints(gpxfile, gccodes, write=not dryrun)
+    except (etree.ParserError,etree.XMLSyntaxError) as e:
         print("Warning: could not parse %s" % (gpxfile), file=sys.stderr)
         print("\tErrorMsg: %s" % (str(e)), file=sys.stderr)
         return removed_files
-    num_wpts = 0
-    ourwpts = []
-    for wpt in gpxtree.iterfind("{http://www.topografix.com/GPX/1/0}wpt",namespaces=gpxtree.nsmap):
-        num_wpts += 1
-        if wpt.findtext("{http://www.topografix.com/GPX/1/0}name",namespaces=gpxtree.nsmap) in gccodes:
-            ourwpts.append(wpt)
-    if ourwpts and num_wpts > 0:
-        if num_wpts == len(ourwpts):
+    if num_ours > 0:
+        if num_kept == 0:
             removed_files.append(os.path.basename(gpxfile))
             if verbose:
                 print("%s contains only already found waypoints. Deleting it." % (gpxfile))
             if not dryrun:
                 os.unlink(gpxfile)
-        else:
-            if verbose:
-                print("Removing already found waypoints from %s." % (gpxfile))
-            for wpt in ourwpts:
-                wpt.getparent().remove(wpt)
-            if not dryrun:
-                etree.ElementTree(gpxtree).write(gpxfile, pretty_print=True,method="xml", xml_declaration=True, encoding="utf-8",inclusive_ns_prefixes=gpxtree.nsmap)
+        elif verbose:
+            print("Removed %d already found waypoints from %s." % (num_ours, gpxfile))
     return removed_files
 
 
-try:
-    opts, args = getopt.gnu_getopt(sys.argv[1:], "hfpdsn", ["help","purge","found","delete","debug","scriptmode","dryrun"])
-except getopt.GetoptError, e:
-    print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
-    usage()
-    sys.exit(1)
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hfpdsn", ["help","purge","found","delete","debug","scriptmode","dryrun","db=","state=","full","profile=","trace-memory"])
+    except getopt.GetoptError, e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
 
-gcgg_action_ = "print"
-script_mode_ = False
-dry_mode_ = False
+    gcgg_action_ = "print"
+    script_mode_ = False
+    dry_mode_ = False
+    waypoint_db_ = None
+    state_file_ = default_state_file_
+    full_sync_ = False
+    profile_file_ = None
+    trace_memory_ = False
 
-for o, a in opts:
-    if o in ["-h","--help"]:
-        usage()
-        sys.exit()
-    elif o in ["-d","--delete"]:
-        gcgg_action_ = "delete"
-    elif o in ["-s","--scriptmode"]:
-        script_mode_ = True
-    elif o in ["-p","--purge"]:
-        gcgg_action_ = "purgefromgpx"
-    elif o in ["-f","--found"]:
-        gcgg_action_ = "printfound"
-    elif o in ["-n","--dryrun"]:
-        dry_mode_ = True
-    elif o in ["--debug"]:
-        gc.gc_debug = True
-
-if args == []:
+    for o, a in opts:
+        if o in ["-h","--help"]:
+            usage()
+            sys.exit()
+        elif o in ["-d","--delete"]:
+            gcgg_action_ = "delete"
+        elif o in ["-s","--scriptmode"]:
+            script_mode_ = True
+        elif o in ["-p","--purge"]:
+            gcgg_action_ = "purgefromgpx"
+        elif o in ["-f","--found"]:
+            gcgg_action_ = "printfound"
+        elif o in ["-n","--dryrun"]:
+            dry_mode_ = True
+        elif o in ["--debug"]:
+            gd.gc_debug = True
+        elif o in ["--db"]:
+            waypoint_db_ = a
+        elif o in ["--state"]:
+            state_file_ = a
+        elif o in ["--full"]:
+            full_sync_ = True
+        elif o in ["--profile"]:
+            profile_file_ = a
+        elif o in ["--trace-memory"]:
+            trace_memory_ = True
+    profilelib.start(profile_file_, trace_memory_)
+
+    if args == []:
+            usage()
+            sys.exit(1)
+
+    gc_logs_xml_filename_="geocache_logs.xml"
+    garmin_dir_=args[0]
+    geocache_logs_=os.path.join(garmin_dir_,gc_logs_xml_filename_)
+    gpx_dir_=os.path.join(garmin_dir_,"GPX")
+
+    if not os.path.isfile(geocache_logs_):
+        print("ERROR:Could not find %s in %s, aborting...\n\n" % (gc_logs_xml_filename_, garmin_dir_), file=sys.stderr)
         usage()
-        sys.exit(1)
+        sys.exit(2)
+
+    deleted_files = []
+
+    if dry_mode_:
+        print("Dry-Run, no write or delete will be performed\n")
+
+    # Purging and --db only look at the visits that are new since the last
+    # run. The state remembers per device the read position in
+    # geocache_logs.xml, the numbered finds so far and, for every gpx file and
+    # database, the number of the first find not yet removed from it.
+    if gcgg_action_ == "purgefromgpx" or waypoint_db_:
+        import gpxlib
+        sync_state = loadSyncState(state_file_)
+        device_key = deviceKey(garmin_dir_)
+        device = {} if full_sync_ else sync_state.get(device_key, {})
+        if "next_seq" not in device:
+            # state of an older version that counted the finds, start over
+            device = {}
+        (new_logs, logs_position, continued) = gd.read_new_garmin_fieldnotes_xml(geocache_logs_, device.get("logs"))
+        if not continued:
+            device = {}
+        (truly_found, last_gccode, next_seq) = reallyFoundFinds(new_logs, device.get("found"), device.get("last_gccode"), device.get("next_seq", 0))
+        device = {"logs": logs_position, "found": truly_found, "last_gccode": last_gccode, "next_seq": next_seq,
+            "gpx": device.get("gpx", {}), "db": device.get("db", {})}
+        if not script_mode_ and continued:
+            print("%d new visits since the last run" % (len(new_logs)))
+
+    if gcgg_action_ == "delete":
+        logs = gd.read_garmin_fieldnotes_xml(geocache_logs_)
+        deleted_files = deleteAndPrintGPXFilesNamedAfterFoundGCCodes(logs, gpx_dir_,dryrun=dry_mode_, verbose=not script_mode_)
+    elif gcgg_action_ == "printfound":
+        logs = gd.read_garmin_fieldnotes_xml(geocache_logs_)
+        print("\n".join(reallyFoundGCCodes(logs)))
+    elif gcgg_action_ == "purgefromgpx":
+        gpx_on_garmin=filter(lambda f: f.endswith(".gpx") and os.path.isfile(f),map(lambda f: os.path.join(gpx_dir_,f), os.listdir(gpx_dir_)))
+        # unchanged files that were purged before only need to be checked for the caches found since then
+        files_by_start = {}
+        for gpxfile in gpx_on_garmin:
+            purged = device["gpx"].get(os.path.basename(gpxfile))
+            start = purged[2] if purged is not None and purged[:2] == gpxlib.fileState(gpxfile) else 0
+            if foundSince(truly_found, start):
+                files_by_start.setdefault(start, []).append(gpxfile)
+        found_in_gpx = {}
+        for (start, gpxfiles) in files_by_start.items():
+            # one scan per file, in parallel, yields exactly the found gccodes each file contains
+            found_in_gpx.update(gpxlib.findWaypointCodesInFiles(gpxfiles, foundSince(truly_found, start)))
+        for gpxfile in gpx_on_garmin:
+            if gpxfile in found_in_gpx:
+                deleted_files += removeWPTfromGPX(found_in_gpx[gpxfile], gpxfile, dryrun=dry_mode_, verbose=not script_mode_)
+        device["gpx"] = dict([(os.path.basename(f), gpxlib.fileState(f) + [next_seq]) for f in gpx_on_garmin if os.path.isfile(f)])
+    else:
+        printLogs(gd.read_garmin_fieldnotes_xml(geocache_logs_))
+
+    if waypoint_db_:
+        db_key = os.path.abspath(waypoint_db_)
+        db_gccodes = foundSince(truly_found, device["db"].get(db_key, 0))
+        import waypointdblib
+        with waypointdblib.WaypointDB(waypoint_db_) as db:
+            if dry_mode_:
+                num_deleted = len(db.query(codes=db_gccodes))
+            else:
+                num_deleted = db.delete(db_gccodes)
+        device["db"][db_key] = next_seq
+        if not script_mode_:
+            print("Deleting %d found caches from %s" % (num_deleted, waypoint_db_))
+
+    if (gcgg_action_ == "purgefromgpx" or waypoint_db_) and not dry_mode_:
+        sync_state[device_key] = device
+        saveSyncState(state_file_, sync_state)
 
-gc_logs_xml_filename_="geocache_logs.xml"
-garmin_dir_=args[0]
-geocache_logs_=os.path.join(garmin_dir_,gc_logs_xml_filename_)
-gpx_dir_=os.path.join(garmin_dir_,"GPX")
-
-if not os.path.isfile(geocache_logs_):
-    print("ERROR:Could not find %s in %s, aborting...\n\n" % (gc_logs_xml_filename_, garmin_dir_), file=sys.stderr)
-    usage()
-    sys.exit(2)
-
-logs = gc.read_garmin_fieldnotes_xml(geocache_logs_)
-deleted_files = []
-
-if dry_mode_:
-    print("Dry-Run, no write or delete will be performed\n")
-
-if gcgg_action_ == "delete":
-    deleted_files = deleteAndPrintGPXFilesNamedAfterFoundGCCodes(logs, gpx_dir_,dryrun=dry_mode_, verbose=not script_mode_)
-elif gcgg_action_ == "printfound":
-    truly_found_gccodes = map(lambda l: l.gccode, filterReallyFoundLogs(logs))
-    print("\n".join(truly_found_gccodes))
-elif gcgg_action_ == "purgefromgpx":
-    truly_found_gccodes = map(lambda l: l.gccode, filterReallyFoundLogs(logs))
-    gpx_on_garmin=filter(lambda f: f.endswith(".gpx") and os.path.isfile(f),map(lambda f: os.path.join(gpx_dir_,f), os.listdir(gpx_dir_)))
-    possible_obsolete_gpx=filter(lambda f: grepFile(f, truly_found_gccodes), gpx_on_garmin)
-    for gpxfile in possible_obsolete_gpx:
-        deleted_files += removeWPTfromGPX(truly_found_gccodes, gpxfile, dryrun=dry_mode_, verbose=not script_mode_)
-else:
-    printLogs(logs)
-
-if script_mode_:
-    print("\n".join(deleted_files))
+    if script_mode_:
+        print("\n".join(deleted_files))
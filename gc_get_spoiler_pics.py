@@ -20,25 +20,32 @@ from multiprocessing import Pool, Lock, RLock
 from hashlib import md5
 import pickle
 import shutil
-import codecs
 
 import geocachingsitelib as gc
+import gpxlib
+import waypointdblib
+import profilelib
 
 def usage():
   print("This tool will take a geocaching.com pocketquery and download and geotag spoiler pics")
   print("\nSyntax:")
   print("   %s [options] <pq-gpx-file> [pq-gpx-file2 [GCCODE*.jpg [...]]]" % (sys.argv[0]))
+  print("   %s [options] --db <waypoint-db> [GCCODE*.jpg [...]]" % (sys.argv[0]))
   print("\nOptions:")
   print("   --lat_offset <degrees>      Latitude Offset for Images Geotag")
   print("   --lon_offset <degrees>      Longitude Offset for Images Geotag")
   print("   --savedir <dir>             Directory to save images in")
   print("   --filter </regex/>          Regex that needs to match the Image Description")
   print("   --threads <num>             use <num> threads, 0 disables threading, default is number of CPUs")
+  print("   --db <file>                 also process all caches in this gc_waypointdb database")
   print("   -f | --flat                 put all photos in one directory instead of sorting them into GeocachePhotos subdirectories")
   print("   -s | --skip_present         skip GC if at least one picture of GC present in savedir")
   print("   -d | --done_file <filename> use and update list of previously downloaded data")
   print("   -g | --no_geotag            don't geotag images")
   print("   -x | --delete_old           delete images of gc not found in given gpx")
+  print("   --profile <file>            write a profile of this and all worker processes (pstats,")
+  print("                               collapsed stacks if <file> ends in .folded)")
+  print("   --trace-memory              print peak memory and the top allocations at exit")
   print("   -h | --help                 Show this Help")
   print("\nExample:")
   print("   This checks all caches in pocketquery 123.gpx for attached pictures that have")
@@ -325,14 +332,6 @@ def terminateProcesses(pool):
   if not pool is None:
     pool.terminate()
 
-def guessEncodingFromBOM(filename):
-  with open(filename,"rb") as fh:
-    sample = fh.read(4)
-  for (bom,codec) in [(codecs.BOM_UTF32_LE,"utf_32_le"),(codecs.BOM_UTF32_BE,"utf_32_be"),(codecs.BOM_UTF16_LE,"utf_16_le"),(codecs.BOM_UTF16_BE,"utf_16_be"),(codecs.BOM_UTF8,"utf_8_sig")]:
-    if sample.startswith(bom):
-      return codec
-  return "utf_8"
-
 
 
 if __name__ == '__main__':
@@ -358,10 +357,13 @@ if __name__ == '__main__':
   pocketqueries_ext_=".gpx" #.lower()
   print_lock_=RLock()
   allinonedir_=False
+  waypoint_dbs_=[]
+  profile_file_=None
+  trace_memory_=False
 
 ######### Parse Arguments ##########
   try:
-    opts, cl_arguments = getopt.gnu_getopt(sys.argv[1:], "fhsgxd:", ["help","delete_old","skip_present","done_file=","lat_offset=","lon_offset=","savedir=", "filter=","no_geotag","threads=","flat"])
+    opts, cl_arguments = getopt.gnu_getopt(sys.argv[1:], "fhsgxd:", ["help","delete_old","skip_present","done_file=","lat_offset=","lon_offset=","savedir=", "filter=","no_geotag","threads=","flat","db=","profile=","trace-memory"])
   except getopt.GetoptError as e:
     print("ERROR: Invalid Option: " +str(e))
     usage()
@@ -375,6 +377,12 @@ if __name__ == '__main__':
       allinonedir_=True
     elif o in ["--threads"]:
       num_threads_=abs(int(a))
+    elif o in ["--db"]:
+      waypoint_dbs_.append(a)
+    elif o in ["--profile"]:
+      profile_file_=a
+    elif o in ["--trace-memory"]:
+      trace_memory_=True
     elif o in ["--lat_offset"]:
       lat_offset_=float(a)
     elif o in ["--lon_offset"]:
@@ -408,7 +416,8 @@ if __name__ == '__main__':
     print("\t"+", ".join(other_files)+"\n")
 
 ######### Main Program ##########
-  if len(useful_files) <1:
+  profilelib.start(profile_file_, trace_memory_)
+  if len(useful_files) <1 and not waypoint_dbs_:
     usage()
     sys.exit()
 
@@ -442,7 +451,7 @@ if __name__ == '__main__':
   mp_pool = False
   if not num_threads_ is 0:
     globals_for_processes = {"done_dict_":done_dict_,"done_file_":done_file_,"print_lock_":print_lock_, "geotag_images_":geotag_images_, "imagemagick_available_":imagemagick_available_, "re_imgnamefilter_":re_imgnamefilter_, "img_save_path_":img_save_path_, "images_ext_":images_ext_}
-    mp_pool = Pool(processes=num_threads_, initializer=reInitGlobalVars, initargs=(globals_for_processes, ))
+    mp_pool = Pool(processes=num_threads_, **profilelib.poolArgs(reInitGlobalVars, (globals_for_processes, )))
     atexit.register(terminateProcesses, mp_pool)
     parprint("multi-processing enabled")
 
@@ -466,34 +475,21 @@ if __name__ == '__main__':
           gc_from_images_dict_[gccode].append(dst_jpgfile)
 
   # parse gpx pocketqueries from cmd-line arguments and download any and all spoiler images
-  xml_parser = etree.XMLParser(encoding="utf-8")
-  for gpxfile in gpxfiles:
-    fgpx = open(gpxfile, encoding=guessEncodingFromBOM(gpxfile))
+  for gpxfile in gpxfiles + waypoint_dbs_:
     try:
-      gpxtree = etree.parse(fgpx,xml_parser).getroot()
-    except (etree.XMLSyntaxError,etree.ParserError,etree.DocumentInvalid) as e:
-      parprint("ERROR, could not parse %s" % (gpxfile))
-      parprint("\tErrorMsg: %s" % (str(e)))
-      continue
-    fgpx.close()
-
-    for wpt_elem in gpxtree:
-      if wpt_elem.tag[-3:] == "wpt":
-        latitude = float(wpt_elem.get("lat"))
-        longitude = float(wpt_elem.get("lon"))
+      if gpxfile in waypoint_dbs_:
+        db = waypointdblib.WaypointDB(gpxfile)
+        waypoints = db.iterWaypoints([row[0] for row in db.query()])
+      else:
+        waypoints = gpxlib.iterWaypoints(gpxfile)
+      for wpt in waypoints:
+        latitude = wpt.lat
+        longitude = wpt.lon
         altitude = 0
-        gccode = None
-        url = None
-        gcname = None
-        for cache_elem in wpt_elem:
-          if cache_elem.tag[-7:] == "urlname":
-            gcname = cache_elem.text.strip()
-          elif cache_elem.tag[-4:] == "name":
-            gccode = cache_elem.text.strip()
-          elif cache_elem.tag[-3:] == "url":
-            url = cache_elem.text.strip()
-          elif cache_elem.tag[-5:] == "cache":
-            gchash = genCacheDescriptionHash(cache_elem)
+        gccode = wpt.code
+        url = wpt.url
+        gcname = wpt.name
+        gchash = genCacheDescriptionHash(wpt.cache) if wpt.cache is not None else None
 
         # tag images from CL-arguments if applicaple
         if geotag_images_ and gccode in gc_from_images_dict_:
@@ -525,6 +521,10 @@ if __name__ == '__main__':
           mp_pool.apply_async(parseHTMLDescriptionDownloadAndTag,(url, gccode, gcname, gchash, latitude + lat_offset_, longitude + lon_offset_, altitude), callback=addTupleToDone)
         else:
           addTupleToDone(parseHTMLDescriptionDownloadAndTag(url, gccode, gcname, gchash, latitude + lat_offset_, longitude + lon_offset_, altitude))
+    except (etree.XMLSyntaxError,etree.ParserError,waypointdblib.sqlite3.Error) as e:
+      parprint("ERROR, could not parse %s" % (gpxfile))
+      parprint("\tErrorMsg: %s" % (str(e)))
+      continue
 
   if delete_old_images_:
     for fp in genListOfImagesNotStartingWithGCCodeInSaveDir(gc_in_gpx_list_ + list(gc_from_images_dict_.keys())):
@@ -543,4 +543,5 @@ if __name__ == '__main__':
   rmdirEmptyDirs(img_save_path_)
 
   print("All Done! Now move contents of %s to %s on your garmin device" % (img_save_path_, os.path.join("/garmin","JPEG") if allinonedir_ else os.path.join("/garmin","GeocachePhotos")))
+  print("(e.g. with: gc_devicesync.py %s <device>%s)" % (img_save_path_, os.path.join("/garmin","JPEG") if allinonedir_ else os.path.join("/garmin","GeocachePhotos")))
 
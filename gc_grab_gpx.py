@@ -9,6 +9,7 @@ import os
 import getopt
 import re
 import geocachingsitelib as gc
+import profilelib
 
 destination_dir_ = os.path.curdir
 gc_username_ = None
@@ -26,11 +27,13 @@ def usage():
     print("       -u username  | --username=gc_user ")
     print("       -p password  | --password=gc_pass ")
     print("       -i           | --noninteractive   Never prompt for pwd, just fail")
+    print("       --profile file                    Write a profile (pstats, collapsed stacks if file ends in .folded)")
+    print("       --trace-memory                    Print peak memory and the top allocations at exit")
     print("If username and password are not provided, we interactively")
     print("ask for them the first time and store a session cookie. Unless -i is given")
 
 try:
-    opts, args = getopt.gnu_getopt(sys.argv[1:], "u:p:hlad:ci", ["listpq","help","gpxdir=","username=","password=","allpq","createpqdir","noninteractive","debug"])
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "u:p:hlad:ci", ["listpq","help","gpxdir=","username=","password=","allpq","createpqdir","noninteractive","debug","profile=","trace-memory"])
 except getopt.GetoptError as e:
     print("ERROR: Invalid Option: " +str(e))
     usage()
@@ -39,6 +42,8 @@ except getopt.GetoptError as e:
 fetch_all_pqs_ = False
 list_pqs_ = False
 create_pq_dir_ = False
+profile_file_ = None
+trace_memory_ = False
 gc.be_interactive = True
 for o, a in opts:
     if o in ["-h","--help"]:
@@ -60,6 +65,11 @@ for o, a in opts:
         gc.be_interactive = False
     elif o in ["--debug"]:
         gc.gc_debug = True
+    elif o in ["--profile"]:
+        profile_file_ = a
+    elif o in ["--trace-memory"]:
+        trace_memory_ = True
+profilelib.start(profile_file_, trace_memory_)
 
 re_gccode = re.compile(r'GC[a-z0-9]{1,6}',re.IGNORECASE)
 re_pquid = re.compile(r'[a-f0-9-]{36}',re.IGNORECASE)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Puts the gpx files of a pocket query mail (or a downloaded PQ zip) into a
+# directory and deletes single cache files GCxxxx.gpx that are contained in
+# a pocket query. The gccodes of a PQ are collected while it is unpacked.
+
+from __future__ import print_function
+import sys
+import os
+import re
+import io
+import email
+import email.header
+import getopt
+import zipfile
+import tempfile
+import shutil
+import gpxlib
+from filelib import copyFileMode, replaceFile, fsyncFile
+
+pq_subject_prefix_ = "[GEO] Pocket Query: "
+re_single_cache_file_ = re.compile(r'^(GC[A-Z0-9]+)\.gpx$')
+copy_bufsize_ = 1024 * 1024
+# bytes kept from the end of one chunk to find a <name> cut in two
+scan_overlap_ = 256
+
+def usage():
+    print("gc_ingest_pq - unpack pocket queries and remove single cache gpx files they contain")
+    print("\nSyntax:")
+    print("       %s [options] -d <gpx-dir> [pq.zip|mail ...]" % (sys.argv[0]))
+    print("       Without files (or with -) a pocket query e-mail is read from stdin")
+    print("\nOptions:")
+    print("       -h           | --help             Show Help")
+    print("       -d dir       | --gpxdir=dir       Put gpx files into this dir")
+    print("       -k           | --keep             Do not delete single cache gpx files")
+    print("       -g           | --download         Download the PQ if the e-mail has no zip attached")
+    print("       -u username  | --username=gc_user ")
+    print("       -p password  | --password=gc_pass ")
+    print("       -q           | --quiet            Only print errors")
+    print("\nExit status is 1 if the e-mail is not a pocket query mail")
+
+def singleCacheFiles(gpx_dir):
+    # {gccode: filename} of the GCxxxx.gpx files in gpx_dir
+    files = {}
+    for fn in os.listdir(gpx_dir):
+        m = re_single_cache_file_.match(fn)
+        if m:
+            files[m.group(1)] = os.path.join(gpx_dir, fn)
+    return files
+
+def copyAndScan(src, dst_dir, name):
+    # streams the open file src into dst_dir/name (atomically replacing it)
+    # and returns the waypoint names found on the way
+    codes = set()
+    dst = os.path.join(dst_dir, name)
+    (fd, tmpfile) = tempfile.mkstemp(prefix=".", suffix=".gpx.tmp", dir=dst_dir)
+    try:
+        copyFileMode(tmpfile, dst)
+        with os.fdopen(fd, "wb") as out:
+            tail = b""
+            scan = True
+            while True:
+                chunk = src.read(copy_bufsize_)
+                if not chunk:
+                    break
+                out.write(chunk)
+                if not tail and [bom for (bom, enc) in gpxlib.bom_encodings_ if enc != "utf_8_sig" and chunk.startswith(bom)]:
+                    scan = False  # UTF-16/32, the parser has to look at it
+                if scan:
+                    data = tail + chunk
+                    codes.update([m.group(1) for m in gpxlib.re_wpt_name_.finditer(data)])
+                    tail = data[-scan_overlap_:]
+            fsyncFile(out)
+        replaceFile(tmpfile, dst)
+    except:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        raise
+    if not scan:
+        return set([wpt.code for wpt in gpxlib.iterWaypoints(dst) if wpt.code])
+    return set([c.decode("utf-8", "replace") for c in codes])
+
+def extractZip(zipsrc, gpx_dir):
+    # zipsrc is a filename or a file object. Returns {extracted filename: codes}
+    extracted = {}
+    zf = zipfile.ZipFile(zipsrc)
+    try:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if not name.lower().endswith(".gpx"):
+                continue
+            src = zf.open(info)
+            try:
+                extracted[os.path.join(gpx_dir, name)] = copyAndScan(src, gpx_dir, name)
+            finally:
+                src.close()
+    finally:
+        zf.close()
+    return extracted
+
+def readMail(fh):
+    # fh is opened in binary mode
+    if hasattr(email, "message_from_binary_file"):
+        return email.message_from_binary_file(fh)
+    return email.message_from_file(fh)
+
+def pqName(msg):
+    # name of the pocket query from the subject, None if it is no PQ mail
+    subject = msg.get("Subject", "")
+    parts = []
+    for (text, charset) in email.header.decode_header(subject):
+        if isinstance(text, bytes):
+            text = text.decode(charset or "utf-8", "replace")
+        parts.append(text)
+    subject = u"".join(parts).strip()
+    if not subject.startswith(pq_subject_prefix_):
+        return None
+    return subject[len(pq_subject_prefix_):].strip()
+
+def mailZips(msg):
+    # the attached zip files as file objects
+    zips = []
+    for part in msg.walk():
+        filename = part.get_filename() or ""
+        if filename.lower().endswith(".zip") or part.get_content_type() in ["application/zip", "application/x-zip-compressed"]:
+            payload = part.get_payload(decode=True)
+            if payload:
+                zips.append(io.BytesIO(payload))
+    return zips
+
+def downloadPQ(pqname, tmpdir):
+    import geocachingsitelib as gc
+    pqdict = gc.get_pq_names()
+    if pqname not in pqdict:
+        raise gc.GeocachingSiteError("a PQ named '%s' is not in the list of downloadable pocketqueries" % pqname)
+    return os.path.join(tmpdir, gc.download_pq(pqdict[pqname], tmpdir))
+
+def removeContainedSingleCacheFiles(gpx_dir, extracted):
+    # deletes GCxxxx.gpx files whose cache is in any other gpx file in gpx_dir.
+    # The unpacked files have been scanned already, older PQs are only read
+    # if a single cache file is not in a new one
+    singles = singleCacheFiles(gpx_dir)
+    contained = set()
+    for codes in extracted.values():
+        contained.update(codes)
+    remaining = set(singles) - contained
+    if remaining:
+        single_files = set(singles.values())
+        others = [os.path.join(gpx_dir, fn) for fn in sorted(os.listdir(gpx_dir))
+            if fn.lower().endswith(".gpx") and not fn.startswith(".")
+            and os.path.join(gpx_dir, fn) not in single_files and os.path.join(gpx_dir, fn) not in extracted]
+        for codes in gpxlib.findWaypointCodesInFiles(others, remaining).values():
+            contained.update(codes)
+    removed = []
+    for (gccode, filename) in sorted(singles.items()):
+        if gccode in contained and filename not in extracted:
+            os.unlink(filename)
+            removed.append(filename)
+    return removed
+
+
+if __name__ == '__main__':
+    gpx_dir_ = None
+    keep_ = False
+    download_ = False
+    quiet_ = False
+    gc_username_ = None
+    gc_password_ = None
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hd:kgu:p:q", ["help","gpxdir=","keep","download","username=","password=","quiet"])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-d","--gpxdir"]:
+                gpx_dir_ = os.path.expanduser(a)
+            elif o in ["-k","--keep"]:
+                keep_ = True
+            elif o in ["-g","--download"]:
+                download_ = True
+            elif o in ["-u","--username"]:
+                gc_username_ = a
+            elif o in ["-p","--password"]:
+                gc_password_ = a
+            elif o in ["-q","--quiet"]:
+                quiet_ = True
+    except getopt.GetoptError as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    if gpx_dir_ is None or not os.path.isdir(gpx_dir_):
+        print("ERROR: please give an existing directory with -d", file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    if not args:
+        args = ["-"]
+    extracted = {}
+    tmpdir = None
+    try:
+        for arg in args:
+            if arg != "-" and zipfile.is_zipfile(arg):
+                extracted.update(extractZip(arg, gpx_dir_))
+                continue
+            if arg == "-":
+                msg = readMail(getattr(sys.stdin, "buffer", sys.stdin))
+            else:
+                with open(arg, "rb") as fh:
+                    msg = readMail(fh)
+            pqname = pqName(msg)
+            if pqname is None:
+                print("ERROR: %s is no pocket query e-mail" % ("stdin" if arg == "-" else arg), file=sys.stderr)
+                sys.exit(1)
+            zips = mailZips(msg)
+            if not zips and download_:
+                import geocachingsitelib as gc
+                gc.gc_username = gc_username_
+                gc.gc_password = gc_password_
+                gc.be_interactive = False
+                if tmpdir is None:
+                    tmpdir = tempfile.mkdtemp(prefix="gctools-pq-")
+                try:
+                    zips = [downloadPQ(pqname, tmpdir)]
+                except Exception as e:
+                    print("ERROR: download of PQ '%s' failed: %s" % (pqname, e), file=sys.stderr)
+            for zipsrc in zips:
+                extracted.update(extractZip(zipsrc, gpx_dir_))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if not quiet_:
+        for filename in sorted(extracted):
+            print("unpacked %s" % filename)
+    if extracted and not keep_:
+        for filename in removeContainedSingleCacheFiles(gpx_dir_, extracted):
+            if not quiet_:
+                print("removed %s, it is contained in a pocket query" % filename)
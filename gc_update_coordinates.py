@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+from __future__ import print_function
+import sys
+import os
+import json
+import getopt
+import tempfile
+import geocachingsitelib as gc
+import correctionslib
+from filelib import replaceFile, fsyncFile
+
+default_state_file_ = os.path.join(gc.default_config_dir_, "pushed_coordinates.json")
+# coordinates closer than this (degrees, about 5cm) count as unchanged
+coord_epsilon_ = 5e-7
+
+def usage():
+    print("gc_update_coordinates - set corrected coordinates of solved caches on geocaching.com")
+    print("\nSyntax:")
+    print("       %s [options] <gpx|csv|json file> [...]" % (sys.argv[0]))
+    print("\nOptions:")
+    print("       -h           | --help             Show Help")
+    print("       -n           | --dryrun           Only show which caches would be updated")
+    print("       -f           | --full             Update all caches, not only those changed since the last run")
+    print("       -j <n>       | --jobs <n>         Update n caches at the same time, default 4")
+    print("       -a           | --all-waypoints    Also take gpx files with several caches, all of them")
+    print("                                         count as corrected (only for files of solved caches)")
+    print("       --state <file>                    Remember what was updated in <file>")
+    print("                                         default %s" % default_state_file_)
+    print("       -u username  | --username=gc_user ")
+    print("       -p password  | --password=gc_pass ")
+    print("       -i           | --noninteractive   Never prompt for pwd, just fail")
+    print("\nA gpx file with a single cache (e.g. changed with chngwaypoint.py) gives its corrected")
+    print("coordinates, files with more caches, like pocket queries, need --all-waypoints.")
+    print("csv and json files are the corrections files of chngwaypoint.py --batch: csv with a header")
+    print("line and the columns gccode,coords or gccode,lat,lon, json like")
+    print("{\"GC12345\": {\"coords\": \"N48 12.345 E016 23.456\"}, ...}")
+
+def readCoordinates(filename, all_waypoints=False):
+    # {gccode: (lat, lon)}
+    ext = os.path.splitext(filename)[1].lower()
+    coords = {}
+    if ext in [".json", ".csv"]:
+        for (gccode, correction) in correctionslib.loadCorrections(filename).items():
+            if correction.lat is not None and correction.lon is not None:
+                coords[gccode] = (correction.lat, correction.lon)
+            elif correction.lat is not None or correction.lon is not None:
+                raise ValueError("%s: needs both lat and lon" % gccode)
+    else:
+        import gpxlib
+        for (gccode, lat, lon) in gpxlib.waypointPositions(filename):
+            if gccode is not None and lat is not None and lon is not None:
+                coords[gccode.upper()] = (lat, lon)
+    coords = dict([(gccode, latlon) for (gccode, latlon) in coords.items() if gccode.upper().startswith("GC")])
+    # a pocket query holds the posted coordinates of all its caches,
+    # sending those would overwrite the user's corrections with them
+    if ext not in [".json", ".csv"] and len(coords) > 1 and not all_waypoints:
+        raise ValueError("%d caches in one gpx file (a pocket query?), give --all-waypoints if all of them are corrected" % len(coords))
+    return coords
+
+def loadState(filename):
+    # {gccode: {"lat": ..., "lon": ..., "usertoken": ...}} of what was updated before
+    try:
+        with open(filename, "r") as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def saveState(filename, state):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    (fd, tmpfile) = tempfile.mkstemp(prefix=".", suffix=".json.tmp", dir=dirname)
+    with os.fdopen(fd, "w") as fh:
+        json.dump(state, fh, indent=0, sort_keys=True)
+        fsyncFile(fh)
+    replaceFile(tmpfile, filename)
+
+def isPushed(state, gccode, lat, lon):
+    pushed = state.get(gccode)
+    return pushed is not None and abs(pushed["lat"] - lat) < coord_epsilon_ and abs(pushed["lon"] - lon) < coord_epsilon_
+
+
+if __name__ == '__main__':
+    dry_mode_ = False
+    full_ = False
+    jobs_ = 4
+    all_waypoints_ = False
+    state_file_ = default_state_file_
+    gc.be_interactive = True
+    try:
+        opts, files = getopt.gnu_getopt(sys.argv[1:], "hnfj:au:p:i", ["help","dryrun","full","jobs=","all-waypoints","state=","username=","password=","noninteractive","debug"])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-n","--dryrun"]:
+                dry_mode_ = True
+            elif o in ["-f","--full"]:
+                full_ = True
+            elif o in ["-j","--jobs"]:
+                jobs_ = int(a)
+            elif o in ["-a","--all-waypoints"]:
+                all_waypoints_ = True
+            elif o in ["--state"]:
+                state_file_ = a
+            elif o in ["-u","--username"]:
+                gc.gc_username = a
+            elif o in ["-p","--password"]:
+                gc.gc_password = a
+            elif o in ["-i","--noninteractive"]:
+                gc.be_interactive = False
+            elif o in ["--debug"]:
+                gc.gc_debug = True
+    except (getopt.GetoptError, ValueError) as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    if len(files) < 1:
+        usage()
+        sys.exit(1)
+
+    coords = {}
+    for filename in files:
+        try:
+            coords.update(readCoordinates(filename, all_waypoints_))
+        except Exception as e:
+            print("ERROR: could not read %s: %s" % (filename, e), file=sys.stderr)
+            sys.exit(1)
+
+    state = loadState(state_file_)
+    changed = dict([(gccode, latlon) for (gccode, latlon) in coords.items() if full_ or not isPushed(state, gccode, *latlon)])
+    print("%d caches, %d changed since the last update" % (len(coords), len(changed)))
+    if dry_mode_:
+        for gccode in sorted(changed):
+            print("would update %s to %.6f %.6f" % ((gccode,) + changed[gccode]))
+        sys.exit(0)
+
+    usertokens = dict([(gccode, pushed.get("usertoken")) for (gccode, pushed) in state.items() if pushed.get("usertoken")])
+    def report(result):
+        if result.error is None:
+            state[result.gccode] = {"lat": result.lat, "lon": result.lon, "usertoken": result.usertoken}
+            print("updated %s to %.6f %.6f" % (result.gccode, result.lat, result.lon))
+        else:
+            print("ERROR: %s: %s" % (result.gccode, result.error), file=sys.stderr)
+
+    try:
+        results = gc.update_coordinates_bulk(changed, usertokens, threads=jobs_, callback=report)
+    except gc.NotLoggedInError as e:
+        print("ERROR:", e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        saveState(state_file_, state)
+    failed = len([r for r in results if r.error is not None])
+    print("%d updated, %d unchanged, %d failed" % (len(results) - failed, len(coords) - len(changed), failed))
+    if failed > 0:
+        sys.exit(1)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Watches pocket query / gpx directories and, whenever files arrive or
+# change, runs the other gctools on just those files:
+#   gc_get_spoiler_pics.py -> gc_add_gcvote_to_pq.py -> gpx_merge.py --incremental -> gc_devicesync.py
+# Spoilers come before votes, gc_get_spoiler_pics.py needs the unchanged descriptions.
+
+from __future__ import print_function
+import sys
+import os
+import time
+import getopt
+import signal
+import subprocess
+import watchlib
+
+gctools_dir_ = os.path.dirname(os.path.abspath(__file__))
+spoiler_done_file_ = ".gc_watch_spoilers.store"
+
+def usage():
+    print("gc_watch - process new and changed pocket queries as soon as they arrive")
+    print("\nSyntax:")
+    print("       %s [options] <gpx-dir> [...]" % (sys.argv[0]))
+    print("\nOptions:")
+    print("       -h           | --help              Show Help")
+    print("       -o <file>    | --output <file>     Merge all gpx files of the directories into <file>")
+    print("       -v           | --gcvote            Add GCVotes to new and changed gpx files")
+    print("       -s <dir>     | --spoilers <dir>    Download spoiler pictures of new and changed gpx files into <dir>")
+    print("       --sync-gpx <dir>                   Copy the directory of --output to <dir> (e.g. /media/GARMIN/Garmin/GPX)")
+    print("                                           whenever it changed and <dir> exists, i.e. the device is mounted")
+    print("       --sync-photos <dir>                Same for the spoiler pictures")
+    print("       --settle <sec>                     Wait until no file changed for <sec> seconds, default 10")
+    print("       --poll <sec>                       Look for changes every <sec> seconds instead of using inotify")
+    print("       --once                             Process all files once and exit")
+    print("       -n           | --dryrun            Only print what would be run")
+    print("\nFiles already in the directories when gc_watch starts are not processed, unless --once is given.")
+    print("\nExample:")
+    print("       %s -s ~/spoilers -v -o ~/garmin/pq.gpx --sync-gpx /media/GARMIN/Garmin/GPX --sync-photos /media/GARMIN/Garmin/GeocachePhotos ~/pq" % (sys.argv[0]))
+
+def log(*args):
+    print(time.strftime("%Y-%m-%d %H:%M:%S"), *args)
+    sys.stdout.flush()
+
+class Pipeline(object):
+    def __init__(self, dirs, output=None, gcvote=False, spoilers=None, sync_gpx=None, sync_photos=None, dryrun=False):
+        self.dirs = dirs
+        self.output = os.path.abspath(output) if output else None
+        self.gcvote = gcvote
+        self.spoilers = spoilers
+        self.syncs = []
+        if sync_gpx and self.output:
+            self.syncs.append((os.path.dirname(self.output), sync_gpx))
+        if sync_photos and spoilers:
+            self.syncs.append((spoilers, sync_photos))
+        self.pending_syncs = set()
+        self.dryrun = dryrun
+
+    def accept(self, path):
+        # input gpx files, but not what we write ourselves
+        if not path.lower().endswith(".gpx"):
+            return False
+        if self.output:
+            (base, ext) = os.path.splitext(self.output)
+            name = os.path.abspath(path)
+            if name == self.output or (name.startswith(base + "-") and name[len(base) + 1:-len(ext)].isdigit()):
+                return False
+        return True
+
+    def inputFiles(self):
+        files = []
+        for d in self.dirs:
+            files += [os.path.join(d, fn) for fn in sorted(os.listdir(d)) if not fn.startswith(".") and self.accept(os.path.join(d, fn))]
+        return files
+
+    def run(self, script, args):
+        cmd = [os.path.join(gctools_dir_, script)] + list(args)
+        log("running", " ".join(cmd))
+        if self.dryrun:
+            return True
+        rc = subprocess.call(cmd)
+        if rc != 0:
+            log("ERROR: %s exited with %d" % (script, rc))
+        return rc == 0
+
+    def process(self, changed, deleted):
+        # returns the input files that were rewritten by one of the stages
+        changed = sorted([f for f in changed if os.path.exists(f)])
+        rewritten = []
+        if changed and self.spoilers:
+            if self.run("gc_get_spoiler_pics.py", ["--savedir", self.spoilers, "--done_file", os.path.join(self.spoilers, spoiler_done_file_)] + changed):
+                self.pending_syncs.add(self.spoilers)
+        if changed and self.gcvote:
+            self.run("gc_add_gcvote_to_pq.py", changed)
+            rewritten = changed
+        if (changed or deleted) and self.output:
+            inputs = self.inputFiles()
+            if inputs and self.run("gpx_merge.py", ["--incremental", "-o", self.output] + inputs):
+                self.pending_syncs.add(os.path.dirname(self.output))
+        self.sync()
+        return rewritten
+
+    def sync(self):
+        # copies what changed onto the device, if it is mounted
+        for (src, dst) in self.syncs:
+            if src in self.pending_syncs and os.path.isdir(dst):
+                if self.run("gc_devicesync.py", ["-s", src, dst]):
+                    self.pending_syncs.discard(src)
+
+
+if __name__ == '__main__':
+    output_ = None
+    gcvote_ = False
+    spoilers_ = None
+    sync_gpx_ = None
+    sync_photos_ = None
+    settle_ = 10.0
+    poll_ = None
+    once_ = False
+    dryrun_ = False
+    try:
+        opts, dirs = getopt.gnu_getopt(sys.argv[1:], "ho:vs:n", ["help","output=","gcvote","spoilers=","sync-gpx=","sync-photos=","settle=","poll=","once","dryrun"])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-o","--output"]:
+                output_ = a
+            elif o in ["-v","--gcvote"]:
+                gcvote_ = True
+            elif o in ["-s","--spoilers"]:
+                spoilers_ = a
+            elif o in ["--sync-gpx"]:
+                sync_gpx_ = a
+            elif o in ["--sync-photos"]:
+                sync_photos_ = a
+            elif o in ["--settle"]:
+                settle_ = float(a)
+            elif o in ["--poll"]:
+                poll_ = float(a)
+            elif o in ["--once"]:
+                once_ = True
+            elif o in ["-n","--dryrun"]:
+                dryrun_ = True
+    except (getopt.GetoptError, ValueError) as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    dirs = [os.path.expanduser(d) for d in dirs]
+    if not dirs or [d for d in dirs if not os.path.isdir(d)]:
+        print("ERROR: please give one or more existing directories", file=sys.stderr)
+        usage()
+        sys.exit(1)
+    if sync_gpx_ and not output_ or sync_photos_ and not spoilers_:
+        print("ERROR: --sync-gpx needs --output and --sync-photos needs --spoilers", file=sys.stderr)
+        sys.exit(1)
+    if spoilers_ and not os.path.isdir(spoilers_) and not dryrun_:
+        os.makedirs(spoilers_)
+
+    pipeline = Pipeline(dirs, output_, gcvote_, spoilers_, sync_gpx_, sync_photos_, dryrun_)
+    if once_:
+        pipeline.process(pipeline.inputFiles(), [])
+        sys.exit(0)
+
+    # stop cleanly when the service manager stops us
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    watcher = watchlib.DirectoryWatcher(dirs, accept=pipeline.accept, settle=settle_, poll_interval=poll_)
+    log("watching %s (%s)" % (", ".join(dirs), watcher.method))
+    try:
+        while True:
+            # wake up now and then to sync onto a device that was plugged in meanwhile
+            changes = watcher.wait(timeout=60 if pipeline.pending_syncs else None)
+            if changes is None:
+                pipeline.sync()
+                continue
+            log("%d new or changed, %d deleted files" % (len(changes.changed), len(changes.deleted)))
+            watcher.refresh(pipeline.process(changes.changed, changes.deleted))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+from __future__ import print_function
+import sys
+import getopt
+from lxml import etree
+import waypointdblib as wdb
+
+def usage():
+    print("gc_waypointdb - keep all waypoints of your pocketqueries in a local database")
+    print("\nSyntax:")
+    print("       %s [options] ingest <gpx-file> [...]" % (sys.argv[0]))
+    print("       %s [options] export -o <output-gpx-file> [gccode ...]" % (sys.argv[0]))
+    print("       %s [options] list [gccode ...]" % (sys.argv[0]))
+    print("       %s [options] delete <gccode> [...]" % (sys.argv[0]))
+    print("\nOptions:")
+    print("       -h           | --help              Show Help")
+    print("       -d <file>    | --db <file>         Database file, default %s" % wdb.default_db_file_)
+    print("       -o <file>    | --output <file>     GPX file to export to")
+    print("       --bbox <minlat,minlon,maxlat,maxlon>  Only waypoints inside this box")
+    print("       --center <lat,lon> --radius <km>   Only waypoints within radius km of center")
+
+def parseFloats(s, num):
+    values = [float(x) for x in s.replace(";", ",").split(",")]
+    if len(values) != num:
+        raise ValueError("expected %d comma separated numbers, got '%s'" % (num, s))
+    return tuple(values)
+
+
+if __name__ == '__main__':
+    db_file_ = None
+    output_file_ = None
+    bbox_ = None
+    center_ = None
+    radius_ = None
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hd:o:", ["help","db=","output=","bbox=","center=","radius="])
+        for o, a in opts:
+            if o in ["-h","--help"]:
+                usage()
+                sys.exit()
+            elif o in ["-d","--db"]:
+                db_file_ = a
+            elif o in ["-o","--output"]:
+                output_file_ = a
+            elif o in ["--bbox"]:
+                (minlat, minlon, maxlat, maxlon) = parseFloats(a, 4)
+                bbox_ = (min(minlat, maxlat), min(minlon, maxlon), max(minlat, maxlat), max(minlon, maxlon))
+            elif o in ["--center"]:
+                center_ = parseFloats(a, 2)
+            elif o in ["--radius"]:
+                radius_ = float(a)
+    except (getopt.GetoptError, ValueError) as e:
+        print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    if len(args) < 1 or args[0] not in ["ingest", "export", "list", "delete"]:
+        usage()
+        sys.exit(1)
+    if (center_ is None) != (radius_ is None):
+        print("ERROR: --center and --radius have to be given together", file=sys.stderr)
+        sys.exit(1)
+    (command, args) = (args[0], args[1:])
+
+    with wdb.WaypointDB(db_file_) as db:
+        if command == "ingest":
+            for gpxfile in args:
+                try:
+                    (new, updated, unchanged) = db.ingest(gpxfile)
+                except (etree.ParserError, etree.XMLSyntaxError, IOError) as e:
+                    print("Warning: could not parse %s" % (gpxfile), file=sys.stderr)
+                    print("\tErrorMsg: %s" % (str(e)), file=sys.stderr)
+                    continue
+                print("%s: %d new, %d updated, %d unchanged waypoints" % (gpxfile, new, updated, unchanged))
+        elif command == "delete":
+            print("%d waypoints deleted" % db.delete([c.upper() for c in args]))
+        else:
+            rows = db.query(bbox=bbox_, center=center_, radius_km=radius_, codes=[c.upper() for c in args] if args else None)
+            if command == "list":
+                for (rowid, gccode, lat, lon) in rows:
+                    print("%-8s %10.5f %10.5f" % (gccode, lat if lat is not None else 0.0, lon if lon is not None else 0.0))
+            elif output_file_ is None:
+                print("ERROR: no output file given", file=sys.stderr)
+                sys.exit(1)
+            else:
+                print("%d waypoints exported to %s" % (db.exportGPX(output_file_, [r[0] for r in rows], "gc_waypointdb"), output_file_))
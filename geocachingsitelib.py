@@ -7,16 +7,12 @@
 from __future__ import print_function
 import sys
 import os
-from lxml import etree
-import requests
-try:
-    # Python3
-    from http.cookiejar import LWPCookieJar
-except:
-    # Python2
-    from cookielib import LWPCookieJar
 import re
 import types
+import json
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as _timer
 from io import StringIO
 try:
 	# Python3
@@ -26,6 +22,12 @@ except:
 	import urlparse
 
 from collections import namedtuple
+from garmindevicelib import GarminFieldLog, read_garmin_fieldnotes_xml
+
+# requests and lxml are only imported on first use (see _import_requests and _init_parser)
+# so tools that import this module but stay offline start fast
+requests = None
+etree = None
 
 
 #### Global Constants ####
@@ -34,18 +36,24 @@ gc_auth_uri_ = "https://www.geocaching.com/account/login?ReturnUrl=%2Fplay%2Fsea
 gc_uploadfieldnotes_uri_ = "https://www.geocaching.com/my/uploadfieldnotes.aspx"
 gc_listfieldnotes_uri_ = "https://www.geocaching.com/my/fieldnotes.aspx"
 gc_wp_uri_ = "https://www.geocaching.com/seek/cache_details.aspx?wp=%s"
+gc_setusercoord_uri_ = "https://www.geocaching.com/seek/cache_details.aspx/SetUserCoordinate"
 gc_pqlist_uri_ = "https://www.geocaching.com/pocket/default.aspx"
 gc_pqdownload_host_ = "https://www.geocaching.com"
 gc_pqdownload_path_ = '/pocket/downloadpq.ashx?g=%s&src=web'
 gc_debug = False
 
+re_user_token_ = re.compile(br"userToken = '([^']*)';")
+
 gcvote_getvote_uri_='http://gcvote.com/getVotes.php'
 
 default_config_dir_ = os.path.join(os.path.expanduser('~'),".local","share","gctools")
 auth_cookie_default_filename_ = "gctools_cookies"
 
 FieldNote = namedtuple("FieldNote",["name","date","time","type","loguri","deluri"])
-GarminFieldLog = namedtuple("GarminFieldLog",["gccode","date","time","type","comment"])
+RequestRecord = namedtuple("RequestRecord",["method","urlclass","url","status","bytes","latency","retries","relogins","invalidations","error"])
+# result of update_coordinates_bulk, error is None on success
+CoordinateUpdate = namedtuple("CoordinateUpdate",["gccode","lat","lon","usertoken","error"])
+LogForm = namedtuple("LogForm",["formaction","post_data","checkboxes","loginfo_input_name","valid_logtype_ids","fieldnote_loginfo"])
 
 
 #### Exceptions ####
@@ -75,13 +83,27 @@ def _did_request_succeed(r):
     else:
         assert False
 
+def _import_requests():
+    global requests
+    if requests is None:
+        import requests as requests_module
+        requests = requests_module
+    return requests
+
 def _init_parser():
-    global parser_, xml_parser_
+    global etree, parser_, xml_parser_
+    if etree is None:
+        from lxml import etree as lxml_etree
+        etree = lxml_etree
     parser_ = etree.HTMLParser(encoding = "utf-8")
     xml_parser_ = etree.XMLParser(encoding="utf-8")
 
+def _ensure_parser():
+    if parser_ is None:
+        _init_parser()
+
 parser_ = None
-_init_parser()
+xml_parser_ = None
 
 def _ask_usr_pwd():
     if allow_use_wx:
@@ -121,6 +143,7 @@ def _request_for_hidden_inputs(uri):
         return ({}, uri)
 
 def _parse_for_hidden_inputs(uri, content):
+    _ensure_parser()
     post_data = {}
     formaction = uri
     tree = etree.fromstring(content, parser_)
@@ -159,18 +182,120 @@ def _splitList(lst,n):
         yield lst[i:i+n]
         i+=n
 
+# first matching path fragment determines the class of an url in a RequestRecord
+request_url_classes_ = [
+    ("login", "/account/login"),
+    ("cache_details_coord", "/seek/cache_details.aspx/SetUserCoordinate"),
+    ("cache_details", "/seek/cache_details.aspx"),
+    ("log", "/seek/log.aspx"),
+    ("fieldnotes_upload", "/my/uploadfieldnotes.aspx"),
+    ("fieldnotes", "/my/fieldnotes.aspx"),
+    ("pq_download", "/pocket/downloadpq.ashx"),
+    ("pq_list", "/pocket/"),
+    ("gcvote", "/getVotes.php"),
+]
+request_image_exts_ = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+
+def _classify_url(uri):
+    if uri is None:
+        return "other"
+    path = urlparse.urlsplit(uri).path
+    for (urlclass, fragment) in request_url_classes_:
+        if fragment in path:
+            return urlclass
+    if path.lower().endswith(request_image_exts_):
+        return "image"
+    return "other"
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+#### Request Statistics ####
+
+class RequestStatsCollector(object):
+    # a request hook, see GCSession.request_hooks. Aggregates RequestRecords per method and url class
+    def __init__(self, keep_records=False):
+        self.lock = threading.Lock()
+        self.keep_records = keep_records
+        self.records = []
+        self.latencies = {}
+        self.stats = {}
+
+    def __call__(self, record):
+        key = "%s %s" % (record.method, record.urlclass)
+        with self.lock:
+            if self.keep_records:
+                self.records.append(record)
+            s = self.stats.get(key)
+            if s is None:
+                s = self.stats[key] = {"count": 0, "errors": 0, "bytes": 0, "latency_total": 0.0, "retries": 0, "relogins": 0, "invalidations": 0, "status": {}}
+                self.latencies[key] = []
+            s["count"] += 1
+            s["bytes"] += record.bytes
+            s["latency_total"] += record.latency
+            s["retries"] += record.retries
+            s["relogins"] += record.relogins
+            s["invalidations"] += record.invalidations
+            if record.error is not None:
+                s["errors"] += 1
+            status = str(record.status)
+            s["status"][status] = s["status"].get(status, 0) + 1
+            self.latencies[key].append(record.latency)
+
+    def summary(self):
+        rv = {}
+        with self.lock:
+            for (key, s) in self.stats.items():
+                latencies = sorted(self.latencies[key])
+                d = dict(s)
+                d["status"] = dict(s["status"])
+                d["latency_mean"] = s["latency_total"] / s["count"]
+                d["latency_p50"] = _percentile(latencies, 50)
+                d["latency_p90"] = _percentile(latencies, 90)
+                d["latency_p99"] = _percentile(latencies, 99)
+                d["latency_max"] = latencies[-1]
+                rv[key] = d
+        return rv
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.summary(), sort_keys=True, **kwargs)
+
+    def reset(self):
+        with self.lock:
+            self.records = []
+            self.latencies = {}
+            self.stats = {}
+
 #### Login / Requests-Lib Decorator ####
 
 class GCSession(object):
-    def __init__(self, gc_username, gc_password, cookie_session_filename, ask_pass_handler):
+    def __init__(self, gc_username, gc_password, cookie_session_filename, ask_pass_handler, request_hooks=None):
         self.logged_in = 0 #0: no, 1: yes but session may have time out, 2: yes
+        # threads share the session: only one of them logs in or drops the
+        # cookies at a time, login_generation counts the logins so a request
+        # made with an older login does not throw away a newer one
+        self.login_lock = threading.RLock()
+        self.login_generation = 0
+        # callables, each called with a RequestRecord after every req_get, req_post and req_post_json
+        self.request_hooks = request_hooks if request_hooks is not None else []
+        self._trace = threading.local()
+        self._thread = threading.local()
         self.ask_pass_handler = ask_pass_handler
         self.gc_username = gc_username
         self.gc_password = gc_password
         self.cookie_session_filename = cookie_session_filename
         self.user_agent_ = "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:54.0) Gecko/20100101 Firefox/54.0"
-        self.session = requests.Session()
+        self.session = _import_requests().Session()
         if self._haveCookieFilename():
+            try:
+                # Python3
+                from http.cookiejar import LWPCookieJar
+            except ImportError:
+                # Python2
+                from cookielib import LWPCookieJar
             self.session.cookies = LWPCookieJar(_config_file(self.cookie_session_filename))
 
     def _save_cookie_login(self):
@@ -188,6 +313,8 @@ class GCSession(object):
         return isinstance(self.cookie_session_filename, str)
 
     def _askUserPass(self):
+        if getattr(self._thread, "noninteractive", False):
+            return self._haveUserPass()
         if isinstance(self.ask_pass_handler, types.FunctionType):
             try:
                 (self.gc_username, self.gc_password) = self.ask_pass_handler()
@@ -196,6 +323,18 @@ class GCSession(object):
                 return False
         return self._haveUserPass()
 
+    @contextmanager
+    def nonInteractive(self):
+        # with gcsession.nonInteractive(): requests of this thread never ask
+        # for a password, e.g. from a background thread while a GUI is shown.
+        # Without known credentials they raise NotLoggedInError instead.
+        old = getattr(self._thread, "noninteractive", False)
+        self._thread.noninteractive = True
+        try:
+            yield self
+        finally:
+            self._thread.noninteractive = old
+
     def login(self):
         if not self._haveUserPass():
             raise Exception("Login called without known username/passwort")
@@ -244,61 +383,109 @@ class GCSession(object):
             return False
 
     def _check_login(self):
-        if self.logged_in > 0:
-            return True
-        if self.loadSessionCookie():
-            self.logged_in = 1
-            return True
-        if not self._haveUserPass():
-            if not self._askUserPass():
-                raise NotLoggedInError("Don't know login credentials and can't ask user interactively")
-        if not self.login():
-            raise NotLoggedInError("login failed, wrong username/password")
-        self.logged_in = 2
-        return True
-
-    def _check_is_session_valid(self, content):
+        # returns the login_generation the next request is made with
+        with self.login_lock:
+            if self.logged_in > 0:
+                return self.login_generation
+            if self.loadSessionCookie():
+                self.logged_in = 1
+                self.login_generation += 1
+                return self.login_generation
+            if not self._haveUserPass():
+                if not self._askUserPass():
+                    raise NotLoggedInError("Don't know login credentials and can't ask user interactively")
+            self._trace.relogins = getattr(self._trace, "relogins", 0) + 1
+            if not self.login():
+                raise NotLoggedInError("login failed, wrong username/password")
+            self.logged_in = 2
+            self.login_generation += 1
+            return self.login_generation
+
+    def _check_is_session_valid(self, content, generation=None):
         if content.find(b"id=\"ctl00_ContentBody_cvLoginFailed\"") >= 0 \
         or content.find(b'<a id="hlSignIn" accesskey="s" title="Sign In" class="SignInLink" href="/login/">Sign In') >= 0 \
         or content.find(b'<h2>Object moved to <a href="https://www.geocaching.com/login/?RESET=Y&amp;redir=') >= 0:
-            self.invalidate_cookie()
-            self.logged_in = 0
+            self._trace.invalidations = getattr(self._trace, "invalidations", 0) + 1
+            with self.login_lock:
+                # another thread may already have logged in again
+                if generation is None or generation == self.login_generation:
+                    self.invalidate_cookie()
+                    self.logged_in = 0
             return False
         return True
 
-    def req_wrap(self, reqfun):
+    def req_wrap(self, reqfun, method="GET", uri=None):
+        if not self.request_hooks:
+            return self._req_wrap(reqfun)
+        self._trace.relogins = 0
+        self._trace.invalidations = 0
+        self._trace.attempts = 0
+        self._trace.response = None
+        error = None
+        t_start = _timer()
+        try:
+            return self._req_wrap(reqfun)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._run_request_hooks(method, uri, _timer() - t_start, error)
+
+    def _req_wrap(self, reqfun):
         attempts = 2
         while attempts > 0:
-            self._check_login()
+            generation = self._check_login()
             attempts -= 1
+            self._trace.attempts = 2 - attempts
             r = reqfun()
+            self._trace.response = r
             _debug_print("req_wrap","uri: %s\n" % r.url,"attempts: %d\n" % attempts, r.content)
             if _did_request_succeed(r):
-                if self._check_is_session_valid(r.content):
+                if self._check_is_session_valid(r.content, generation):
                     return r
             else:
                 raise HTTPError("Recieved HTTP Error "+str(r.status_code))
         raise NotLoggedInError("Request to geocaching.com failed")
 
+    def _run_request_hooks(self, method, uri, latency, error):
+        r = self._trace.response
+        record = RequestRecord(method=method,
+                               urlclass=_classify_url(uri),
+                               url=uri,
+                               status=r.status_code if r is not None else None,
+                               bytes=len(r.content) if r is not None else 0,
+                               latency=latency,
+                               retries=max(0, self._trace.attempts - 1),
+                               relogins=self._trace.relogins,
+                               invalidations=self._trace.invalidations,
+                               error=type(error).__name__ if error is not None else None)
+        for hook in self.request_hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                _debug_print("request hook", hook, e)
+
     def req_get(self, uri):
-        return self.req_wrap(lambda : self.session.get(uri, headers = {"User-Agent":self.user_agent_, "Referer":uri}))
+        return self.req_wrap(lambda : self.session.get(uri, headers = {"User-Agent":self.user_agent_, "Referer":uri}), "GET", uri)
 
     def req_post(self, uri, post_data, files = None):
-        return self.req_wrap(lambda : self.session.post(uri, data = post_data, files = _seek0_files_in_dict(files), allow_redirects = False, headers = {"User-Agent":self.user_agent_, "Referer":uri}))
+        return self.req_wrap(lambda : self.session.post(uri, data = post_data, files = _seek0_files_in_dict(files), allow_redirects = False, headers = {"User-Agent":self.user_agent_, "Referer":uri}), "POST", uri)
 
     def req_post_json(self, uri, json_data):
-        return self.req_wrap(lambda : self.session.post(uri, json = json_data, allow_redirects = False, headers = {"User-Agent":self.user_agent_, "Referer":uri}))
+        return self.req_wrap(lambda : self.session.post(uri, json = json_data, allow_redirects = False, headers = {"User-Agent":self.user_agent_, "Referer":uri}), "POST_JSON", uri)
 
 _gc_session_ = False
 gc_username = None
 gc_password = None
 be_interactive = True
 allow_use_wx = False
+# hooks of the default session, e.g. gc.request_hooks.append(gc.RequestStatsCollector())
+request_hooks = []
 
 def getDefaultInteractiveGCSession():
     global _gc_session_
     if not isinstance(_gc_session_, GCSession):
-        _gc_session_ = GCSession( gc_username = gc_username, gc_password = gc_password, cookie_session_filename = auth_cookie_default_filename_, ask_pass_handler = _ask_usr_pwd if be_interactive else None)
+        _gc_session_ = GCSession( gc_username = gc_username, gc_password = gc_password, cookie_session_filename = auth_cookie_default_filename_, ask_pass_handler = _ask_usr_pwd if be_interactive else None, request_hooks = request_hooks)
     return _gc_session_
 
 
@@ -327,6 +514,7 @@ def download_gpx(gccode, dstdir):
     raise GeocachingSiteError("Invalid gccode or other geocaching.com error")
 
 def get_pq_names():
+    _ensure_parser()
     gcsession = getDefaultInteractiveGCSession()
     uri = gc_pqlist_uri_
     r = gcsession.req_get(uri)
@@ -350,27 +538,89 @@ def download_pq(pquid, dstdir):
             return filename
     raise GeocachingSiteError("Invalid PQ uid or other geocaching.com error")
 
-def update_coordinates(gccode, latitude, longitude):
-    import re
+def get_user_token(gccode):
+    # the userToken of a cache page, needed to set corrected coordinates
     gcsession = getDefaultInteractiveGCSession()
-    uri = "https://www.geocaching.com/seek/cache_details.aspx/SetUserCoordinate"
-
-    # Get the user token
-    r = gcsession.req_get(gc_wp_uri_ % gccode)
-
-    res = re.search('userToken = \'(.*)\';', r.content)
-    if not(res):
-        GeocachingSiteError("Did not find userToken!")
-
-    userToken = res.group(1)
-
-    json_data = {
-            "dto": {
-                "data": {"lat": latitude, "lng": longitude }, "ut": userToken }
-            }
-    r = gcsession.req_post_json(uri, json_data)
+    r = gcsession.req_get(gc_wp_uri_ % gccode.upper())
+    res = re_user_token_.search(r.content)
+    if not res:
+        raise GeocachingSiteError("Did not find userToken of %s" % gccode)
+    return res.group(1).decode("utf-8")
+
+def update_coordinates(gccode, latitude, longitude, usertoken=None):
+    # Sets the corrected coordinates of a cache and returns the userToken used.
+    # A usertoken returned by an earlier call for the same cache saves getting
+    # the cache page again, if geocaching.com rejects it a new one is fetched.
+    gcsession = getDefaultInteractiveGCSession()
+    while True:
+        token = usertoken if usertoken else get_user_token(gccode)
+        json_data = {
+                "dto": {
+                    "data": {"lat": latitude, "lng": longitude }, "ut": token }
+                }
+        try:
+            _check_setusercoord_reply(gccode, gcsession.req_post_json(gc_setusercoord_uri_, json_data))
+            return token
+        except (HTTPError, GeocachingSiteError):
+            if not usertoken:
+                raise
+            usertoken = None
+
+def _check_setusercoord_reply(gccode, r):
+    # geocaching.com answers {"d": "{\"status\":\"success\"}"}, the inner
+    # json as a string. Anything else means the coordinates were not set.
+    try:
+        status = r.json()["d"]
+        if isinstance(status, (type(""), type(u""))) and status.lstrip().startswith("{"):
+            status = json.loads(status)
+        if isinstance(status, dict):
+            status = status.get("status")
+    except (ValueError, KeyError, TypeError):
+        status = None
+    if status != "success":
+        raise GeocachingSiteError("geocaching.com did not set the coordinates of %s: %s" % (gccode, r.text[:200]))
+
+def update_coordinates_bulk(coordinates, usertokens=None, threads=4, callback=None):
+    # coordinates: {gccode: (lat, lon)}, usertokens: {gccode: userToken} of
+    # earlier calls, updated in place. The first cache is done alone, so we log
+    # in only once, the rest on up to threads parallel connections. They share
+    # the session, if it expires only one of them logs in again.
+    # callback(CoordinateUpdate) is called after each cache, one call at a time.
+    # Returns the list of CoordinateUpdates, a NotLoggedInError aborts.
+    from multiprocessing.pool import ThreadPool
+    if usertokens is None:
+        usertokens = {}
+    callback_lock = threading.Lock()
+    def update(gccode):
+        (lat, lon) = coordinates[gccode]
+        try:
+            token = update_coordinates(gccode, lat, lon, usertokens.get(gccode))
+            usertokens[gccode] = token
+            result = CoordinateUpdate(gccode, lat, lon, token, None)
+        except NotLoggedInError:
+            raise
+        except Exception as e:
+            _debug_print("update_coordinates %s" % gccode, e)
+            result = CoordinateUpdate(gccode, lat, lon, usertokens.get(gccode), e)
+        if callback is not None:
+            with callback_lock:
+                callback(result)
+        return result
+    gccodes = sorted(coordinates)
+    if not gccodes:
+        return []
+    results = [update(gccodes[0])]
+    if len(gccodes) > 1:
+        pool = ThreadPool(max(1, min(threads, len(gccodes) - 1)))
+        try:
+            results += pool.map(update, gccodes[1:], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return results
 
 def upload_fieldnote(fieldnotefileObj, ignore_previous_logs = True):
+    _ensure_parser()
     gcsession = getDefaultInteractiveGCSession()
     #<input id="ctl00_ContentBody_chkSuppressDate" type="checkbox" checked="checked" name="ctl00$ContentBody$chkSuppressDate">
     #<input id="ctl00_ContentBody_FieldNoteLoader" type="file" name="ctl00$ContentBody$FieldNoteLoader">
@@ -400,6 +650,7 @@ def upload_fieldnote(fieldnotefileObj, ignore_previous_logs = True):
         raise GeocachingSiteError("geocaching.com did not like the provided file %s" % fieldnotefileObj.name)
 
 def get_fieldnotes():
+    _ensure_parser()
     gcsession = getDefaultInteractiveGCSession()
     uri = gc_listfieldnotes_uri_
     r = gcsession.req_get(uri)
@@ -417,35 +668,25 @@ def get_fieldnotes():
                                                 deluri=urlparse.urljoin(uri,tr_elem[4][1].get("href"))))
     return rv
 
-def submit_log(loguri, logtext, logdate=None, logtype=None, favorite=False, encrypt=False):
-    #~ Valid Log Types:
-		#~ <option value="-1">- Select Type of Log -</option>
-		#~ <option value="2">Found it</option>
-		#~ <option value="3">Didn&#39;t find it</option>
-		#~ <option value="4">Write note</option>
-		#~ <option value="7">Needs Archived</option>
-		#~ <option value="45">Needs Maintenance</option>
+def fetch_log_form(loguri):
+    _ensure_parser()
     gcsession = getDefaultInteractiveGCSession()
     r = gcsession.req_get(loguri)
     loginfo_input_name="ctl00$ContentBody$LogBookPanel1$uxLogInfo"
     valid_logtype_ids = []
-    rv = []
     post_data={}
     post_checkboxes=[]
     fieldnote_loginfo=""
     tree = etree.fromstring(r.content, parser_)
     formelem = tree.find(".//form")
     if formelem is None:
-        return rv
+        return None
     formaction=urlparse.urljoin(loguri,formelem.get("action"))
 
     for textarea_elem in formelem.findall(".//textarea"):
         if textarea_elem.get("name").endswith("LogInfo"):
             loginfo_input_name = textarea_elem.get("name")
-            fieldnote_loginfo = textarea_elem.text.strip()
-
-    if fieldnote_loginfo:
-        print("Fieldnote stored logtext found:", fieldnote_loginfo)
+            fieldnote_loginfo = (textarea_elem.text or "").strip()
 
     for select_elem in formelem.findall(".//select"):
         if not select_elem.get("name").endswith("LogType"):
@@ -455,33 +696,60 @@ def submit_log(loguri, logtext, logdate=None, logtype=None, favorite=False, encr
             valid_logtype_ids.append(option_elem.get("value"))
             if option_elem.get("selected"):
                 post_data[select_elem.get("name")] = option_elem.get("value")
-    valid_logtype_ids.remove("-1")
+    if "-1" in valid_logtype_ids:
+        valid_logtype_ids.remove("-1")
 
     for input_elem in formelem.findall(".//input"):
         if input_elem.get("type") == "checkbox":
             post_checkboxes.append(input_elem.get("name"))
         else:
             post_data[input_elem.get("name")] = input_elem.get("value")
+    return LogForm(formaction=formaction,
+                   post_data=post_data,
+                   checkboxes=post_checkboxes,
+                   loginfo_input_name=loginfo_input_name,
+                   valid_logtype_ids=valid_logtype_ids,
+                   fieldnote_loginfo=fieldnote_loginfo)
+
+def submit_log(loguri, logtext, logdate=None, logtype=None, favorite=False, encrypt=False, logform=None):
+    #~ Valid Log Types:
+		#~ <option value="-1">- Select Type of Log -</option>
+		#~ <option value="2">Found it</option>
+		#~ <option value="3">Didn&#39;t find it</option>
+		#~ <option value="4">Write note</option>
+		#~ <option value="7">Needs Archived</option>
+		#~ <option value="45">Needs Maintenance</option>
+    # logform may be a LogForm prefetched with fetch_log_form(), then only the POST is done here
+    gcsession = getDefaultInteractiveGCSession()
+    if logform is None:
+        logform = fetch_log_form(loguri)
+    if logform is None:
+        return []
+
+    if logform.fieldnote_loginfo:
+        print("Fieldnote stored logtext found:", logform.fieldnote_loginfo)
+
+    post_data = dict(logform.post_data)
     if encrypt:
-        input_name = filter(lambda s: s.endswith("Encrypt"), post_checkboxes)
+        input_name = [s for s in logform.checkboxes if s.endswith("Encrypt")]
         if input_name:
             post_data[input_name[0]]=1
     if favorite:
-        input_name = filter(lambda s: s.endswith("AddToFavorites"), post_checkboxes)
+        input_name = [s for s in logform.checkboxes if s.endswith("AddToFavorites")]
         if input_name:
             post_data[input_name[0]]=1
-    if str(logtype) in valid_logtype_ids:
-        input_name = filter(lambda s: s.endswith("LogType"), post_data.keys())
+    if str(logtype) in logform.valid_logtype_ids:
+        input_name = [s for s in post_data.keys() if s.endswith("LogType")]
         if input_name:
             post_data[input_name[0]]=str(logtype)
     if logdate is not None:
-        input_name = filter(lambda s: s.endswith("DateVisited"), post_data.keys())
+        input_name = [s for s in post_data.keys() if s.endswith("DateVisited")]
         if input_name:
             post_data[input_name[0]]=logdate
-    post_data[loginfo_input_name]=logtext
+    post_data[logform.loginfo_input_name]=logtext
 
     ### Post Log ###
-    r = gcsession.req_post(formaction, post_data)
+    r = gcsession.req_post(logform.formaction, post_data)
     return _did_request_succeed(r)
 
 def get_gcvotes(gcids_list, gcv_usr=None, gcv_pwd=None, use_median=True, request_limit=10):
@@ -496,8 +764,8 @@ def get_gcvotes(gcids_list, gcv_usr=None, gcv_pwd=None, use_median=True, request
         raise Exception("got empty list")
     for gcids in _splitList(gcids_list, request_limit):
         post_data={"version":"2.4e","userName":gcv_usr, "password":gcv_pwd,"cacheIds":",".join(gcids)}
-        r = requests.post(gcvote_getvote_uri_, data=post_data, allow_redirects=False)
-        if _did_request_succeed(r) and r.content.find("<votes userName='%s'" % gcv_usr) >= 0:
+        r = _import_requests().post(gcvote_getvote_uri_, data=post_data, allow_redirects=False)
+        if _did_request_succeed(r) and r.content.find(("<votes userName='%s'" % gcv_usr).encode("utf-8")) >= 0:
             try:
                 tree = etree.fromstring(r.content, xml_parser_)
                 for vote in tree.findall(".//vote[@voteMedian]"):
@@ -507,23 +775,9 @@ def get_gcvotes(gcids_list, gcv_usr=None, gcv_pwd=None, use_median=True, request
                 _debug_print(e)
                 continue
         else:
-            raise Exception("GC-Vote download error." + (" GC-Vote: "+r.content if len(r.content) < 10 else ""))
+            raise Exception("GC-Vote download error." + (" GC-Vote: "+r.content.decode("utf-8","replace") if len(r.content) < 10 else ""))
     return rdict
 
-def read_garmin_fieldnotes_xml(filename):
-    _init_parser()
-    rv = []
-    with open(filename,"rb") as fh:
-        tree = etree.parse(fh, xml_parser_).getroot()
-    for log_elem in tree:
-        timedate=log_elem.find("./{http://www.garmin.com/xmlschemas/geocache_visits/v1}time").text
-        rv.append(GarminFieldLog(gccode=log_elem.find("./{http://www.garmin.com/xmlschemas/geocache_visits/v1}code").text,
-                                                date=timedate[0:10],
-                                                time=timedate[11:19],
-                                                type=log_elem.find("./{http://www.garmin.com/xmlschemas/geocache_visits/v1}result").text,
-                                                comment=log_elem.find("./{http://www.garmin.com/xmlschemas/geocache_visits/v1}comment").text))
-    return rv
-
 def urlopen(url):
     gcsession = getDefaultInteractiveGCSession()
     r = gcsession.req_get(url)
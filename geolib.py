@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Bulk geometry on waypoint coordinates held in numpy arrays (degrees).
+# Waypoints without coordinates are NaN and never match any area.
+
+from __future__ import print_function
+import json
+import numpy as np
+import gpxlib
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+earth_radius_km_ = 6371.0088
+
+
+def parseLatLon(s):
+    # "47.07,15.43" -> (47.07, 15.43)
+    (lat, lon) = [float(x) for x in s.replace(";", ",").split(",")]
+    return (lat, lon)
+
+def parseBBox(s):
+    # "minlat,minlon,maxlat,maxlon"
+    (minlat, minlon, maxlat, maxlon) = [float(x) for x in s.replace(";", ",").split(",")]
+    return (min(minlat, maxlat), min(minlon, maxlon), max(minlat, maxlat), max(minlon, maxlon))
+
+def greatCircleDistance(lat, lon, lat0, lon0):
+    # haversine distance in km from every (lat, lon) to (lat0, lon0)
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    lat0 = np.radians(lat0)
+    lon0 = np.radians(lon0)
+    a = np.sin((lat - lat0) / 2.0) ** 2 + np.cos(lat) * np.cos(lat0) * np.sin((lon - lon0) / 2.0) ** 2
+    return 2.0 * earth_radius_km_ * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def toUnitVectors(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+def distanceToNearestAnchor(lat, lon, anchors):
+    # great-circle distance in km from every waypoint to the closest of the
+    # anchors [(lat, lon), ...]. Waypoints without coordinates get inf.
+    alat = np.array([a[0] for a in anchors], dtype=float)
+    alon = np.array([a[1] for a in anchors], dtype=float)
+    dist = np.full(np.shape(lat), np.inf)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    if cKDTree is not None and len(anchors) > 1:
+        # chord length between unit vectors grows monotonically with the great-circle distance
+        (chord, idx) = cKDTree(toUnitVectors(alat, alon)).query(toUnitVectors(lat[valid], lon[valid]))
+        dist[valid] = 2.0 * earth_radius_km_ * np.arcsin(np.minimum(chord / 2.0, 1.0))
+    else:
+        for i in range(len(anchors)):
+            dist[valid] = np.minimum(dist[valid], greatCircleDistance(lat[valid], lon[valid], alat[i], alon[i]))
+    return dist
+
+def _spreadBits(x):
+    # 0..2**32-1 -> the same bits at the even positions of a uint64
+    x = x.astype(np.uint64)
+    for (shift, mask) in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+def geohashKey(lat, lon, bits=30):
+    # integer with the interleaved bits of a geohash (lon first), sorting by it
+    # keeps nearby waypoints together. Waypoints without coordinates sort last.
+    scale = float(2 ** bits)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    qlat = np.clip((np.where(valid, lat, 0.0) + 90.0) / 180.0 * scale, 0, scale - 1).astype(np.uint64)
+    qlon = np.clip((np.where(valid, lon, 0.0) + 180.0) / 360.0 * scale, 0, scale - 1).astype(np.uint64)
+    key = (_spreadBits(qlon) << np.uint64(1)) | _spreadBits(qlat)
+    key[~valid] = np.iinfo(np.uint64).max
+    return key
+
+def inBBox(lat, lon, bbox):
+    (minlat, minlon, maxlat, maxlon) = bbox
+    return (lat >= minlat) & (lat <= maxlat) & (lon >= minlon) & (lon <= maxlon)
+
+def inRadius(lat, lon, center, radius_km):
+    return greatCircleDistance(lat, lon, center[0], center[1]) <= radius_km
+
+def inRing(lat, lon, ring):
+    # even-odd rule, one vectorized step per polygon edge
+    inside = np.zeros(np.shape(lat), dtype=bool)
+    if len(ring) < 3:
+        return inside
+    rlat = np.asarray([p[0] for p in ring], dtype=float)
+    rlon = np.asarray([p[1] for p in ring], dtype=float)
+    # only points inside the bounding box of the ring need the edge tests
+    candidates = np.flatnonzero(inBBox(lat, lon, (rlat.min(), rlon.min(), rlat.max(), rlon.max())))
+    clat = lat[candidates]
+    clon = lon[candidates]
+    cinside = np.zeros(len(candidates), dtype=bool)
+    for i in range(len(ring)):
+        (lat1, lon1, lat2, lon2) = (rlat[i - 1], rlon[i - 1], rlat[i], rlon[i])
+        if lat1 == lat2:
+            continue
+        crosses = (lat1 > clat) != (lat2 > clat)
+        cinside ^= crosses & (clon < (lon2 - lon1) * (clat - lat1) / (lat2 - lat1) + lon1)
+    inside[candidates] = cinside
+    return inside
+
+def inPolygons(lat, lon, polygons):
+    # polygons: list of polygons, each a list of rings (outer ring first, then holes),
+    # each ring a list of (lat, lon). A point matches if it is inside any polygon.
+    inside = np.zeros(np.shape(lat), dtype=bool)
+    for polygon in polygons:
+        in_polygon = np.zeros(np.shape(lat), dtype=bool)
+        for ring in polygon:
+            in_polygon ^= inRing(lat, lon, ring)
+        inside |= in_polygon
+    return inside
+
+def _geoJSONPolygons(obj):
+    if obj is None:
+        return []
+    objtype = obj.get("type")
+    if objtype == "FeatureCollection":
+        return [p for feature in obj.get("features", []) for p in _geoJSONPolygons(feature)]
+    elif objtype == "Feature":
+        return _geoJSONPolygons(obj.get("geometry"))
+    elif objtype == "GeometryCollection":
+        return [p for geometry in obj.get("geometries", []) for p in _geoJSONPolygons(geometry)]
+    elif objtype == "Polygon":
+        return [[[(p[1], p[0]) for p in ring] for ring in obj["coordinates"]]]
+    elif objtype == "MultiPolygon":
+        return [[[(p[1], p[0]) for p in ring] for ring in polygon] for polygon in obj["coordinates"]]
+    return []
+
+def _gpxPolygons(filename):
+    # every <trkseg> and <rte> is the outline of one area
+    polygons = []
+    for elem in gpxlib.GPXReader(filename).iterElements():
+        if gpxlib.isGPXTag(elem.tag, "trk"):
+            segments = [seg for seg in elem if gpxlib.isGPXTag(seg.tag, "trkseg")]
+        elif gpxlib.isGPXTag(elem.tag, "rte"):
+            segments = [elem]
+        else:
+            continue
+        for seg in segments:
+            ring = [(float(pt.get("lat")), float(pt.get("lon"))) for pt in seg if gpxlib.isGPXTag(pt.tag, "trkpt") or gpxlib.isGPXTag(pt.tag, "rtept")]
+            if len(ring) >= 3:
+                polygons.append([ring])
+    return polygons
+
+def loadPolygons(filename):
+    # GeoJSON (Polygon, MultiPolygon, Features thereof) or a GPX file with tracks/routes
+    with open(filename, "rb") as fh:
+        start = fh.read(64).lstrip()
+    if start.startswith(b"{"):
+        with open(filename, "r") as fh:
+            polygons = _geoJSONPolygons(json.load(fh))
+    else:
+        polygons = _gpxPolygons(filename)
+    if not polygons:
+        raise ValueError("no polygon found in %s" % filename)
+    return polygons
+
+def loadAnchors(filename):
+    # the waypoints of a GPX file or a text file with one "lat,lon" per line
+    with open(filename, "rb") as fh:
+        start = fh.read(64).lstrip()
+    if start.startswith(b"<"):
+        anchors = [(wpt.lat, wpt.lon) for wpt in gpxlib.iterWaypoints(filename) if wpt.lat is not None]
+    else:
+        with open(filename, "r") as fh:
+            anchors = [parseLatLon(line) for line in fh if line.strip() and not line.lstrip().startswith("#")]
+    if not anchors:
+        raise ValueError("no coordinates found in %s" % filename)
+    return anchors
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Garmin GGZ output: a zip with several GPX files in data/ and one index in
+# index/com/garmin/geocaches/v0/index.xml that lists every geocache with the
+# byte range of its <wpt> in the (uncompressed) GPX file.
+# Every GPX member and its part of the index are streamed to temporary files
+# first, so no more than one <wpt> at a time has to be kept in memory.
+
+from __future__ import print_function
+import os
+import re
+import zlib
+import shutil
+import zipfile
+import tempfile
+from lxml import etree
+import gpxlib
+from waypointtablelib import re_lat_, re_lon_, re_name_, re_difficulty_, re_terrain_, re_cachetype_, re_container_
+
+ggz_ns_ = "http://www.opencaching.com/xmlschemas/ggz/1/0"
+ggz_index_path_ = "index/com/garmin/geocaches/v0/index.xml"
+ggz_data_dir_ = "data/"
+# groundspeak:container -> rating used by the GGZ index
+ggz_sizes_ = {u"Micro": u"2", u"Small": u"3", u"Regular": u"4", u"Large": u"5"}
+
+re_cache_name_ = re.compile(br'<[\w.-]+:name>\s*([^<]*?)\s*<')
+re_urlname_ = re.compile(br'<urlname>\s*([^<]*?)\s*</urlname>')
+re_sym_ = re.compile(br'<sym>\s*([^<]*?)\s*</sym>')
+
+
+def _unescape(m):
+    # text of a regex match on raw XML, with entities resolved
+    if m is None:
+        return None
+    return etree.fromstring(b"<x>" + m.group(1) + b"</x>").text or u""
+
+def cacheIndexEntry(data, offset, length):
+    # <gch> index entry for a serialized <wpt>, None if it is no geocache
+    cachetype = _unescape(re_cachetype_.search(data))
+    if cachetype is None:
+        return None
+    start_tag = data[:data.find(b">")]
+    gch = etree.Element("gch")
+    for (tag, text) in [("code", _unescape(re_name_.search(data))),
+            ("name", _unescape(re_cache_name_.search(data) or re_urlname_.search(data))),
+            ("type", cachetype),
+            ("lat", _unescape(re_lat_.search(start_tag))),
+            ("lon", _unescape(re_lon_.search(start_tag))),
+            ("file_pos", str(offset)),
+            ("file_len", str(length))]:
+        etree.SubElement(gch, tag).text = text or u""
+    ratings = etree.SubElement(gch, "ratings")
+    for (tag, text) in [("difficulty", _unescape(re_difficulty_.search(data))),
+            ("size", ggz_sizes_.get(_unescape(re_container_.search(data)))),
+            ("terrain", _unescape(re_terrain_.search(data)))]:
+        if text:
+            etree.SubElement(ratings, tag).text = text
+    etree.SubElement(gch, "found").text = u"true" if _unescape(re_sym_.search(data)) == u"Geocache Found" else u"false"
+    return gch
+
+
+class GGZMember(gpxlib.GPXWriter):
+    # one GPX file of the GGZ, remembers CRC32 and the index entries of its caches
+    def __init__(self, name, filename, nsmap=None, attrib=None):
+        gpxlib.GPXWriter.__init__(self, filename, nsmap, attrib)
+        self.name = name
+        self.index_filename = filename + ".idx"
+        self.index_fh = None
+        self.crc = 0
+        self.num_caches = 0
+
+    def open(self):
+        self.index_fh = open(self.index_filename, "wb")
+        return gpxlib.GPXWriter.open(self)
+
+    def _write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        gpxlib.GPXWriter._write(self, data)
+
+    def writeXML(self, data):
+        (offset, length) = gpxlib.GPXWriter.writeXML(self, data)
+        gch = cacheIndexEntry(data, offset, length)
+        if gch is not None:
+            self.index_fh.write(b"    " + etree.tostring(gch, encoding="utf-8", xml_declaration=False) + b"\n")
+            self.num_caches += 1
+        return (offset, length)
+
+    def close(self):
+        gpxlib.GPXWriter.close(self)
+        self.index_fh.close()
+
+
+class GGZWriter(object):
+    # with GGZWriter("out.ggz") as ggz:
+    #     gpx = ggz.newGPX(nsmap, attrib)
+    #     gpx.writeXML(...)
+    # The zip is only put together (and output replaced) when the block ends without error.
+    def __init__(self, output):
+        self.output = output
+        self.tmpdir = None
+        self.members = []
+
+    def open(self):
+        self.tmpdir = tempfile.mkdtemp(prefix=".ggz", dir=os.path.dirname(os.path.abspath(self.output)))
+        return self
+
+    def newGPX(self, nsmap=None, attrib=None):
+        name = "%04d.gpx" % (len(self.members) + 1)
+        member = GGZMember(name, os.path.join(self.tmpdir, name), nsmap, attrib)
+        self.members.append(member)
+        return member.open()
+
+    @property
+    def num_caches(self):
+        return sum([m.num_caches for m in self.members])
+
+    def _writeIndex(self, filename):
+        with open(filename, "wb") as fh:
+            fh.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+            fh.write(('<ggz xmlns="%s">\n' % ggz_ns_).encode("utf-8"))
+            for member in self.members:
+                fh.write(b"  <file>\n")
+                fh.write(("    <name>%s</name>\n    <crc>%08x</crc>\n" % (member.name, member.crc & 0xffffffff)).encode("utf-8"))
+                with open(member.index_filename, "rb") as idx:
+                    shutil.copyfileobj(idx, fh)
+                fh.write(b"  </file>\n")
+            fh.write(b"</ggz>\n")
+
+    def close(self):
+        try:
+            for member in self.members:
+                if member.fh is not None:
+                    member.close()
+            index_filename = os.path.join(self.tmpdir, "index.xml")
+            self._writeIndex(index_filename)
+            zip_filename = os.path.join(self.tmpdir, "out.ggz")
+            zf = zipfile.ZipFile(zip_filename, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+            try:
+                for member in self.members:
+                    zf.write(member.output, ggz_data_dir_ + member.name)
+                zf.write(index_filename, ggz_index_path_)
+            finally:
+                zf.close()
+            gpxlib.replaceFile(zip_filename, self.output)
+        finally:
+            self.abort()
+
+    def abort(self):
+        for member in self.members:
+            if member.fh is not None:
+                member.fh.close()
+                member.fh = None
+            if member.index_fh is not None:
+                member.index_fh.close()
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            return False
+        self.close()
+        return False
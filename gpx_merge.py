@@ -4,52 +4,340 @@
 # License: public domain, attribution appreciated
 
 
+import os
+import io
 import sys
 import getopt
+import mmap
+import shutil
+import tempfile
+from hashlib import md5
+from contextlib import ExitStack
 from lxml import etree
-import codecs
 from itertools import *
+import numpy as np
+import gpxlib
+import geolib
+import waypointdblib
+import waypointtablelib
+import ggzlib
+import mergeindexlib
+import waypointruleslib
+import profilelib
+from mergeindexlib import WPT_CODE, WPT_PATH, WPT_HASH, WPT_OFFSET, WPT_LENGTH, WPT_LAT, WPT_LON
+
+# size of the GPX files inside a .ggz if neither --max-waypoints-per-file nor --max-bytes-per-file is given
+ggz_max_bytes_per_file_ = 4 * 1024 * 1024
 
 
 def usage():
   print("This tool will merge two GPX Files")
   print("\nOptions:")
-  print("   -o <output-gpx-file>")
+  print("   -o <output-gpx-file>                   write a Garmin GGZ if the name ends with .ggz")
   print("   -l <maximum number of waypoints in output-gpx-file>")
+  print("   --max-waypoints-per-file <n>           split the output into numbered files of at most n waypoints")
+  print("   --max-bytes-per-file <size>            split the output into numbered files of at most size bytes,")
+  print("                                          k, M and G suffixes are understood")
+  print("   --incremental                          keep an index next to the output and on the next run only")
+  print("                                          re-read the gpx-files that changed since then")
+  print("   --db <file>                            also take waypoints from this gc_waypointdb database,")
+  print("                                          waypoints in the gpx-files take precedence")
+  print("   --bbox <minlat,minlon,maxlat,maxlon>   only waypoints inside this box")
+  print("   --center <lat,lon> --radius <km>       only waypoints within radius km of center")
+  print("   --polygon <file>                       only waypoints inside the area(s) of a GeoJSON file")
+  print("                                          or the tracks/routes of a GPX file")
+  print("   --limit-nearest <n>                    keep the n waypoints closest to --home/--anchors")
+  print("   --home <lat,lon>                       anchor point for --limit-nearest")
+  print("   --anchors <file>                       more anchor points: waypoints of a GPX file or")
+  print("                                          a text file with one lat,lon per line")
+  print("   --rules <file|garmin>                  adapt the waypoints for a device while writing them,")
+  print("                                          a JSON rules file (see waypointruleslib.py) or the")
+  print("                                          builtin garmin rules for older Garmins (e.g. 60CSx)")
+  print("   --profile <file>                       write a profile (pstats, collapsed stacks if <file> ends in .folded)")
+  print("   --trace-memory                         print peak memory and the top allocations at exit")
   print("\nSyntax:")
   print("   %s -o <output-gpx-file> <gpx-file1> [gpx-file2 [...]]" % (sys.argv[0]))
+  print("   %s -o <output-gpx-file> --db <file> [gpx-file1 [...]]" % (sys.argv[0]))
+
+def calcBounds(lat, lon):
+  bounds = etree.Element ( 'bounds' )
+  valid = ~(np.isnan(lat) | np.isnan(lon))
+  if valid.any():
+    bounds.set("minlat", repr(float(lat[valid].min())))
+    bounds.set("minlon", repr(float(lon[valid].min())))
+    bounds.set("maxlat", repr(float(lat[valid].max())))
+    bounds.set("maxlon", repr(float(lon[valid].max())))
+  return bounds
+
+def parseSize(s):
+  # "500k" -> 512000
+  s = s.strip()
+  multiplier = 1
+  if s and s[-1] in "kKmMgG":
+    multiplier = 1024 ** ("kmg".index(s[-1].lower()) + 1)
+    s = s[:-1]
+  return int(float(s) * multiplier)
+
+def shardFileName(output_file, num):
+  # merge.gpx -> merge-001.gpx
+  (base, ext) = os.path.splitext(output_file)
+  return "%s-%03d%s" % (base, num, ext or ".gpx")
+
+def headerSize(table):
+  # bytes of a shard without any waypoints, with the widest possible <bounds>
+  buf = io.BytesIO()
+  with gpxlib.GPXWriter(buf, table.nsmap(), {"version":"1.0", "creator":"GPX Merge Tool"}) as writer:
+    for elem in table.metainfo():
+      writer.write(elem)
+    writer.write(calcBounds(np.array([-89.12345678901234, 89.12345678901234]), np.array([-179.12345678901234, 179.12345678901234])))
+  return len(buf.getvalue())
+
+def splitShards(table, indices, max_wpts=None, max_bytes=None, rules=None):
+  # orders the waypoints along their geohash and cuts them into consecutive
+  # pieces, so every shard covers a compact area. Returns a list of index arrays.
+  indices = indices[np.argsort(geolib.geohashKey(table.lat[indices], table.lon[indices]), kind="stable")]
+  if max_bytes is not None:
+    # every waypoint is written on its own line, indented by two spaces
+    sizes = (table.sizes(indices) if rules is None else ruleSizes(table, indices, rules)) + 3
+    header = headerSize(table)
+  shards = []
+  start = 0
+  (count, size) = (0, 0)
+  for pos in range(len(indices)):
+    full = max_wpts is not None and count + 1 > max_wpts
+    if max_bytes is not None:
+      full = full or header + size + sizes[pos] > max_bytes
+    if full and count > 0:
+      shards.append(indices[start:pos])
+      (start, count, size) = (pos, 0, 0)
+    count += 1
+    if max_bytes is not None:
+      size += sizes[pos]
+  if count > 0 or not shards:
+    shards.append(indices[start:])
+  return shards
 
-def guessEncodingFromBOM(filename):
-  with open(filename,"rb") as fh:
-    sample = fh.read(4)
-  for (bom,codec) in [(codecs.BOM_UTF32_LE,"utf_32_le"),(codecs.BOM_UTF32_BE,"utf_32_be"),(codecs.BOM_UTF16_LE,"utf_16_le"),(codecs.BOM_UTF16_BE,"utf_16_be"),(codecs.BOM_UTF8,"utf_8_sig")]:
-    if sample.startswith(bom):
-      return codec
-  return "utf_8"
-
-def calcBounds(wpt, bounds):
-  comp_func = {"max":max, "min":min}
-  for attrib in ["minlat", "minlon", "maxlat", "maxlon"]:
-    if not bounds.attrib.has_key(attrib):
-      bounds.set(attrib,wpt.get(attrib[-3:]))
+def applyRules(table, index, xml, rules):
+  # xml of the waypoint after the rules, the same bytes if no rule changed anything
+  elem = table.parseXML(index, xml)
+  if not rules.apply(elem):
+    return xml
+  return etree.tostring(elem, encoding="utf-8", xml_declaration=False, with_tail=False)
+
+def ruleSizes(table, indices, rules):
+  # like table.sizes, but of the waypoints as they will be written
+  position = dict(zip(indices.tolist(), range(len(indices))))
+  sizes = np.zeros(len(indices), dtype=np.int64)
+  for (i, xml) in table.iterXML(indices):
+    sizes[position[i]] = len(applyRules(table, i, xml, rules))
+  return sizes
+
+def collectWaypoints(files, db=None, bbox=None):
+  # first pass: only gccode, coordinates and the location of each <wpt> are kept.
+  # Waypoints from the database come first, so the gpx-files take precedence
+  table = waypointtablelib.WaypointTable()
+  if db is not None:
+    table.addWaypointDB(db, bbox)
+  for gpxfile in files:
+    try:
+      table.addGPX(gpxfile)
+    except (etree.ParserError,etree.XMLSyntaxError) as e:
+      print("Warning: could not parse %s" % (gpxfile), file=sys.stderr)
+      print("\tErrorMsg: %s" % (str(e)), file=sys.stderr)
+  return table
+
+def selectArea(lat, lon, bbox=None, center=None, radius=None, polygons=None):
+  selected = np.ones(len(lat), dtype=bool)
+  if bbox is not None:
+    selected &= geolib.inBBox(lat, lon, bbox)
+  if center is not None:
+    selected &= geolib.inRadius(lat, lon, center, radius)
+  if polygons is not None:
+    selected &= geolib.inPolygons(lat, lon, polygons)
+  return selected
+
+def writeWaypoints(table, shards, writers, records=None, rules=None):
+  # second pass: copy the surviving waypoints from the input files, the input
+  # is read only once and every waypoint goes to the writer of its shard,
+  # after the rules were applied to it.
+  # records gets (index, md5 of the input, offset, length) of every waypoint in output order
+  shard_of = np.zeros(len(table), dtype=np.int32)
+  for (num, indices) in enumerate(shards):
+    shard_of[indices] = num
+  for (i, xml) in table.iterXML(np.concatenate(shards)):
+    (offset, length) = writers[shard_of[i]].writeXML(xml if rules is None else applyRules(table, i, xml, rules))
+    if records is not None:
+      records.append((i, md5(xml).hexdigest(), offset, length))
+
+def buildMergeIndex(table, records, settings):
+  index = mergeindexlib.MergeIndex(settings)
+  paths = [os.path.abspath(src.name) for src in table.sources]
+  for (srcno, src) in enumerate(table.sources):
+    index.addFile(paths[srcno], [table.gccodes[i] for i in np.flatnonzero(table.source == srcno)], src.kind == "db")
+  for (i, xmlhash, offset, length) in records:
+    index.addWaypoint(table.gccodes[i], paths[table.source[i]], xmlhash, offset, length, float(table.lat[i]), float(table.lon[i]))
+  return index
+
+def incrementalMerge(index, files, db, output_file, area, rules=None):
+  # Updates output_file with the waypoints of the files that changed since
+  # index was written. Returns the new index and (unchanged, updated, added,
+  # removed) or None if a full merge is needed.
+  old_files = dict([(f["path"], f) for f in index.files])
+  old_paths = [f["path"] for f in index.files]
+  paths = ([os.path.abspath(db.filename)] if db is not None else []) + [os.path.abspath(f) for f in files]
+  if [p for p in paths if p in old_files] != old_paths:
+    # files were removed or reordered, which changes which duplicate wins
+    return None
+  changed = [p for p in paths if p not in old_files or old_files[p]["state"] != mergeindexlib.fileState(p)]
+  if not changed:
+    return (index, (len(index.waypoints), 0, 0, 0))
+
+  table = waypointtablelib.WaypointTable()
+  scanned = {}  # path -> {gccode: table index}
+  def scan(path):
+    srcno = len(table.sources)
+    try:
+      if db is not None and path == paths[0]:
+        table.addWaypointDB(db, area["bbox"])
+      else:
+        table.addGPX(path)
+    except (etree.ParserError,etree.XMLSyntaxError) as e:
+      print("Warning: could not parse %s" % (path), file=sys.stderr)
+      print("\tErrorMsg: %s" % (str(e)), file=sys.stderr)
+      scanned[path] = None
+      return
+    scanned[path] = dict([(table.gccodes[i], i) for i in np.flatnonzero(table.source == srcno).tolist()])
+  for p in changed:
+    scan(p)
+
+  old_recs = dict([(w[WPT_CODE], w) for w in index.waypoints])
+  prev_winner = {}
+  for f in index.files:
+    for c in f["gccodes"]:
+      prev_winner[c] = f["path"]
+  winner = {}
+  for p in paths:
+    for c in (scanned[p] or {}) if p in scanned else old_files[p]["gccodes"]:
+      winner[c] = p
+  # an unchanged file has to be read after all if one of its waypoints now
+  # wins that was not in the output before, e.g. because a changed PQ dropped it
+  for p in set([p for (c, p) in winner.items() if p not in scanned and not (c in old_recs and old_recs[c][WPT_PATH] == p) and prev_winner.get(c) != p]):
+    scan(p)
+
+  keep = {}  # gccode -> path, copied from the old output
+  candidates = []
+  for (c, p) in winner.items():
+    if p in scanned:
+      if scanned[p] is not None and c in scanned[p]:
+        candidates.append(scanned[p][c])
+    elif c in old_recs and old_recs[c][WPT_PATH] == p:
+      keep[c] = p
+  candidates = np.array(candidates, dtype=np.int64)
+  candidates = candidates[selectArea(table.lat[candidates], table.lon[candidates], **area)]
+  # only the waypoints of the changed files are held in memory
+  xmls = dict(table.iterXML(candidates))
+  replace = {}  # gccode -> (table index, xml, md5)
+  for i in candidates.tolist():
+    c = table.gccodes[i]
+    xmlhash = md5(xmls[i]).hexdigest()
+    if c in old_recs and old_recs[c][WPT_HASH] == xmlhash:
+      keep[c] = os.path.abspath(table.sources[table.source[i]].name)
     else:
-      try:
-        cfun = comp_func[attrib[:3]]
-        bounds.attrib[attrib] = cfun(wpt.get(attrib[-3:]), bounds.get(attrib))
-      except KeyError:
-        pass
+      replace[c] = (i, xmls[i], xmlhash)
+  del xmls
 
+  # old output order, changed waypoints in place, new ones at the end.
+  # entries are (gccode, None) for waypoints from replace and (gccode, old record)
+  entries = []
+  for w in index.waypoints:
+    if w[WPT_CODE] in replace:
+      entries.append((w[WPT_CODE], None))
+    elif w[WPT_CODE] in keep:
+      entries.append((w[WPT_CODE], w))
+  entries += [(c, None) for c in replace if c not in old_recs]
+  lat = np.array([table.lat[replace[c][0]] if w is None else w[WPT_LAT] for (c, w) in entries], dtype=float)
+  lon = np.array([table.lon[replace[c][0]] if w is None else w[WPT_LON] for (c, w) in entries], dtype=float)
+
+  new_index = mergeindexlib.MergeIndex(index.settings)
+  for p in paths:
+    if p in scanned and scanned[p] is not None:
+      new_index.addFile(p, list(scanned[p].keys()), db is not None and p == paths[0])
+    elif p not in scanned:
+      new_index.addFile(p, old_files[p]["gccodes"], old_files[p].get("db", False))
+
+  with open(output_file, "rb") as fh:
+    data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      root_match = waypointtablelib.re_root_start_.search(data)
+      root = etree.fromstring(root_match.group(0) + b"</gpx>")
+      if any([root.nsmap.get(prefix) != uri for (prefix, uri) in table.nsmap().items()]):
+        return None
+      header_end = index.waypoints[0][WPT_OFFSET] if index.waypoints else data.rfind(b"</gpx>")
+      metainfo = dict([(elem.tag, elem) for elem in waypointtablelib.parseHeader(data, root_match, header_end)])
+      for elem in table.metainfo():
+        metainfo[elem.tag] = elem
+      (fd, tmpname) = tempfile.mkstemp(prefix=".", suffix=".gpx.tmp", dir=os.path.dirname(os.path.abspath(output_file)))
+      try:
+        shutil.copymode(output_file, tmpname)
+        with os.fdopen(fd, "wb") as out, gpxlib.GPXWriter(out, root.nsmap, dict(root.attrib), root.tag) as writer:
+          for elem in metainfo.values():
+            writer.write(elem)
+          writer.write(calcBounds(lat, lon))
+          pos = 0
+          while pos < len(entries):
+            if entries[pos][1] is None:
+              c = entries[pos][0]
+              (i, xml, xmlhash) = replace[c]
+              (offset, length) = writer.writeXML(xml if rules is None else applyRules(table, i, xml, rules))
+              new_index.addWaypoint(c, os.path.abspath(table.sources[table.source[i]].name), xmlhash, offset, length, float(lat[pos]), float(lon[pos]))
+              pos += 1
+              continue
+            # copy a run of waypoints that were next to each other in the old output in one go
+            run = [entries[pos][1]]
+            while pos + len(run) < len(entries):
+              w = entries[pos + len(run)][1]
+              if w is None or data[run[-1][WPT_OFFSET] + run[-1][WPT_LENGTH]:w[WPT_OFFSET]] != b"\n  ":
+                break
+              run.append(w)
+            start = run[0][WPT_OFFSET]
+            (offset, length) = writer.writeRaw(data[start:run[-1][WPT_OFFSET] + run[-1][WPT_LENGTH]])
+            writer.count += len(run) - 1
+            for w in run:
+              new_index.addWaypoint(w[WPT_CODE], keep[w[WPT_CODE]], w[WPT_HASH], offset + w[WPT_OFFSET] - start, w[WPT_LENGTH], w[WPT_LAT], w[WPT_LON])
+            pos += len(run)
+      except:
+        os.unlink(tmpname)
+        raise
+    finally:
+      data.close()
+  gpxlib.replaceFile(tmpname, output_file)
+  updated = len([c for c in replace if c in old_recs])
+  return (new_index, (len(entries) - len(replace), updated, len(replace) - updated, len(index.waypoints) - (len(entries) - len(replace) + updated)))
 
 if __name__ == '__main__':
 
 ######### Global Vars ##########
   output_file_ = None
   wpt_limit_ = None
+  bbox_ = None
+  center_ = None
+  radius_ = None
+  polygons_ = None
+  nearest_limit_ = None
+  anchors_ = []
+  db_file_ = None
+  max_wpts_per_file_ = None
+  max_bytes_per_file_ = None
+  polygon_file_ = None
+  incremental_ = False
+  rules_ = None
+  profile_file_ = None
+  trace_memory_ = False
 
 
 ######### Parse Arguments ##########
   try:
-    opts, files = getopt.gnu_getopt(sys.argv[1:], "ho:l:", ["help","output=","limit="])
+    opts, files = getopt.gnu_getopt(sys.argv[1:], "ho:l:", ["help","output=","limit=","bbox=","center=","radius=","polygon=","limit-nearest=","home=","anchors=","db=","max-waypoints-per-file=","max-bytes-per-file=","incremental","rules=","profile=","trace-memory"])
   except getopt.GetoptError as e:
     print("ERROR: Invalid Option: " +str(e), file=sys.stderr)
     usage()
@@ -61,67 +349,147 @@ if __name__ == '__main__':
       sys.exit()
     elif o in ["-o","--output"]:
       output_file_ = a
+    elif o in ["--db"]:
+      db_file_ = a
+    elif o in ["--incremental"]:
+      incremental_ = True
+    elif o in ["--profile"]:
+      profile_file_ = a
+    elif o in ["--trace-memory"]:
+      trace_memory_ = True
     elif o in ["-l","--limit"]:
       try:
         wpt_limit_ = int(a)
       except ValueError:
         print("Warning: given limit is not an integer, ignoring it...",file=sys.stderr)
+    try:
+      if o in ["--bbox"]:
+        bbox_ = geolib.parseBBox(a)
+      elif o in ["--center"]:
+        center_ = geolib.parseLatLon(a)
+      elif o in ["--radius"]:
+        radius_ = float(a)
+      elif o in ["--polygon"]:
+        polygons_ = geolib.loadPolygons(a)
+        polygon_file_ = a
+      elif o in ["--limit-nearest"]:
+        nearest_limit_ = int(a)
+      elif o in ["--home"]:
+        anchors_.append(geolib.parseLatLon(a))
+      elif o in ["--anchors"]:
+        anchors_ += geolib.loadAnchors(a)
+      elif o in ["--max-waypoints-per-file"]:
+        max_wpts_per_file_ = int(a)
+      elif o in ["--max-bytes-per-file"]:
+        max_bytes_per_file_ = parseSize(a)
+      elif o in ["--rules"]:
+        rules_ = waypointruleslib.loadRules(a)
+    except (ValueError, IOError, OSError, etree.XMLSyntaxError) as e:
+      print("ERROR: invalid argument for %s: %s" % (o, str(e)), file=sys.stderr)
+      sys.exit(1)
 
 ######### Main Program ##########
-  if len(files) <1 or output_file_ is None:
+  profilelib.start(profile_file_, trace_memory_)
+  if (len(files) <1 and db_file_ is None) or output_file_ is None:
     print("ERROR: no input files and/or no output file given",file=sys.stderr)
     usage()
     sys.exit()
-    
-  wptdict = {}
-  gpxmetainfo = {}
-  nsmap = {}
-  bounds = etree.Element ( 'bounds' , nsmap = nsmap)
-  xml_parser = etree.XMLParser(encoding="utf-8")
-  for gpxfile in files:
-    fgpx = open(gpxfile, encoding=guessEncodingFromBOM(gpxfile))
-    try:
-      gpxtree = etree.parse(fgpx,xml_parser).getroot()
-      nsmap.update(gpxtree.nsmap)  #get namespace info from gpx files
-    except (etree.ParserError,etree.DocumentInvalid,etree.XMLSyntaxError) as e:
-      print("Warning: could not parse %s" % (gpxfile), file=sys.stderr)
-      print("\tErrorMsg: %s" % (str(e)), file=sys.stderr)
-      continue
-    fgpx.close()
-
-    for wpt_elem in gpxtree:
-      if wpt_elem.tag == "wpt" or (wpt_elem.tag.startswith("{http://www.topografix.com/GPX/") and wpt_elem.tag.endswith("}wpt")):
-        calcBounds(wpt_elem, bounds)
-        for wpt_subelem in wpt_elem:
-          if wpt_subelem.tag == "name" or (wpt_subelem.tag.startswith("{http://www.topografix.com/GPX/") and wpt_subelem.tag.endswith("}name")):
-            wptname = wpt_subelem.text.strip()
-            wptdict[wptname] = wpt_elem
-            break
-      elif wpt_elem.tag[-6:] == "bounds":
-        pass
+  if (center_ is None) != (radius_ is None):
+    print("ERROR: --center and --radius have to be given together",file=sys.stderr)
+    sys.exit(1)
+  if (max_wpts_per_file_ is not None and max_wpts_per_file_ < 1) or (max_bytes_per_file_ is not None and max_bytes_per_file_ < 1):
+    print("ERROR: --max-waypoints-per-file and --max-bytes-per-file have to be positive",file=sys.stderr)
+    sys.exit(1)
+  if nearest_limit_ is not None and not anchors_:
+    print("ERROR: --limit-nearest needs --home or --anchors",file=sys.stderr)
+    sys.exit(1)
+  ggz = output_file_.lower().endswith(".ggz")
+  if incremental_ and (ggz or wpt_limit_ is not None or nearest_limit_ is not None or max_wpts_per_file_ is not None or max_bytes_per_file_ is not None):
+    print("ERROR: --incremental only works for a single gpx output file without -l and --limit-nearest",file=sys.stderr)
+    sys.exit(1)
+
+  db = waypointdblib.WaypointDB(db_file_) if db_file_ is not None else None
+  area = {"bbox": bbox_, "center": center_, "radius": radius_, "polygons": polygons_}
+  if incremental_:
+    settings = {"bbox": bbox_, "center": center_, "radius": radius_,
+      "polygon": [os.path.abspath(polygon_file_), mergeindexlib.fileState(polygon_file_)] if polygon_file_ is not None else None}
+    if rules_ is not None:
+      # the index only records the input, different rules need a full merge
+      settings["rules"] = rules_.digest()
+    index_file = mergeindexlib.indexFileName(output_file_)
+    index = mergeindexlib.MergeIndex.load(index_file)
+    result = None
+    if index is not None and index.matches(settings, output_file_):
+      result = incrementalMerge(index, files, db, output_file_, area, rules_)
+    if result is not None:
+      (new_index, (unchanged, updated, added, removed)) = result
+      if db is not None:
+        db.close()
+      if new_index is index:
+        print("%s is up to date" % (output_file_))
       else:
-        gpxmetainfo[wpt_elem.tag] = wpt_elem
-  
-  newgpx = etree.Element ( 'gpx' , nsmap = nsmap)
-  newgpx.attrib["version"]="1.0" 
-  newgpx.attrib["creator"]="GPX Merge Tool" 
-  doc = etree.ElementTree ( newgpx)
+        new_index.save(index_file, output_file_)
+        print("%d waypoints merged into %s (%d unchanged, %d updated, %d added, %d removed)" % (len(new_index.waypoints), output_file_, unchanged, updated, added, removed))
+      sys.exit(0)
+
+  table = collectWaypoints(files, db, bbox_)
+  # last occurrence of every gccode, in the order gccodes were first seen
+  survivors = table.deduplicate()
+
+  (lat, lon) = (table.lat[survivors], table.lon[survivors])
+
+  selected = np.flatnonzero(selectArea(lat, lon, **area))
+  num_outside = len(survivors) - len(selected)
+
+  distance = None
+  if nearest_limit_ is not None:
+    distance = geolib.distanceToNearestAnchor(lat[selected], lon[selected], anchors_)
+    order = np.argsort(distance, kind="stable")
+    selected = selected[order]
+    distance = distance[order]
+    wpt_limit_ = nearest_limit_ if wpt_limit_ is None else min(wpt_limit_, nearest_limit_)
 
   if wpt_limit_ is None:
-    wpt_limit_ = len(wptdict)
+    wpt_limit_ = len(selected)
   else:
-    wpt_limit_ = min(wpt_limit_,len(wptdict))
-  
-  for elem in gpxmetainfo.values():
-    newgpx.append(elem)
-  newgpx.append(bounds)
-  for elem in islice(wptdict.values(),wpt_limit_):
-    newgpx.append(elem)
-  
-  with open(output_file_, "wb") as nfh:
-    nfh.truncate()
-    nfh.write(etree.tostring(doc,method="xml",xml_declaration=True,encoding="utf-8"))
-  print ("%d waypoints merged into %s" % (wpt_limit_, output_file_))
-  if wpt_limit_ < len(wptdict):
+    wpt_limit_ = min(wpt_limit_,len(selected))
+  written = survivors[selected[:wpt_limit_]]
+  dropped = survivors[selected[wpt_limit_:]]
+
+  if ggz and max_wpts_per_file_ is None and max_bytes_per_file_ is None:
+    max_bytes_per_file_ = ggz_max_bytes_per_file_
+  if max_wpts_per_file_ is not None or max_bytes_per_file_ is not None:
+    shards = splitShards(table, written, max_wpts_per_file_, max_bytes_per_file_, rules_)
+    output_files = [shardFileName(output_file_, num + 1) for num in range(len(shards))]
+  else:
+    shards = [written]
+    output_files = [output_file_]
+
+  with ExitStack() as stack:
+    if ggz:
+      # the shards become the GPX files inside the .ggz
+      ggzwriter = stack.enter_context(ggzlib.GGZWriter(output_file_))
+      writers = [ggzwriter.newGPX(table.nsmap(), {"version":"1.0", "creator":"GPX Merge Tool"}) for indices in shards]
+      output_files = ["%s:%s" % (output_file_, writer.name) for writer in writers]
+    else:
+      writers = [stack.enter_context(gpxlib.GPXWriter(filename, table.nsmap(), {"version":"1.0", "creator":"GPX Merge Tool"})) for filename in output_files]
+    for (writer, indices) in zip(writers, shards):
+      for elem in table.metainfo():
+        writer.write(elem)
+      writer.write(calcBounds(table.lat[indices], table.lon[indices]))
+    records = [] if incremental_ else None
+    writeWaypoints(table, shards, writers, records, rules_)
+  if incremental_:
+    buildMergeIndex(table, records, settings).save(index_file, output_file_)
+  if db is not None:
+    db.close()
+  for (filename, indices) in zip(output_files, shards):
+    print ("%d waypoints merged into %s" % (len(indices), filename))
+  if num_outside > 0:
+    print("%d waypoints were outside the selected area" % (num_outside))
+  if wpt_limit_ < len(selected):
     print("Waypoint limit was exceeded and the following waypoints were dropped:")
-    print(", ".join(islice(wptdict.keys(),wpt_limit_,None)))
+    if distance is None:
+      print(", ".join([table.gccodes[i] for i in dropped]))
+    else:
+      print(", ".join(["%s (%.1fkm)" % (table.gccodes[i], d) for (i, d) in zip(dropped, distance[wpt_limit_:])]))
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Streaming GPX reading and writing shared by all gctools.
+# GPXReader parses with iterparse and drops every top-level element once it
+# has been handed out, so memory use does not grow with the size of the file.
+
+from __future__ import print_function
+import os
+import re
+import mmap
+import codecs
+import multiprocessing
+import tempfile
+from copy import deepcopy
+from collections import namedtuple
+from lxml import etree
+from filelib import fileState, copyFileMode, replaceFile, fsyncFile, fsyncDir
+import profilelib
+
+gpx_ns_ = "http://www.topografix.com/GPX/1/0"
+gpx_ns_prefix_ = "{http://www.topografix.com/GPX/"
+groundspeak_ns_prefix_ = "{http://www.groundspeak.com/cache/"
+
+Waypoint = namedtuple("Waypoint",["code","lat","lon","name","type","url","cache","elem"])
+
+bom_encodings_ = [(codecs.BOM_UTF32_LE,"utf_32_le"),(codecs.BOM_UTF32_BE,"utf_32_be"),(codecs.BOM_UTF16_LE,"utf_16_le"),(codecs.BOM_UTF16_BE,"utf_16_be"),(codecs.BOM_UTF8,"utf_8_sig")]
+# python codec name -> encoding name libxml2 understands
+libxml_encodings_ = {"utf_32_le":"UTF-32LE", "utf_32_be":"UTF-32BE", "utf_16_le":"UTF-16LE", "utf_16_be":"UTF-16BE", "utf_8_sig":"UTF-8", "utf_8":"UTF-8"}
+re_xmlns_decl_ = re.compile(br' xmlns(?::[^=\s]+)?="[^"]*"')
+re_wpt_name_ = re.compile(br'<name>\s*([^<\s]+)\s*</name>')
+re_wpt_lat_ = re.compile(br'\slat\s*=\s*["\']([^"\']*)')
+re_wpt_lon_ = re.compile(br'\slon\s*=\s*["\']([^"\']*)')
+# raw byte scanning of files whose default namespace is GPX
+re_wpt_ = re.compile(br'<wpt[\s>].*?</wpt>', re.DOTALL)
+re_root_start_ = re.compile(br'<gpx[\s>][^>]*>', re.DOTALL)
+
+
+def guessEncodingFromBOM(filename):
+    with open(filename,"rb") as fh:
+        sample = fh.read(4)
+    for (bom,codec) in bom_encodings_:
+        if sample.startswith(bom):
+            return codec
+    return "utf_8"
+
+def isGPXTag(tag, name):
+    # matches <name> and <name> in any GPX namespace version
+    return tag == name or (isinstance(tag, (type(""), type(u""))) and tag.startswith(gpx_ns_prefix_) and tag.endswith("}"+name))
+
+def isGroundspeakTag(tag, name):
+    return isinstance(tag, (type(""), type(u""))) and tag.startswith(groundspeak_ns_prefix_) and tag.endswith("}"+name)
+
+def findGroundspeakChild(elem, name):
+    if elem is None:
+        return None
+    for child in elem:
+        if isGroundspeakTag(child.tag, name):
+            return child
+    return None
+
+def makeWaypoint(wpt_elem):
+    code = None
+    name = None
+    wpttype = None
+    url = None
+    cache = None
+    for child in wpt_elem:
+        tag = child.tag
+        if isGPXTag(tag, "name"):
+            code = (child.text or "").strip()
+        elif isGPXTag(tag, "urlname"):
+            name = (child.text or "").strip()
+        elif isGPXTag(tag, "url"):
+            url = (child.text or "").strip()
+        elif isGPXTag(tag, "type"):
+            wpttype = (child.text or "").strip()
+        elif isGroundspeakTag(tag, "cache"):
+            cache = child
+    try:
+        lat = float(wpt_elem.get("lat"))
+        lon = float(wpt_elem.get("lon"))
+    except (TypeError, ValueError):
+        lat = lon = None
+    return Waypoint(code=code, lat=lat, lon=lon, name=name, type=wpttype, url=url, cache=cache, elem=wpt_elem)
+
+
+class GPXReader(object):
+    # Iterating yields a Waypoint for every <wpt>. Other top-level elements are
+    # copied into metainfo (in document order) and bounds.
+    # With clear=True each <wpt> is emptied as soon as the consumer asks for the
+    # next one, with clear=False the whole document is kept and the consumer
+    # may hold on to Waypoint.elem.
+    def __init__(self, filename, clear=True):
+        self.filename = filename
+        self.clear = clear
+        self.tag = None
+        self.nsmap = {}
+        self.attrib = {}
+        self.metainfo = []
+        self.bounds = None
+
+    def iterElements(self):
+        # yields every top-level element once it has been parsed completely
+        encoding = libxml_encodings_.get(guessEncodingFromBOM(self.filename), "UTF-8")
+        depth = 0
+        for (event, elem) in etree.iterparse(self.filename, events=("start","end"), encoding=encoding, huge_tree=True):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    self.tag = elem.tag
+                    self.nsmap = dict(elem.nsmap)
+                    self.attrib = dict(elem.attrib)
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            yield elem
+            if not self.clear:
+                continue
+            elem.clear()
+            # drop what has been handed out already, so the root does not grow.
+            # Not done with clear=False, detached elements would lose their
+            # default namespace and serialize with generated ns0: prefixes
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+    def __iter__(self):
+        for elem in self.iterElements():
+            if isGPXTag(elem.tag, "wpt"):
+                yield makeWaypoint(elem)
+            elif isGPXTag(elem.tag, "bounds"):
+                self.bounds = deepcopy(elem)
+            elif isinstance(elem.tag, (type(""), type(u""))):
+                self.metainfo.append(deepcopy(elem))
+
+def iterWaypoints(filename, clear=True):
+    return iter(GPXReader(filename, clear))
+
+
+class GPXWriter(object):
+    # Writes a GPX file incrementally, one top-level element at a time.
+    # Namespace declarations a subtree repeats from the <gpx> root are left
+    # out, so the output looks like a tree serialized with etree.tostring.
+    def __init__(self, output, nsmap=None, attrib=None, tag=None):
+        self.output = output
+        self.nsmap = dict(nsmap) if nsmap else {None: gpx_ns_}
+        self.attrib = attrib if attrib is not None else {"version":"1.0", "creator":"gctools"}
+        self.tag = tag if tag is not None else ("{%s}gpx" % self.nsmap[None] if None in self.nsmap else "gpx")
+        self.fh = None
+        self.own_fh = False
+        self.root_ns_decls = []
+        self.count = 0
+        self.position = 0
+
+    def open(self):
+        if hasattr(self.output, "write"):
+            self.fh = self.output
+        else:
+            self.fh = open(self.output, "wb")
+            self.own_fh = True
+        root = etree.Element(self.tag, nsmap=self.nsmap)
+        for (k, v) in self.attrib.items():
+            root.set(k, v)
+        root.text = "GPXWRITERSPLIT"
+        (start_tag, self.end_tag) = etree.tostring(root, encoding="utf-8", xml_declaration=False).split(b"GPXWRITERSPLIT")
+        self.root_ns_decls = re_xmlns_decl_.findall(start_tag)
+        self._write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        self._write(start_tag)
+        return self
+
+    def _write(self, data):
+        self.fh.write(data)
+        self.position += len(data)
+
+    def serialize(self, elem):
+        return self.stripRootNamespaces(etree.tostring(elem, encoding="utf-8", xml_declaration=False, with_tail=False))
+
+    def stripRootNamespaces(self, data):
+        tag_end = data.find(b">")
+        head = data[:tag_end]
+        for decl in self.root_ns_decls:
+            head = head.replace(decl, b"", 1)
+        return head + data[tag_end:]
+
+    # write, writeXML and writeRaw return (offset, length) of the element in the output
+
+    def write(self, elem):
+        return self.writeRaw(self.serialize(elem))
+
+    def writeXML(self, data):
+        # an element serialized on its own, e.g. by etree.tostring
+        return self.writeRaw(self.stripRootNamespaces(data))
+
+    def writeRaw(self, data):
+        self._write(b"\n  ")
+        offset = self.position
+        self._write(data)
+        self.count += 1
+        return (offset, len(data))
+
+    def close(self):
+        self._write(b"\n" + self.end_tag + b"\n")
+        if self.own_fh:
+            self.fh.close()
+        self.fh = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.own_fh:
+            self.fh.close()
+            return False
+        self.close()
+        return False
+
+
+def findWaypointCodes(filename, gccodes):
+    # the gccodes that are the <name> of a waypoint in filename. One regex
+    # pass over the mmapped file, only UTF-16/32 files are parsed with lxml.
+    if guessEncodingFromBOM(filename) not in ["utf_8", "utf_8_sig"]:
+        return set([wpt.code for wpt in iterWaypoints(filename) if wpt.code in gccodes])
+    found = set()
+    with open(filename, "rb") as fh:
+        try:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return found  # empty file
+        try:
+            for m in re_wpt_name_.finditer(data):
+                code = m.group(1).decode("utf-8", "replace")
+                if code in gccodes:
+                    found.add(code)
+        finally:
+            data.close()
+    return found
+
+def _findWaypointCodesWorker(args):
+    return findWaypointCodes(*args)
+
+def findWaypointCodesInFiles(filenames, gccodes, processes=None):
+    # {filename: gccodes found in it} for every file that contains any of
+    # gccodes. The files are scanned in parallel on all cores.
+    gccodes = frozenset(gccodes)
+    if processes == 1 or len(filenames) < 2:
+        results = [findWaypointCodes(f, gccodes) for f in filenames]
+    else:
+        pool = multiprocessing.Pool(processes, **profilelib.poolArgs())
+        try:
+            results = pool.map(_findWaypointCodesWorker, [(f, gccodes) for f in filenames], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return dict([(f, codes) for (f, codes) in zip(filenames, results) if codes])
+
+def _floatOrNone(m):
+    try:
+        return float(m.group(1))
+    except (AttributeError, ValueError):
+        return None
+
+def waypointPositions(filename):
+    # [(code, lat, lon), ...] of every waypoint in file order, None where
+    # unknown. Plain UTF-8 GPX is scanned with regexes, anything else parsed.
+    if guessEncodingFromBOM(filename) in ["utf_8", "utf_8_sig"]:
+        with open(filename, "rb") as fh:
+            try:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return []  # empty file
+            try:
+                if isPlainGPX(data):
+                    positions = []
+                    for m in re_wpt_.finditer(data):
+                        chunk = m.group(0)
+                        start_tag = chunk[:chunk.find(b">")]
+                        name = re_wpt_name_.search(chunk)
+                        positions.append((name.group(1).decode("utf-8", "replace") if name else None,
+                            _floatOrNone(re_wpt_lat_.search(start_tag)), _floatOrNone(re_wpt_lon_.search(start_tag))))
+                    return positions
+            finally:
+                data.close()
+    return [(wpt.code, wpt.lat, wpt.lon) for wpt in iterWaypoints(filename)]
+
+def isPlainGPX(data):
+    # True if the <gpx> root in the raw bytes has GPX as default namespace,
+    # i.e. <wpt> can be found with re_wpt_
+    m = re_root_start_.search(data)
+    if m is None:
+        return False
+    root = etree.fromstring(m.group(0) + b"</gpx>")
+    return root.nsmap.get(None, "").startswith(gpx_ns_prefix_[1:])
+
+def purgeWaypoints(filename, gccodes, write=True):
+    # Removes the waypoints whose code is in gccodes (a set). The rest of the
+    # file is copied byte for byte to a temporary file next to it, which is
+    # fsynced and renamed over filename, so a crash leaves either the old or
+    # the new file. Nothing is written if no waypoint (or every waypoint)
+    # would be removed. Returns (number kept, number removed).
+    if guessEncodingFromBOM(filename) in ["utf_8", "utf_8_sig"]:
+        with open(filename, "rb") as fh:
+            try:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return (0, 0)  # empty file
+            try:
+                if isPlainGPX(data):
+                    return _purgeWaypointBytes(filename, data, gccodes, write)
+            finally:
+                data.close()
+    # UTF-16/32 or prefixed GPX namespace, needs the parser
+    (kept, removed) = (0, 0)
+    for wpt in iterWaypoints(filename):
+        if wpt.code in gccodes:
+            removed += 1
+        else:
+            kept += 1
+    if write and kept > 0 and removed > 0:
+        rewriteGPX(filename, filename, lambda elem, wpt: None if wpt is not None and wpt.code in gccodes else elem)
+    return (kept, removed)
+
+def _purgeWaypointBytes(filename, data, gccodes, write):
+    drop = []
+    kept = 0
+    for m in re_wpt_.finditer(data):
+        name = re_wpt_name_.search(m.group(0))
+        if name is not None and name.group(1).decode("utf-8", "replace") in gccodes:
+            drop.append((m.start(), m.end()))
+        else:
+            kept += 1
+    if write and kept > 0 and drop:
+        (fd, tmpfile) = tempfile.mkstemp(prefix=".", suffix=".gpx.tmp", dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            copyFileMode(tmpfile, filename)
+            with os.fdopen(fd, "wb") as fh:
+                copied = 0
+                for (start, end) in drop:
+                    # the indentation in front of a removed <wpt> goes as well
+                    while start > copied and data[start-1:start] in [b" ", b"\t", b"\r", b"\n"]:
+                        start -= 1
+                    fh.write(data[copied:start])
+                    copied = end
+                fh.write(data[copied:])
+                fsyncFile(fh)
+            replaceFile(tmpfile, filename)
+        except:
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+            raise
+    return (kept, len(drop))
+
+def rewriteGPX(src, dst, transform):
+    # Streams src into dst. transform(elem, waypoint) is called for every
+    # top-level element (waypoint is None for anything but <wpt>) and returns
+    # the element to write or None to drop it. dst may be src, the result is
+    # written to a temporary file next to dst and renamed over it at the end.
+    # Returns (number of waypoints written, number of waypoints dropped).
+    reader = GPXReader(src)
+    written = 0
+    dropped = 0
+    (fd, tmpfile) = tempfile.mkstemp(prefix=".", suffix=".gpx.tmp", dir=os.path.dirname(os.path.abspath(dst)))
+    try:
+        copyFileMode(tmpfile, dst)
+        with os.fdopen(fd, "wb") as fh:
+            writer = None
+            for elem in reader.iterElements():
+                if writer is None:
+                    writer = GPXWriter(fh, reader.nsmap, reader.attrib, reader.tag).open()
+                wpt = makeWaypoint(elem) if isGPXTag(elem.tag, "wpt") else None
+                if not isinstance(elem.tag, (type(""), type(u""))):
+                    continue
+                result = transform(elem, wpt)
+                if result is not None:
+                    writer.write(result)
+                if wpt is not None:
+                    if result is None:
+                        dropped += 1
+                    else:
+                        written += 1
+            if writer is None:
+                writer = GPXWriter(fh, reader.nsmap, reader.attrib, reader.tag).open()
+            writer.close()
+            fsyncFile(fh)
+        replaceFile(tmpfile, dst)
+    except:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        raise
+    return (written, dropped)
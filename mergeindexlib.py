@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Sidecar index of gpx_merge --incremental, stored next to the output as
+# <output>.mergeindex (JSON). It remembers for every input file its size,
+# mtime and gccodes and for every waypoint in the output where it came from,
+# the md5 of its XML and its byte range in the output. With it a later run
+# only has to read the inputs that changed and can copy everything else
+# from the previous output in large pieces.
+
+from __future__ import print_function
+import os
+import json
+import tempfile
+import gpxlib
+from gpxlib import fileState
+
+index_version_ = 1
+index_suffix_ = ".mergeindex"
+
+# columns of MergeIndex.waypoints
+WPT_CODE, WPT_PATH, WPT_HASH, WPT_OFFSET, WPT_LENGTH, WPT_LAT, WPT_LON = range(7)
+
+
+def indexFileName(output_file):
+    return output_file + index_suffix_
+
+def _jsonable(obj):
+    # tuples become lists, as they would after a round trip through JSON
+    return json.loads(json.dumps(obj))
+
+
+class MergeIndex(object):
+    # files: [{"path": ..., "state": [size, mtime], "gccodes": [...], "db": bool}, ...]
+    #   in order of precedence, the last file wins
+    # waypoints: [[gccode, path, md5, offset, length, lat, lon], ...] in output order
+    def __init__(self, settings):
+        self.settings = _jsonable(settings)
+        self.files = []
+        self.waypoints = []
+        self.output_state = None
+
+    def addFile(self, path, gccodes, db=False):
+        self.files.append({"path": path, "state": fileState(path), "gccodes": list(gccodes), "db": db})
+
+    def addWaypoint(self, gccode, path, xmlhash, offset, length, lat, lon):
+        self.waypoints.append([gccode, path, xmlhash, offset, length,
+            None if lat != lat else lat, None if lon != lon else lon])
+
+    def matches(self, settings, output_file):
+        # True if the index belongs to the output_file as it is on disk now
+        return self.settings == _jsonable(settings) and self.output_state is not None and self.output_state == fileState(output_file)
+
+    @classmethod
+    def load(cls, filename):
+        # None if there is no usable index
+        try:
+            with open(filename, "r") as fh:
+                data = json.load(fh)
+            if data.get("version") != index_version_:
+                return None
+            index = cls(data["settings"])
+            index.files = data["files"]
+            index.waypoints = data["waypoints"]
+            index.output_state = data["output"]
+            return index
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            return None
+
+    def save(self, filename, output_file):
+        self.output_state = fileState(output_file)
+        (fd, tmpname) = tempfile.mkstemp(prefix=".mergeindex", dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump({"version": index_version_, "settings": self.settings, "output": self.output_state,
+                    "files": self.files, "waypoints": self.waypoints}, fh, separators=(",", ":"))
+            gpxlib.replaceFile(tmpname, filename)
+        except:
+            os.unlink(tmpname)
+            raise
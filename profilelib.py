@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# --profile FILE and --trace-memory for all gctools entry points.
+#   profilelib.start(profile_file, trace_memory)
+# right after the options are parsed, the results are written at exit.
+# FILE gets pstats (python -m pstats FILE, snakeviz, ...) or, if it ends in
+# .folded or .collapsed, sampled stacks in the collapsed format of
+# flamegraph.pl / speedscope. --trace-memory prints the tracemalloc peak and
+# the lines holding the most memory at that peak to stderr (python2 only has
+# the peak RSS).
+# Pools created with Pool(..., **profilelib.poolArgs(initializer, initargs))
+# profile their workers as well, their results are added to the parent's.
+
+from __future__ import print_function
+import os
+import sys
+import json
+import atexit
+import fnmatch
+import shutil
+import tempfile
+import threading
+
+collapsed_extensions_ = (".folded", ".collapsed")
+sample_interval_ = 0.005
+top_allocators_ = 15
+peak_interval_ = 0.05
+snapshot_switch_interval_ = 60.0
+# a new peak snapshot is taken once the traced memory grew by this factor
+peak_growth_ = 1.1
+
+# the running session of this process, None if there is nothing to do
+_session = None
+
+
+def _mib(size):
+    return size / 1024.0 / 1024.0
+
+def _peakRSS():
+    # peak resident memory of this process in bytes, None where unknown
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StackSampler(object):
+    # samples the stacks of all other threads every interval seconds,
+    # counts holds {"outer;...;inner": number of samples}
+    def __init__(self, interval=sample_interval_):
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profilelib-sampler")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        me = threading.current_thread().ident
+        while not self.stopped.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class PeakSnapshots(object):
+    # takes a tracemalloc snapshot whenever the traced memory reaches a new
+    # peak, top holds the lines that allocated the most at the last one.
+    # A snapshot is traced itself and would raise the peak, so peak keeps the
+    # highest peak seen before a snapshot and the peak is reset after it
+    # (python 3.9 and later, before that the peak includes the snapshots).
+    def __init__(self, tracemalloc, interval=peak_interval_):
+        self.tracemalloc = tracemalloc
+        self.interval = interval
+        self.size = 0
+        self.peak = 0
+        self.top = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profilelib-peak")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        (current, peak) = self.tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        if current <= self.size * peak_growth_:
+            return
+        tm = self.tracemalloc
+        # without the allocations of imports and of the profiler itself, like
+        # tm.Filter but on the lines of the statistics instead of every trace
+        excluded = ["<frozen importlib._bootstrap*>", "<unknown>"] + \
+            [m.__file__ for m in (tm, sys.modules[__name__], sys.modules.get("cProfile"), sys.modules.get("profile")) if m is not None]
+        # other threads must not allocate while the snapshot is taken, or their
+        # peak would be reset along with the one of the snapshot
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(snapshot_switch_interval_)
+        try:
+            self.peak = max(self.peak, tm.get_traced_memory()[1])
+            stats = tm.take_snapshot().statistics("lineno")
+            stats = [stat for stat in stats if not [p for p in excluded if fnmatch.fnmatch(stat.traceback[0].filename, p)]]
+            self.top = [["%s:%d" % (stat.traceback[0].filename, stat.traceback[0].lineno), stat.size, stat.count] for stat in stats[:top_allocators_ * 4]]
+            self.size = current
+            del stats
+            if hasattr(tm, "reset_peak"):
+                tm.reset_peak()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        # the memory at exit may be the highest
+        self.check()
+
+
+class ProfileSession(object):
+    def __init__(self, profile_file=None, trace_memory=False, worker_dir=None):
+        self.profile_file = profile_file
+        self.trace_memory = trace_memory
+        self.collapsed = profile_file is not None and profile_file.endswith(collapsed_extensions_)
+        # workers leave their results here, only the parent has own_worker_dir
+        self.own_worker_dir = worker_dir is None
+        self.worker_dir = worker_dir if worker_dir is not None else tempfile.mkdtemp(prefix="gctools-profile-")
+        self.profiler = None
+        self.sampler = None
+        self.tracemalloc = None
+        self.peaks = None
+
+    def settings(self):
+        return (self.profile_file, self.trace_memory, self.worker_dir)
+
+    def start(self):
+        if self.trace_memory:
+            try:
+                import tracemalloc
+                self.tracemalloc = tracemalloc
+                tracemalloc.start()
+                self.peaks = PeakSnapshots(tracemalloc)
+                self.peaks.start()
+            except ImportError:
+                if self.own_worker_dir:
+                    print("WARNING: tracemalloc needs python3, --trace-memory only reports the peak RSS", file=sys.stderr)
+        if self.profile_file is not None:
+            if self.collapsed:
+                self.sampler = StackSampler()
+                self.sampler.start()
+            else:
+                import cProfile
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        memory = None
+        if self.trace_memory:
+            memory = {"rss_peak": _peakRSS(), "peak": None, "top": [], "top_at": None}
+            if self.tracemalloc is not None:
+                self.peaks.stop()
+                memory["peak"] = max(self.peaks.peak, self.tracemalloc.get_traced_memory()[1])
+                memory["top"] = self.peaks.top
+                memory["top_at"] = self.peaks.size
+                self.tracemalloc.stop()
+        return memory
+
+    def writeWorkerResults(self, memory):
+        # called in a worker at its exit
+        name = os.path.join(self.worker_dir, "worker-%d" % os.getpid())
+        if self.profiler is not None:
+            self.profiler.dump_stats(name + ".pstats")
+        if self.sampler is not None:
+            with open(name + ".folded.json", "w") as fh:
+                json.dump(self.sampler.counts, fh)
+        if memory is not None:
+            with open(name + ".memory.json", "w") as fh:
+                json.dump(memory, fh)
+
+    def _workerResults(self, suffix):
+        return sorted([os.path.join(self.worker_dir, fn) for fn in os.listdir(self.worker_dir) if fn.endswith(suffix)])
+
+    def writeResults(self, memory):
+        # called in the parent at exit, adds up the results of all workers
+        if self.profiler is not None:
+            import pstats
+            stats = pstats.Stats(self.profiler)
+            workers = self._workerResults(".pstats")
+            for filename in workers:
+                stats.add(filename)
+            stats.dump_stats(self.profile_file)
+            print("profile written to %s%s" % (self.profile_file, " (including %d worker processes)" % len(workers) if workers else ""), file=sys.stderr)
+        if self.sampler is not None:
+            counts = dict(self.sampler.counts)
+            workers = self._workerResults(".folded.json")
+            for filename in workers:
+                with open(filename) as fh:
+                    for (stack, count) in json.load(fh).items():
+                        counts[stack] = counts.get(stack, 0) + count
+            with open(self.profile_file, "w") as fh:
+                for (stack, count) in sorted(counts.items()):
+                    fh.write("%s %d\n" % (stack, count))
+            print("%d stack samples written to %s%s" % (sum(counts.values()), self.profile_file, " (including %d worker processes)" % len(workers) if workers else ""), file=sys.stderr)
+        if memory is not None:
+            workers = []
+            for filename in self._workerResults(".memory.json"):
+                with open(filename) as fh:
+                    workers.append(json.load(fh))
+            printMemoryReport(memory, workers)
+
+    def workerStop(self):
+        self.writeWorkerResults(self.stop())
+
+    def parentStop(self):
+        try:
+            self.writeResults(self.stop())
+        finally:
+            shutil.rmtree(self.worker_dir, True)
+
+
+def printMemoryReport(memory, workers=[]):
+    out = sys.stderr
+    if memory["peak"] is not None:
+        print("tracemalloc peak: %.1f MiB" % _mib(memory["peak"]), file=out)
+    if memory["rss_peak"] is not None:
+        print("peak RSS: %.1f MiB" % _mib(memory["rss_peak"]), file=out)
+    if workers:
+        peaks = [w["peak"] for w in workers if w["peak"] is not None]
+        if peaks:
+            print("tracemalloc peak of %d worker processes: %.1f MiB max, %.1f MiB total" % (len(workers), _mib(max(peaks)), _mib(sum(peaks))), file=out)
+    # held at the peak snapshot, by line, added up over the parent and all workers
+    top = {}
+    for m in [memory] + workers:
+        for (line, size, count) in m["top"]:
+            (old_size, old_count) = top.get(line, (0, 0))
+            top[line] = (old_size + size, old_count + count)
+    if top:
+        if workers:
+            print("top allocations at the peak of each process:", file=out)
+        else:
+            print("top allocations at the peak (peak snapshot of %.1f MiB):" % _mib(memory["top_at"]), file=out)
+        for (line, (size, count)) in sorted(top.items(), key=lambda item: -item[1][0])[:top_allocators_]:
+            print("  %10.1f KiB %8d blocks  %s" % (size / 1024.0, count, line), file=out)
+
+
+def start(profile_file=None, trace_memory=False):
+    # starts profiling this process and writes the results at exit
+    global _session
+    if profile_file is None and not trace_memory:
+        return
+    _session = ProfileSession(profile_file, trace_memory)
+    _session.start()
+    atexit.register(_session.parentStop)
+
+def _initWorker(settings, initializer, initargs):
+    global _session
+    # a forked worker inherits the parent's session, it starts its own.
+    # Since python 3.12 cProfile no longer uses sys.setprofile, the inherited
+    # profiler has to be disabled or enabling a new one fails.
+    if _session is not None:
+        if _session.profiler is not None:
+            _session.profiler.disable()
+        if _session.sampler is not None:
+            _session.sampler.stopped.set()
+    sys.setprofile(None)
+    tracemalloc = sys.modules.get("tracemalloc")
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if settings is not None:
+        _session = ProfileSession(*settings)
+        _session.start()
+        import multiprocessing.util
+        # atexit handlers do not run in pool workers, finalizers do (unless the pool is terminated)
+        multiprocessing.util.Finalize(None, _session.workerStop, exitpriority=100)
+    if initializer is not None:
+        initializer(*initargs)
+
+def poolArgs(initializer=None, initargs=()):
+    # initializer and initargs for multiprocessing.Pool that also profile the workers
+    if _session is None:
+        return {"initializer": initializer, "initargs": initargs}
+    return {"initializer": _initWorker, "initargs": (_session.settings(), initializer, initargs)}
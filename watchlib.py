@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Watches directories for new, changed and deleted files.
+# On Linux inotify is used (through ctypes, no extra module needed), elsewhere
+# the directories are polled. Either way a burst of events only ends the wait
+# once no file changed for `settle` seconds, then the directories are compared
+# with the last snapshot, so the result is the same for both methods.
+
+from __future__ import print_function
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from collections import namedtuple
+from filelib import fileState
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+watch_mask_ = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+event_header_ = struct.Struct("iIII")
+
+# sets of paths, see DirectoryWatcher.wait
+WatchChanges = namedtuple("WatchChanges", ["changed", "deleted"])
+
+
+def _fsdecode(name):
+    if isinstance(name, str):
+        return name
+    return name.decode(sys.getfilesystemencoding() or "utf-8", "replace")
+
+class Inotify(object):
+    # minimal inotify binding, raises OSError where inotify is not available
+    def __init__(self, dirs):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            (init1, add_watch) = (libc.inotify_init1, libc.inotify_add_watch)
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify not available")
+        self.fd = init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        for d in dirs:
+            path = os.path.abspath(d)
+            wd = add_watch(self.fd, path.encode(sys.getfilesystemencoding() or "utf-8") if not isinstance(path, bytes) else path, watch_mask_)
+            if wd < 0:
+                err = ctypes.get_errno()
+                self.close()
+                raise OSError(err, "inotify_add_watch %s failed" % d)
+            self.dirs[wd] = d
+
+    def read(self, timeout=None):
+        # paths of the files events arrived for within timeout seconds,
+        # None in the list means events were lost and everything has to be checked
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]:
+                return []
+            raise
+        paths = []
+        pos = 0
+        while pos + event_header_.size <= len(data):
+            (wd, mask, cookie, length) = event_header_.unpack_from(data, pos)
+            name = data[pos + event_header_.size:pos + event_header_.size + length].rstrip(b"\0")
+            pos += event_header_.size + length
+            if mask & IN_Q_OVERFLOW:
+                paths.append(None)
+            elif wd in self.dirs and name:
+                paths.append(os.path.join(self.dirs[wd], _fsdecode(name)))
+        return paths
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class DirectoryWatcher(object):
+    # watcher = DirectoryWatcher(["~/pq"], accept=lambda path: path.endswith(".gpx"))
+    # while True:
+    #     changes = watcher.wait()
+    # Files present when the watcher is created count as known. Hidden files
+    # (e.g. temp files of atomic writes) are never reported.
+    def __init__(self, dirs, accept=None, settle=10.0, poll_interval=None):
+        self.dirs = list(dirs)
+        self.accept = accept
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.inotify = None
+        if poll_interval is None:
+            try:
+                self.inotify = Inotify(self.dirs)
+            except OSError:
+                self.poll_interval = 30.0
+        self.snapshot = self.scan()
+
+    @property
+    def method(self):
+        return "inotify" if self.inotify is not None else "polling every %gs" % self.poll_interval
+
+    def scan(self):
+        # {path: [size, mtime]} of every accepted file
+        states = {}
+        for d in self.dirs:
+            try:
+                names = os.listdir(d)
+            except OSError:
+                continue
+            for fn in names:
+                path = os.path.join(d, fn)
+                if fn.startswith(".") or (self.accept is not None and not self.accept(path)):
+                    continue
+                state = fileState(path)
+                if state is not None and os.path.isfile(path):
+                    states[path] = state
+        return states
+
+    def refresh(self, paths):
+        # take the current state of paths as known, e.g. after rewriting them
+        # ourselves, so the next wait() does not report them
+        for path in paths:
+            state = fileState(path)
+            if state is None:
+                self.snapshot.pop(path, None)
+            else:
+                self.snapshot[path] = state
+
+    def _diff(self, states):
+        changed = set([p for (p, s) in states.items() if self.snapshot.get(p) != s])
+        deleted = set(self.snapshot) - set(states)
+        return WatchChanges(changed, deleted)
+
+    def _events(self, timeout):
+        # True if something may have changed within timeout seconds
+        if self.inotify is not None:
+            return len([p for p in self.inotify.read(timeout) if p is None or self.accept is None or self.accept(p)]) > 0
+        time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+        return self.scan() != self.snapshot
+
+    def wait(self, timeout=None):
+        # blocks until files changed and then settled, returns WatchChanges,
+        # or None if nothing changed within timeout seconds
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not self._events(remaining):
+                if deadline is not None and time.time() >= deadline:
+                    return None
+                continue
+            # coalesce the burst: wait until nothing happened for settle seconds
+            states = self.scan()
+            while True:
+                if self.inotify is not None:
+                    while self._events(self.settle):
+                        pass
+                else:
+                    time.sleep(self.settle)
+                new_states = self.scan()
+                if new_states == states:
+                    break
+                states = new_states
+            changes = self._diff(states)
+            self.snapshot = states
+            if changes.changed or changes.deleted:
+                return changes
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
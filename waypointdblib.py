@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Local waypoint database, so tools do not have to re-parse the same big
+# pocketqueries over and over again.
+# One row per gccode with coordinates, the most useful cache attributes and
+# the zlib compressed <wpt> XML. Coordinates are indexed with an SQLite R-tree.
+
+from __future__ import print_function
+import os
+import math
+import time
+import zlib
+import sqlite3
+from hashlib import md5
+from lxml import etree
+import gpxlib
+
+default_db_file_ = os.path.join(os.path.expanduser('~'),".local","share","gctools","waypoints.sqlite")
+earth_radius_km_ = 6371.0088
+sqlite_max_variables_ = 500
+
+schema_ = [
+    """CREATE TABLE IF NOT EXISTS waypoints (
+        id INTEGER PRIMARY KEY,
+        gccode TEXT UNIQUE NOT NULL,
+        lat REAL, lon REAL,
+        name TEXT, type TEXT, cachetype TEXT, container TEXT,
+        difficulty REAL, terrain REAL,
+        available INTEGER, archived INTEGER,
+        url TEXT,
+        hash TEXT NOT NULL,
+        source TEXT,
+        updated REAL,
+        xml BLOB NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS waypoints_latlon ON waypoints (lat, lon)",
+    "CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, uri TEXT NOT NULL)",
+]
+rtree_schema_ = "CREATE VIRTUAL TABLE IF NOT EXISTS waypoints_rtree USING rtree(id, minlat, maxlat, minlon, maxlon)"
+
+
+def _float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+def _bool(text):
+    if text is None:
+        return None
+    return 1 if text.strip().lower() == "true" else 0
+
+def _childText(elem, name):
+    child = gpxlib.findGroundspeakChild(elem, name)
+    return child.text.strip() if child is not None and child.text else None
+
+def _chunks(lst, size=sqlite_max_variables_):
+    for i in range(0, len(lst), size):
+        yield lst[i:i+size]
+
+def _distanceKm(lat1, lon1, lat2, lon2):
+    (lat1, lon1, lat2, lon2) = [math.radians(x) for x in (lat1, lon1, lat2, lon2)]
+    a = math.sin((lat2 - lat1) / 2.0) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * earth_radius_km_ * math.asin(min(1.0, math.sqrt(a)))
+
+
+class WaypointDB(object):
+    def __init__(self, filename=None):
+        self.filename = filename or default_db_file_
+        dbdir = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(dbdir):
+            os.makedirs(dbdir)
+        self.conn = sqlite3.connect(self.filename)
+        for stmt in schema_:
+            self.conn.execute(stmt)
+        try:
+            self.conn.execute(rtree_schema_)
+            self.has_rtree = True
+        except sqlite3.OperationalError:
+            # sqlite built without R-tree module, fall back to the lat/lon index
+            self.has_rtree = False
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.conn.rollback()
+        self.close()
+        return False
+
+    def nsmap(self):
+        return dict([(prefix or None, uri) for (prefix, uri) in self.conn.execute("SELECT prefix, uri FROM namespaces")])
+
+    def hashes(self):
+        return dict(self.conn.execute("SELECT gccode, hash FROM waypoints"))
+
+    def _store(self, wpt, xml, xmlhash, source, rowid=None):
+        cache = wpt.cache
+        row = (wpt.code, wpt.lat, wpt.lon, wpt.name, wpt.type,
+            _childText(cache, "type"), _childText(cache, "container"),
+            _float(_childText(cache, "difficulty")), _float(_childText(cache, "terrain")),
+            _bool(cache.get("available")) if cache is not None else None,
+            _bool(cache.get("archived")) if cache is not None else None,
+            wpt.url, xmlhash, source, time.time(), sqlite3.Binary(zlib.compress(xml)))
+        if rowid is None:
+            rowid = self.conn.execute("INSERT INTO waypoints (gccode, lat, lon, name, type, cachetype, container, difficulty, terrain, available, archived, url, hash, source, updated, xml) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", row).lastrowid
+        else:
+            self.conn.execute("UPDATE waypoints SET gccode=?, lat=?, lon=?, name=?, type=?, cachetype=?, container=?, difficulty=?, terrain=?, available=?, archived=?, url=?, hash=?, source=?, updated=?, xml=? WHERE id=?", row + (rowid,))
+        if self.has_rtree:
+            if wpt.lat is None or wpt.lon is None:
+                self.conn.execute("DELETE FROM waypoints_rtree WHERE id=?", (rowid,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO waypoints_rtree VALUES (?,?,?,?,?)", (rowid, wpt.lat, wpt.lat, wpt.lon, wpt.lon))
+        return rowid
+
+    def ingest(self, gpxfile):
+        # upserts every waypoint of gpxfile whose XML differs from the stored one
+        # returns (number of new, number of updated, number of unchanged waypoints)
+        (new, updated, unchanged) = (0, 0, 0)
+        reader = gpxlib.GPXReader(gpxfile)
+        source = os.path.basename(gpxfile)
+        try:
+            for wpt in reader:
+                if not wpt.code:
+                    continue
+                xml = etree.tostring(wpt.elem, encoding="utf-8", xml_declaration=False, with_tail=False)
+                xmlhash = md5(xml).hexdigest()
+                stored = self.conn.execute("SELECT id, hash FROM waypoints WHERE gccode=?", (wpt.code,)).fetchone()
+                if stored is None:
+                    self._store(wpt, xml, xmlhash, source)
+                    new += 1
+                elif stored[1] != xmlhash:
+                    self._store(wpt, xml, xmlhash, source, stored[0])
+                    updated += 1
+                else:
+                    unchanged += 1
+            for (prefix, uri) in reader.nsmap.items():
+                self.conn.execute("INSERT OR IGNORE INTO namespaces VALUES (?,?)", (prefix or "", uri))
+        except:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return (new, updated, unchanged)
+
+    def query(self, bbox=None, center=None, radius_km=None, codes=None, details=False):
+        # returns [(id, gccode, lat, lon), ...] in gccode order, with details=True
+        # [(id, gccode, lat, lon, difficulty, terrain, cachetype, container), ...]
+        # bbox = (minlat, minlon, maxlat, maxlon), center = (lat, lon)
+        where = []
+        params = []
+        if center is not None and radius_km is not None:
+            dlat = math.degrees(radius_km / earth_radius_km_)
+            coslat = math.cos(math.radians(center[0]))
+            dlon = 180.0 if coslat < 1e-6 else min(180.0, dlat / coslat)
+            circle_bbox = (center[0] - dlat, center[1] - dlon, center[0] + dlat, center[1] + dlon)
+            if bbox is None:
+                bbox = circle_bbox
+            else:
+                bbox = (max(bbox[0], circle_bbox[0]), max(bbox[1], circle_bbox[1]), min(bbox[2], circle_bbox[2]), min(bbox[3], circle_bbox[3]))
+        if bbox is not None:
+            if self.has_rtree:
+                where.append("w.id IN (SELECT id FROM waypoints_rtree WHERE minlat>=? AND maxlat<=? AND minlon>=? AND maxlon<=?)")
+                params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+            else:
+                where.append("w.lat BETWEEN ? AND ? AND w.lon BETWEEN ? AND ?")
+                params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+        sql = "SELECT w.id, w.gccode, w.lat, w.lon%s FROM waypoints w" % (", w.difficulty, w.terrain, w.cachetype, w.container" if details else "") + (" WHERE " + " AND ".join(where) if where else "")
+        if codes is not None:
+            codes = list(codes)
+            rows = []
+            for chunk in _chunks(codes):
+                rows += self.conn.execute(sql + (" AND " if where else " WHERE ") + "w.gccode IN (%s)" % ",".join("?" * len(chunk)), params + chunk).fetchall()
+        else:
+            rows = self.conn.execute(sql, params).fetchall()
+        if center is not None and radius_km is not None:
+            rows = [r for r in rows if _distanceKm(r[2], r[3], center[0], center[1]) <= radius_km]
+        rows.sort(key=lambda r: r[1])
+        return rows
+
+    def iterXML(self, ids):
+        # yields (id, serialized <wpt>) in the order of ids
+        for chunk in _chunks(list(ids)):
+            xmls = dict(self.conn.execute("SELECT id, xml FROM waypoints WHERE id IN (%s)" % ",".join("?" * len(chunk)), chunk))
+            for rowid in chunk:
+                if rowid in xmls:
+                    yield (rowid, zlib.decompress(xmls[rowid]))
+
+    def iterWaypoints(self, ids):
+        # gpxlib.Waypoint records, Waypoint.elem is a standalone copy of the stored <wpt>
+        for (rowid, xml) in self.iterXML(ids):
+            yield gpxlib.makeWaypoint(etree.fromstring(xml))
+
+    def update(self, elem):
+        # store a (modified) <wpt> element again
+        wpt = gpxlib.makeWaypoint(elem)
+        xml = etree.tostring(elem, encoding="utf-8", xml_declaration=False, with_tail=False)
+        stored = self.conn.execute("SELECT id, source FROM waypoints WHERE gccode=?", (wpt.code,)).fetchone()
+        if stored is None:
+            return self._store(wpt, xml, md5(xml).hexdigest(), None)
+        return self._store(wpt, xml, md5(xml).hexdigest(), stored[1], stored[0])
+
+    def delete(self, codes):
+        ids = [r[0] for r in self.query(codes=codes)]
+        for chunk in _chunks(ids):
+            marks = ",".join("?" * len(chunk))
+            self.conn.execute("DELETE FROM waypoints WHERE id IN (%s)" % marks, chunk)
+            if self.has_rtree:
+                self.conn.execute("DELETE FROM waypoints_rtree WHERE id IN (%s)" % marks, chunk)
+        self.conn.commit()
+        return len(ids)
+
+    def exportGPX(self, output, ids, creator="gctools"):
+        nsmap = self.nsmap() or None
+        with gpxlib.GPXWriter(output, nsmap, {"version":"1.0", "creator":creator}) as writer:
+            for (rowid, xml) in self.iterXML(ids):
+                writer.writeXML(xml)
+            return writer.count
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Declarative rules that adapt waypoints for a device, e.g. older Garmins
+# that show <cmt> instead of <desc> and only know a few symbols.
+# A rules file is JSON:
+#   {
+#     "move": {"desc": "cmt"},
+#     "truncate": {"cmt": 80, "groundspeak:encoded_hints": 200},
+#     "symbols": [
+#       {"type": "Multi-cache", "sym_is": "Geocache", "sym": "Stadium"},
+#       {"attribute": "Wheelchair accessible", "sym": "Wheelchair"},
+#       {"container": "Micro", "sym": "Pin, Blue"}
+#     ]
+#   }
+# "move" renames a GPX child of <wpt> (if the target exists, the text is
+# appended to it on a new line),
+# "truncate" cuts the text of a GPX child or, with the groundspeak: prefix, of
+# a child of <groundspeak:cache> to at most n characters, and the first
+# matching entry of "symbols" sets <sym>. A symbol rule has one of type,
+# container and attribute and/or sym_is (the current <sym>), all of them have
+# to match. Attributes match by name or id and only if they are set, i.e. not
+# inc="0". The rules are applied in this order.
+# WaypointRules checks the file once, apply() is then called for every <wpt>.
+
+from __future__ import print_function
+import json
+from hashlib import md5
+import gpxlib
+
+# for older Garmins like the former gc_gpx_garmin.sed, found multis keep
+# "Geocache Found". Where sed left two <cmt>, their texts are joined.
+builtin_rules_ = {
+    "garmin": {
+        "move": {"desc": "cmt"},
+        "symbols": [{"type": "Multi-cache", "sym_is": "Geocache", "sym": "Stadium"}],
+    },
+}
+symbol_conditions_ = ["type", "container", "attribute"]
+groundspeak_prefix_ = "groundspeak:"
+
+
+def _children(elem, name):
+    if name.startswith(groundspeak_prefix_):
+        cache = gpxlib.findGroundspeakChild(elem, "cache")
+        name = name[len(groundspeak_prefix_):]
+        return [child for child in (cache if cache is not None else []) if gpxlib.isGroundspeakTag(child.tag, name)]
+    return [child for child in elem if gpxlib.isGPXTag(child.tag, name)]
+
+def _gpxTag(elem, name):
+    # <name> in the GPX namespace of elem
+    tag = elem.tag
+    if tag.startswith("{"):
+        return tag[:tag.find("}") + 1] + name
+    return name
+
+def cacheType(elem):
+    # "Multi-cache" from <type>Geocache|Multi-cache</type> or <groundspeak:type>
+    for child in _children(elem, "type"):
+        text = (child.text or u"").strip()
+        if text.startswith(u"Geocache|"):
+            return text[len(u"Geocache|"):]
+    for child in _children(elem, "groundspeak:type"):
+        return (child.text or u"").strip()
+    return None
+
+def cacheAttributes(elem):
+    # set of lower case names and ids of the attributes that are set
+    attributes = set()
+    found = _children(elem, "groundspeak:attributes")
+    for child in (found[0] if found else []):
+        if gpxlib.isGroundspeakTag(child.tag, "attribute") and child.get("inc", "1").strip() != "0":
+            attributes.add((child.text or u"").strip().lower())
+            if child.get("id"):
+                attributes.add(child.get("id").strip())
+    return attributes
+
+
+class WaypointRules(object):
+    # rules = WaypointRules(loadRulesSpec("garmin"))
+    # changed = rules.apply(wpt_elem)
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError("rules have to be a JSON object")
+        unknown = set(spec) - set(["move", "truncate", "symbols"])
+        if unknown:
+            raise ValueError("unknown rules: %s" % ", ".join(sorted(unknown)))
+        self.spec = spec
+        self.moves = []
+        for (src, dst) in sorted(spec.get("move", {}).items()):
+            if src.startswith(groundspeak_prefix_) or dst.startswith(groundspeak_prefix_):
+                raise ValueError("move only works for GPX fields, not %s -> %s" % (src, dst))
+            self.moves.append((src, dst))
+        self.truncations = []
+        for (field, length) in sorted(spec.get("truncate", {}).items()):
+            if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+                raise ValueError("truncate %s: %r is no length" % (field, length))
+            self.truncations.append((field, length))
+        # ([(condition, lower case value), ...], symbol) in the order they are tried
+        self.symbols = []
+        for rule in spec.get("symbols", []):
+            conditions = [c for c in symbol_conditions_ if c in rule]
+            if "sym_is" in rule:
+                conditions.append("sym_is")
+            if not isinstance(rule.get("sym"), (type(""), type(u""))) or len(conditions) < 1 or len(rule) != len(conditions) + 1 \
+                    or len([c for c in conditions if c in symbol_conditions_]) > 1:
+                raise ValueError("symbol rule %s needs sym, one of %s and/or sym_is" % (json.dumps(rule), ", ".join(symbol_conditions_)))
+            self.symbols.append(([(c, (u"%s" % rule[c]).strip().lower()) for c in conditions], rule["sym"]))
+        self.need_attributes = len([c for (conditions, s) in self.symbols for (c, v) in conditions if c == "attribute"]) > 0
+
+    def digest(self):
+        # changes whenever the rules do, for the index of gpx_merge.py --incremental
+        return md5(json.dumps(self.spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def symbolFor(self, elem):
+        if not self.symbols:
+            return None
+        values = {"type": cacheType(elem), "container": None, "sym_is": None}
+        container = _children(elem, "groundspeak:container")
+        if container:
+            values["container"] = (container[0].text or u"").strip().lower()
+        syms = _children(elem, "sym")
+        if syms:
+            values["sym_is"] = (syms[0].text or u"").strip().lower()
+        if values["type"] is not None:
+            values["type"] = values["type"].lower()
+        attributes = cacheAttributes(elem) if self.need_attributes else set()
+        for (conditions, sym) in self.symbols:
+            if all([value in attributes if condition == "attribute" else values[condition] == value for (condition, value) in conditions]):
+                return sym
+        return None
+
+    def apply(self, elem):
+        # changes the <wpt> elem in place, returns True if anything changed
+        changed = False
+        for (src, dst) in self.moves:
+            sources = _children(elem, src)
+            if not sources:
+                continue
+            targets = _children(elem, dst)
+            if targets:
+                # e.g. the notes in <cmt> of additional waypoints, keep them
+                texts = [t for t in [targets[0].text, sources[0].text] if t]
+                targets[0].text = "\n".join(texts) if texts else None
+                elem.remove(sources[0])
+            else:
+                sources[0].tag = _gpxTag(elem, dst)
+            changed = True
+        for (field, length) in self.truncations:
+            for child in _children(elem, field):
+                if child.text is not None and len(child.text) > length:
+                    child.text = child.text[:length]
+                    changed = True
+        sym = self.symbolFor(elem)
+        if sym is not None:
+            syms = _children(elem, "sym")
+            if not syms:
+                syms = [elem.makeelement(_gpxTag(elem, "sym"), {})]
+                types = _children(elem, "type")
+                if types:
+                    previous = types[0].getprevious()
+                    syms[0].tail = previous.tail if previous is not None else elem.text
+                    types[0].addprevious(syms[0])
+                else:
+                    elem.append(syms[0])
+            if syms[0].text != sym:
+                syms[0].text = sym
+                changed = True
+        return changed
+
+
+def loadRulesSpec(name):
+    # name of a builtin rule set or of a JSON file
+    if name in builtin_rules_:
+        return builtin_rules_[name]
+    with open(name, "r") as fh:
+        return json.load(fh)
+
+def loadRules(name):
+    return WaypointRules(loadRulesSpec(name))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# (c) Bernhard Tittelbach <xro@gmx.net>
+# License: GPLv3, attribution is appreciated
+
+# Compact column store for large waypoint sets.
+# Only coordinates, D/T, cache type, container and gccode are kept, in numpy
+# arrays. For UTF-8 gpx files the <wpt> elements are found by scanning the
+# raw bytes and remembered as byte ranges, so the XML of a waypoint is only
+# read (and never re-serialized) when it is actually needed.
+
+from __future__ import print_function
+import re
+import sys
+import mmap
+from array import array
+from collections import namedtuple
+import numpy as np
+from lxml import etree
+import gpxlib
+
+# kind is "gpx" (byte ranges), "stream" (position in the file, parsed again
+# with GPXReader when needed) or "db" (WaypointDB row ids)
+WaypointSource = namedtuple("WaypointSource", ["kind", "name", "nsmap", "metainfo", "handle"])
+
+re_wpt_ = gpxlib.re_wpt_
+re_root_start_ = gpxlib.re_root_start_
+re_lat_ = gpxlib.re_wpt_lat_
+re_lon_ = gpxlib.re_wpt_lon_
+re_name_ = re.compile(br'<name>\s*([^<]*?)\s*</name>')
+re_difficulty_ = re.compile(br'<[\w.-]+:difficulty>\s*([^<]*?)\s*<')
+re_terrain_ = re.compile(br'<[\w.-]+:terrain>\s*([^<]*?)\s*<')
+re_cachetype_ = re.compile(br'<[\w.-]+:type>\s*([^<]*?)\s*<')
+re_container_ = re.compile(br'<[\w.-]+:container>\s*([^<]*?)\s*<')
+
+# (column, numpy dtype, array typecode used while a file is being read)
+# offsets are collected as doubles, which are exact up to 2**53 on every platform
+column_dtypes_ = [("lat", np.float64, "d"), ("lon", np.float64, "d"), ("difficulty", np.float32, "f"), ("terrain", np.float32, "f"),
+    ("cachetype", np.uint8, "B"), ("container", np.uint8, "B"), ("source", np.int16, "h"), ("ordinal", np.int64, "d"),
+    ("offset", np.int64, "d"), ("length", np.int32, "l")]
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    def _intern(s):
+        try:
+            return intern(str(s))
+        except (TypeError, UnicodeError):
+            return s
+
+def _float(m):
+    try:
+        return float(m.group(1))
+    except (AttributeError, ValueError):
+        return np.nan
+
+def _text(m):
+    return m.group(1).decode("utf-8") if m is not None else u""
+
+def _isElement(elem):
+    return isinstance(elem.tag, (type(""), type(u"")))
+
+def parseHeader(data, root_match, end):
+    # <name>, <desc>, ... between the <gpx> start tag and end, without <bounds>
+    header = data[root_match.end():end]
+    return [elem for elem in etree.fromstring(root_match.group(0) + header + b"</gpx>") if _isElement(elem) and not gpxlib.isGPXTag(elem.tag, "bounds")]
+
+
+class WaypointTable(object):
+    # Columns are numpy arrays: lat, lon, difficulty, terrain (NaN if unknown),
+    # cachetype, container (indices into self.cachetypes / self.containers),
+    # source (index into self.sources), ordinal (position in the gpx file or
+    # WaypointDB row id), offset and length (byte range, -1/0 if unknown).
+    # gccodes is a list of interned strings.
+    def __init__(self):
+        self.sources = []
+        self.gccodes = []
+        self.cachetypes = [u""]
+        self.containers = [u""]
+        self._category_index = [{u"": 0}, {u"": 0}]
+        for (name, dtype, typecode) in column_dtypes_:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+
+    def __len__(self):
+        return len(self.gccodes)
+
+    def _category(self, which, value):
+        (categories, index) = ((self.cachetypes, self._category_index[0]) if which == "cachetype" else (self.containers, self._category_index[1]))
+        if value not in index:
+            if len(categories) >= 256:
+                return 0
+            index[value] = len(categories)
+            categories.append(value)
+        return index[value]
+
+    def _newRows(self):
+        return dict([(name, array(typecode)) for (name, dtype, typecode) in column_dtypes_])
+
+    def _addRow(self, rows, gccode, lat, lon, difficulty, terrain, cachetype, container, source, ordinal, offset=-1, length=0):
+        self.gccodes.append(_intern(gccode))
+        for (name, value) in [("lat", lat), ("lon", lon), ("difficulty", difficulty), ("terrain", terrain),
+                ("cachetype", self._category("cachetype", cachetype)), ("container", self._category("container", container)),
+                ("source", source), ("ordinal", ordinal), ("offset", offset), ("length", length)]:
+            rows[name].append(value)
+
+    def _commitRows(self, rows):
+        for (name, dtype, typecode) in column_dtypes_:
+            setattr(self, name, np.concatenate((getattr(self, name), np.frombuffer(rows[name], dtype=rows[name].typecode).astype(dtype))))
+        return len(rows["lat"])
+
+    def addGPX(self, filename):
+        # returns the number of waypoints added
+        num_before = len(self.gccodes)
+        try:
+            return self._addGPX(filename)
+        except:
+            del self.gccodes[num_before:]
+            raise
+
+    def _addGPX(self, filename):
+        encoding = gpxlib.guessEncodingFromBOM(filename)
+        if encoding in ["utf_8", "utf_8_sig"]:
+            with open(filename, "rb") as fh:
+                try:
+                    data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    data = b""  # empty file
+                try:
+                    m = re_root_start_.search(data)
+                    if m is not None:
+                        root = etree.fromstring(m.group(0) + b"</gpx>")
+                        if root.nsmap.get(None, "").startswith(gpxlib.gpx_ns_prefix_[1:]):
+                            return self._scanGPX(filename, data, m, root)
+                finally:
+                    if data:
+                        data.close()
+        return self._streamGPX(filename)
+
+    def _scanGPX(self, filename, data, root_match, root):
+        source = len(self.sources)
+        rows = self._newRows()
+        first = None
+        for (ordinal, m) in enumerate(re_wpt_.finditer(data, root_match.end())):
+            if first is None:
+                first = m.start()
+            chunk = m.group(0)
+            start_tag = chunk[:chunk.find(b">")]
+            name = re_name_.search(chunk)
+            if name is None:
+                continue
+            self._addRow(rows, name.group(1).decode("utf-8"), _float(re_lat_.search(start_tag)), _float(re_lon_.search(start_tag)),
+                _float(re_difficulty_.search(chunk)), _float(re_terrain_.search(chunk)),
+                _text(re_cachetype_.search(chunk)), _text(re_container_.search(chunk)),
+                source, ordinal, m.start(), m.end() - m.start())
+        metainfo = parseHeader(data, root_match, first if first is not None else data.rfind(b"</gpx>"))
+        self.sources.append(WaypointSource("gpx", filename, dict(root.nsmap), metainfo, root_match.group(0)))
+        return self._commitRows(rows)
+
+    def _streamGPX(self, filename):
+        source = len(self.sources)
+        reader = gpxlib.GPXReader(filename)
+        rows = self._newRows()
+        for (ordinal, wpt) in enumerate(reader):
+            if wpt.code is None:
+                continue
+            difficulty = gpxlib.findGroundspeakChild(wpt.cache, "difficulty")
+            terrain = gpxlib.findGroundspeakChild(wpt.cache, "terrain")
+            cachetype = gpxlib.findGroundspeakChild(wpt.cache, "type")
+            container = gpxlib.findGroundspeakChild(wpt.cache, "container")
+            self._addRow(rows, wpt.code, wpt.lat if wpt.lat is not None else np.nan, wpt.lon if wpt.lon is not None else np.nan,
+                float(difficulty.text) if difficulty is not None and difficulty.text else np.nan,
+                float(terrain.text) if terrain is not None and terrain.text else np.nan,
+                (cachetype.text or u"").strip() if cachetype is not None else u"",
+                (container.text or u"").strip() if container is not None else u"",
+                source, ordinal)
+        self.sources.append(WaypointSource("stream", filename, reader.nsmap, reader.metainfo, None))
+        return self._commitRows(rows)
+
+    def addWaypointDB(self, db, bbox=None):
+        source = len(self.sources)
+        rows = self._newRows()
+        for (rowid, gccode, lat, lon, difficulty, terrain, cachetype, container) in db.query(bbox=bbox, details=True):
+            self._addRow(rows, gccode, lat if lat is not None else np.nan, lon if lon is not None else np.nan,
+                difficulty if difficulty is not None else np.nan, terrain if terrain is not None else np.nan,
+                cachetype or u"", container or u"", source, rowid)
+        self.sources.append(WaypointSource("db", db.filename, db.nsmap(), [], db))
+        return self._commitRows(rows)
+
+    def nsmap(self):
+        nsmap = {}
+        for src in self.sources:
+            nsmap.update(src.nsmap)
+        return nsmap
+
+    def metainfo(self):
+        # top-level elements other than <wpt> and <bounds>, the last file wins for each tag
+        metainfo = {}
+        for src in self.sources:
+            for elem in src.metainfo:
+                metainfo[elem.tag] = elem
+        return list(metainfo.values())
+
+    def deduplicate(self):
+        # indices of the last occurrence of every gccode, in the order gccodes were first seen
+        last = {}
+        for (i, gccode) in enumerate(self.gccodes):
+            last[gccode] = i
+        return np.fromiter(last.values(), dtype=np.int64, count=len(last))
+
+    def iterXML(self, indices):
+        # yields (index, serialized <wpt>) grouped by source and in file order.
+        # Byte ranges are returned as they are in the file, i.e. without any
+        # namespace declarations, everything else is serialized on its own
+        indices = np.asarray(indices, dtype=np.int64)
+        source = self.source[indices]
+        for (srcno, src) in enumerate(self.sources):
+            idx = indices[source == srcno]
+            if len(idx) == 0:
+                continue
+            idx = idx[np.argsort(self.ordinal[idx], kind="stable")]
+            if src.kind == "gpx":
+                with open(src.name, "rb") as fh:
+                    for i in idx.tolist():
+                        fh.seek(int(self.offset[i]))
+                        yield (i, fh.read(int(self.length[i])))
+            elif src.kind == "db":
+                by_rowid = dict(zip(self.ordinal[idx].tolist(), idx.tolist()))
+                for (rowid, xml) in src.handle.iterXML(self.ordinal[idx].tolist()):
+                    yield (by_rowid[rowid], xml)
+            else:
+                wanted = dict(zip(self.ordinal[idx].tolist(), idx.tolist()))
+                for (ordinal, wpt) in enumerate(gpxlib.GPXReader(src.name)):
+                    if ordinal in wanted:
+                        yield (wanted[ordinal], etree.tostring(wpt.elem, encoding="utf-8", xml_declaration=False, with_tail=False))
+
+    def sizes(self, indices):
+        # size in bytes of the serialized <wpt> of every index, waypoints
+        # that are not byte ranges have to be read to find out
+        indices = np.asarray(indices, dtype=np.int64)
+        sizes = self.length[indices].astype(np.int64)
+        unknown = np.flatnonzero(sizes == 0)
+        if len(unknown) > 0:
+            position = dict(zip(indices[unknown].tolist(), unknown.tolist()))
+            for (i, xml) in self.iterXML(indices[unknown]):
+                sizes[position[i]] = len(xml)
+        return sizes
+
+    def loadElement(self, index):
+        (i, xml) = next(self.iterXML([index]))
+        return self.parseXML(index, xml)
+
+    def parseXML(self, index, xml):
+        # the element of xml as returned by iterXML for index
+        src = self.sources[int(self.source[index])]
+        if src.kind == "gpx":
+            # give the byte range the namespace context of its file
+            return etree.fromstring(src.handle + xml + b"</gpx>")[0]
+        return etree.fromstring(xml)